@@ -0,0 +1,56 @@
+# Deferred imports for heavy third-party dependencies.
+# Importing gdal, pandas, terracotta, boto3, octvi, sqlalchemy and friends
+# takes several seconds, and most entry points (glaminfo, --help, argument
+# errors) never touch them. lazyImport() returns a stand-in that performs
+# the real import the first time any attribute is used.
+
+import importlib, threading, types
+
+
+class LazyModule(types.ModuleType):
+	"""Stand-in for a module that is imported on first attribute access"""
+
+	def __init__(self, name:str, on_load=None):
+		super().__init__(name)
+		self.__dict__['_lazy_module'] = None
+		self.__dict__['_lazy_on_load'] = on_load
+		self.__dict__['_lazy_lock'] = threading.RLock()
+
+	def _load(self) -> types.ModuleType:
+		module = self.__dict__['_lazy_module']
+		if module is None:
+			with self.__dict__['_lazy_lock']:
+				module = self.__dict__['_lazy_module']
+				if module is None:
+					module = importlib.import_module(self.__name__)
+					on_load = self.__dict__['_lazy_on_load']
+					if on_load is not None:
+						on_load(module)
+					self.__dict__['_lazy_module'] = module
+		return module
+
+	def __getattr__(self, attr):
+		return getattr(self._load(), attr)
+
+	def __dir__(self):
+		return dir(self._load())
+
+	def __repr__(self):
+		state = "loaded" if self.__dict__['_lazy_module'] is not None else "not yet loaded"
+		return f"<lazy module '{self.__name__}', {state}>"
+
+
+def lazyImport(name:str, on_load=None) -> LazyModule:
+	"""Returns a LazyModule for the named module
+
+	***
+
+	Parameters
+	----------
+	name:str
+		Full dotted name of module; e.g. "osgeo.osr"
+	on_load:function
+		Optional callback run once with the real module
+		immediately after it is imported
+	"""
+	return LazyModule(name, on_load)
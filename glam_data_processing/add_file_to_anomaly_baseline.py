@@ -1,17 +1,61 @@
+#! /usr/bin/env python
+
+"""
+This module adds a new product file to its anomaly baselines
+
+It can be run as a script on one file, as before, or called from
+another program with addFileToBaselines(). Passing in an executor lets
+a long-running caller such as updateData reuse one pool of worker
+processes for every file, rather than starting a new interpreter, a new
+database connection, and a new pool for each one.
+
+With --rebuild_all, every baseline of a product (every DOY, CHIRPS
+dekad, or SWI period) is rebuilt in one job instead; see
+baselines.rebuildAll().
+
+Baselines are written tiled and compressed under temporary names, their
+overviews built in parallel, and then moved into place together, so no
+cloud-optimizing rewrite is needed before they are ingested.
+
+***
+
+Functions
+---------
+getSwiBaselineDoy
+getInputPathList
+baselineNames
+cloud_optimize_inPlace
+anomaly_ingest
+optimize_and_ingest
+addFileToBaselines
+"""
+
 ## set up logging
 import logging, os
 logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger(__name__)
 
-import argparse, copy, copyreg, glob, multiprocessing, rasterio, shutil, subprocess, sys, types
-from collections import Counter
+import argparse, multiprocessing, sys
+from collections import Counter, deque
 from datetime import datetime
-from rasterio.windows import Window
-from rasterio.io import MemoryFile
-from functools import partial
-from octvi import supported_products
-import numpy as np
 import glam_data_processing.legacy as glam
+from glam_data_processing import catalog
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.cog import cloudOptimize, finalizeCogs
+from glam_data_processing.exceptions import BadInputError, UnavailableError
+
+octvi = lazyImport("octvi")
+rasterio = lazyImport("rasterio")
+rasterioWindows = lazyImport("rasterio.windows")
+kernels = lazyImport("glam_data_processing.kernels")
+runningsums = lazyImport("glam_data_processing.runningsums")
+stacks = lazyImport("glam_data_processing.stacks")
+planner = lazyImport("glam_data_processing.planner")
+baselines = lazyImport("glam_data_processing.baselines")
+
+BASELINE_ROOT = os.path.join("/gpfs","data1","cmongp2","GLAM","rasters","baselines")
+HORIZONS = (5, 10) # years per baseline, latest first; "full" uses every year
+BLOCKSIZE = 256 # window size unit when the input is not tiled; see planner.py
 
 
 def getSwiBaselineDoy(new_img:glam.Image) -> int:
@@ -21,43 +65,42 @@ def getSwiBaselineDoy(new_img:glam.Image) -> int:
 
 
 def getInputPathList(new_img:glam.Image) -> list:
+	return [r.path for r in _inputRecords(new_img)]
+
+
+def _inputRecords(new_img:glam.Image) -> list:
+	"""Returns the archive catalog Records of the files in new_img's baseline, latest first; see getInputPathList()"""
 	data_directory = os.path.dirname(new_img.path)
 	product = new_img.product
 	collection = new_img.collection
+	doy = new_img.doy
 	input_images = []
 
-	allFiles = glob.glob(os.path.join(data_directory,"*.tif"))
+	# names are parsed once, and kept in the archive catalog; skip files that are not well-formed images, for example intermediate images
+	allFiles = [r for r in catalog.records(data_directory) if r.product in glam.ancillary_products+octvi.supported_products]
 	if len(allFiles) < 1:
 		log.error(f"Failed to collect archive from {data_directory}")
 		return []
 
-	all_years = []
-
-	for f in allFiles:
-		try:
-			img = glam.getImageType(f)(f)
-		except: # not a well-formed image; for example; an intermediate image
-			continue
-		all_years = list(set(all_years+[str(img.year)]))
-		if product in supported_products+["merra-2"]:
-			# we can just use DOY for NDVI products and merra (since merra is daily)
-			output_doy = doy
-			if (img.doy == doy) and (img.collection == collection): # check that min/mean/max matches
-				input_images.append(img)
-		elif product == "swi":
-			output_doy = getSwiBaselineDoy(new_img)
-			if min(abs(int(img.doy)-output_doy),(output_doy-int(img.doy)) % 365) <= 2: # 'img' is the closest date from given year to eventual output date
-				input_images.append(img)
-		elif product == "chirps": # must be chirps
-			output_doy = new_image.date
-			if img.date.split("-")[1:] == new_image.date.split("-")[1:]: # tests that month and day are equal
-				input_images.append(img)
-		else:
-			log.error(f"Product {product} not recognized in getInputPathList()")
+	all_years = list(set(str(img.year) for img in allFiles))
 
-	# sort input_images
-	input_images.sort()
-	input_images.reverse()
+	# matching files come from indexed lookups
+	if product in octvi.supported_products+["merra-2"]:
+		# we can just use DOY for NDVI products and merra (since merra is daily)
+		output_doy = doy
+		input_images = catalog.records(data_directory,product=product,collection=collection,doy=int(doy)) # check that min/mean/max matches
+	elif product == "swi":
+		output_doy = getSwiBaselineDoy(new_img)
+		doys = [d for d in range(1,367) if min(abs(d-output_doy),(output_doy-d) % 365) <= 2] # each year's closest date to eventual output date
+		input_images = catalog.records(data_directory,product=product,doy=doys)
+	elif product == "chirps": # must be chirps
+		output_doy = new_img.date
+		input_images = catalog.records(data_directory,product=product,month_day=new_img.date[5:]) # tests that month and day are equal
+	else:
+		output_doy = None
+		log.error(f"Product {product} not recognized in getInputPathList()")
+
+	# records come sorted by date, latest first
 	input_paths = [i.path for i in input_images]
 	if len(input_paths) < len(all_years):
 		produced_years = [str(img.year) for img in input_images]
@@ -79,30 +122,41 @@ def getInputPathList(new_img:glam.Image) -> list:
 		err_str = err_str.strip(", ")
 		log.warning(err_str)
 
-	return input_paths
+	return input_images
 
 
-def cloud_optimize_inPlace(in_file:str) -> None:
-	"""Takes path to input and output file location. Reads tif at input location and writes cloud-optimized geotiff of same data to output location."""
-	## add overviews to file
-	cloudOpArgs = ["gdaladdo",in_file]
-	subprocess.call(cloudOpArgs)
+def baselineNames(new_img:glam.Image, horizons:tuple = HORIZONS) -> dict:
+	"""Returns {baseline type: output path} for the baselines that new_img belongs to; e.g. {'mean_5year': ...}"""
+	baseline_types = [f"{stat}_{baselines.horizonName(h)}" for h in horizons for stat in ("mean","median")]
+	product = new_img.product
+	doy = new_img.doy
 
-	## copy file
-	intermediate_file = in_file.replace(".tif",".TEMP.tif")
-	with open(intermediate_file,'wb') as a:
-		with open(in_file,'rb') as b:
-			shutil.copyfileobj(b,a)
+	# set baseline_locations
+	if "merra-2" in product:
+		sub_product = "merra-2-" + os.path.basename(new_img.path).split(".")[-2]
+	else:
+		sub_product = product
+	baseline_locations = {anomaly_type:os.path.join(BASELINE_ROOT,sub_product,anomaly_type) for anomaly_type in baseline_types}
 
-	## add tiling to file
-	cloudOpArgs = ["gdal_translate",intermediate_file,in_file,'-q','-co', "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', "COMPRESS=LZW", "-co", "PREDICTOR=2"]
-	if product in supported_products:
-		cloudOpArgs.append("-co")
-		cloudOpArgs.append("BIGTIFF=YES")
-	subprocess.call(cloudOpArgs)
+	# set output filenames
+	if (product in octvi.supported_products) or ("merra-2" in product): # can just use doy
+		output_date = doy
+		output_product = sub_product
+	elif product == "chirps":
+		output_date = new_img.date
+		output_product = product
+	elif product == "swi":
+		output_date = str(getSwiBaselineDoy(new_img)).zfill(3)
+		output_product = product
+	else:
+		raise BadInputError(f"Product {product} not recognized for output baseline file name generation")
+	return {anomaly_type:os.path.join(baseline_locations[anomaly_type], f"{output_product}.{output_date}.anomaly_{anomaly_type}.tif") for anomaly_type in baseline_types}
 
-	## remove intermediate
-	os.remove(intermediate_file)
+
+def cloud_optimize_inPlace(in_file:str) -> None:
+	"""Takes path to input and output file location. Reads tif at input location and writes cloud-optimized geotiff of same data to output location."""
+	product = os.path.basename(in_file).split(".")[0]
+	cloudOptimize(in_file,bigtiff=(product in octvi.supported_products))
 
 
 def anomaly_ingest(input_tuple:tuple) -> bool:
@@ -115,295 +169,267 @@ def anomaly_ingest(input_tuple:tuple) -> bool:
 def optimize_and_ingest(input_tuple:tuple):
 	f = input_tuple[0]
 	cloud_optimize_inPlace(f)
-	anomaly_ingest(input_tuple)
+	return anomaly_ingest(input_tuple)
 
-if __name__ == "__main__":
 
+def _getWindows(hnum:int, vnum:int, blocksize:int = BLOCKSIZE) -> list:
+	"""Returns rasterio windows of blocksize covering a raster of hnum x vnum pixels"""
+	windows = []
+	for hstart in range(0, hnum, blocksize):
+		for vstart in range(0, vnum, blocksize):
+			hwin = blocksize
+			vwin = blocksize
+			if ((hstart + blocksize) > hnum):
+				hwin = (hnum % blocksize)
+			if ((vstart + blocksize) > vnum):
+				vwin = (vnum % blocksize)
+			windows += [rasterioWindows.Window(hstart, vstart, hwin, vwin)]
+	return windows
+
+
+def _boundedMap(executor, func, iterable, in_flight:int):
+	"""Yields func(arg) for each arg in iterable, in order, keeping at most in_flight calls submitted to executor and not yet yielded
+
+	Executor.map and Pool.imap both queue every call at once, and hold
+	every result until it is read, so neither keeps to a memory budget.
+	executor may be a concurrent.futures.Executor or a multiprocessing.Pool.
+	"""
+	if hasattr(executor,"apply_async"): # multiprocessing.Pool
+		submit, result = (lambda arg: executor.apply_async(func,(arg,))), (lambda r: r.get())
+	else:
+		submit, result = (lambda arg: executor.submit(func,arg)), (lambda r: r.result())
+	pending = deque()
+	try:
+		for arg in iterable:
+			pending.append(submit(arg))
+			if len(pending) >= in_flight:
+				yield result(pending.popleft())
+		while pending:
+			yield result(pending.popleft())
+	finally:
+		# after a failure, don't start any calls still waiting
+		for r in pending:
+			if hasattr(r,"cancel"):
+				r.cancel()
+
+
+def _mp_serf(args:tuple) -> tuple:
+	"""Worker function for use with multiprocessing
+
+	Returns a tuple of targetwindow and outputstore;
+	outputstore holds a dictionary of calculated means/medians
+	for the targetwindow, with keys 'mean_<horizon>' and
+	'median_<horizon>' for each horizon; e.g.:
+		* mean_5year
+		* median_5year
+		* mean_10year
+		* median_10year
+
+	***
+
+	Parameters
+	----------
+	args:tuple
+		targetwindow:rasterio window
+		input_paths:list
+			Ordered list of filepaths
+		dtype:str
+		spans:dict
+			Years in each horizon, by name; e.g. {'5year':5, 'full':23}
+	"""
+	targetwindow, input_paths, dtype, spans = args
+	input_paths = input_paths[:max(spans.values())] # later years are not used
+
+	# read every year into one preallocated stack, latest first, through this worker's open datasets
+	stack = stacks.readStack(targetwindow, input_paths)
+	# every horizon comes from the one stack
+	means = kernels.horizonMeans(stack, list(spans.values()), dtype)
+	medians = kernels.horizonMedians(stack, list(spans.values()), dtype)
+	outputstore = {}
+	for name, years in spans.items():
+		outputstore[f'mean_{name}'] = means[years]
+		outputstore[f'median_{name}'] = medians[years]
+	return(targetwindow, outputstore)
+
+
+def addFileToBaselines(input_file:str, executor = None, n_workers:int = 20, incremental:bool = False, horizons:tuple = HORIZONS, memory_mb:int = None) -> tuple:
+	"""Recalculates the anomaly baselines that a new product file belongs to, and returns their paths
+
+	Raises UnavailableError if fewer than 10 matching files (or fewer than
+	the longest horizon) are in the archive next to input_file. Every
+	year needed is read once, and all horizons come from that one read.
+	With incremental=True, only the mean baselines are updated, from
+	stored running sums; see runningsums.py. The old baselines are only
+	replaced once every new one is complete. Windows are sized to fit a
+	memory budget; see planner.py.
+
+	***
+
+	Parameters
+	----------
+	input_file:str
+		Path to new file to be added to anomaly baselines
+	executor:concurrent.futures.Executor
+		Default None; pool of worker processes to use, which is left
+		running afterwards. A multiprocessing.Pool also works. If not set,
+		a pool of n_workers processes is created for this call alone
+	n_workers:int
+		Default 20; most workers to use, fewer if that many would not fit
+		in memory. This sizes the pool created when executor is not set;
+		with an executor, it should be the number of workers the executor
+		has. Either way, no more windows are submitted at once than the
+		planned workers can hold within the memory budget
+	incremental:bool
+		Default False; whether to update only the mean baselines, adding
+		the new year to stored sums and removing the year that dropped out
+	horizons:tuple
+		Default (5, 10); numbers of years to build baselines over, latest
+		first. "full" uses every year in the archive
+	memory_mb:int
+		Default None; memory budget in MiB. See planner.memoryBudget()
+	"""
 	startTime = datetime.now()
 
+	log.debug("Parsing input image")
+	new_image = glam.getImageType(input_file)(input_file)
+	names = baselineNames(new_image,horizons)
+	sub_product = os.path.basename(next(iter(names.values()))).split(".")[0]
+
+	# get input paths
+	input_records = _inputRecords(new_image)
+	input_paths = [r.path for r in input_records]
+	if len(input_paths) < max([10] + [h for h in horizons if h != "full"]):
+		raise UnavailableError(f"Only {len(input_paths)} input image paths found for {input_file}")
+	# years in each horizon, by name
+	spans = {baselines.horizonName(h):(len(input_paths) if h == "full" else h) for h in horizons}
+
+	# get input raster metadata and dimensions
+	with rasterio.open(new_image.path) as getmeta:
+		metaprofile = getmeta.profile
+		hnum = getmeta.width
+		vnum = getmeta.height
+
+	if incremental:
+		names = {k:v for k, v in names.items() if k.startswith("mean_")}
+
+	# size windows and workers to fit in memory
+	pixel_bytes = planner.baselinePixelBytes(max(spans.values()),metaprofile['dtype'],len(names))
+	plan = planner.planWindows(hnum,vnum,pixel_bytes,n_workers,native_block=planner.nativeBlock(metaprofile,default=BLOCKSIZE),budget_mb=memory_mb)
+	windows = _getWindows(hnum,vnum,plan.blocksize)
+
+	# write tiled and compressed, one tile per window where the window size allows; BIGTIFF where necessary
+	outprofile = baselines.outputProfile(new_image.product,metaprofile,plan.blocksize)
+	temps = baselines.tempNames(names)
+
+	ownPool = None
+	if executor is None:
+		ownPool = executor = multiprocessing.Pool(plan.workers, initializer=stacks.initWorker, initargs=(input_paths,))
+	# submit a few windows at a time, so the windows waiting to be written stay within the plan
+	mapper = lambda func, args: _boundedMap(executor,func,args,plan.in_flight)
+	try:
+		log.info(f"Processing ({sub_product} {new_image.date})")
+		parallelStartTime = datetime.now()
+		if incremental:
+			sources = [(r.year, r.path) for r in input_records]
+			stem = os.path.basename(next(iter(names.values()))).split(".anomaly_")[0]
+			runningsums.updateMeans(os.path.join(BASELINE_ROOT,sub_product,"running"), stem, sources, {h:temps[f"mean_{baselines.horizonName(h)}"] for h in horizons}, outprofile, windows, mapper)
+		else:
+			# open output handles
+			log.debug("Opening handles")
+			handles = {}
+			try:
+				for k, name in temps.items():
+					os.makedirs(os.path.dirname(name),exist_ok=True) # folders for new horizons may not exist yet
+					handles[k] = rasterio.open(name, 'w', **outprofile)
+				# do multiprocessing
+				parallel_args = [(w, input_paths, metaprofile['dtype'], spans) for w in windows]
+				for win, values in mapper(_mp_serf, parallel_args):
+					for k, handle in handles.items():
+						handle.write(values[k], window=win, indexes=1)
+			finally:
+				## close handles
+				for handle in handles.values():
+					handle.close()
+		log.info(f"Finished parallel processing in {datetime.now() - parallelStartTime}")
+
+		# build overviews of every baseline at once and move them into place, then ingest them, waiting for every one to finish
+		log.debug("Building overviews of baselines and ingesting to S3")
+		cogStartTime = datetime.now()
+		output_paths = finalizeCogs({temps[k]:names[k] for k in names})
+		list(mapper(anomaly_ingest,[(x,new_image.year) for x in output_paths]))
+		log.info(f"Finished cloud-optimizing and ingesting in {datetime.now() - cogStartTime}")
+	except BaseException:
+		# stop our own pool at once, rather than waiting for the windows still queued
+		if ownPool is not None:
+			ownPool.terminate()
+		raise
+	else:
+		## close pool
+		if ownPool is not None:
+			ownPool.close()
+	finally:
+		if ownPool is not None:
+			ownPool.join()
+		for temp in temps.values():
+			if os.path.exists(temp):
+				os.remove(temp)
+
+	log.info(f"Finished in {datetime.now()-startTime}")
+	return output_paths
+
+
+def main():
 	parser = argparse.ArgumentParser(description="Update GLAM system imagery data")
 	parser.add_argument("input_file",
 		type=str,
+		nargs="?",
 		help="Path to new file to be added to anomaly baselines"
 		)
+	parser.add_argument("-r",
+		"--rebuild_all",
+		type=str,
+		metavar="PRODUCT",
+		help="Rebuild every baseline of PRODUCT in one job, instead of adding one file"
+		)
+	parser.add_argument("-m",
+		"--memory_mb",
+		type=int,
+		default=None,
+		help="Memory budget in MiB that windows and workers are sized to; by default GLAM_MEMORY_MB, or a share of the memory limit"
+		)
 	parser.add_argument("-n",
 		"--n_workers",
 		type=int,
 		default=20,
 		help="Number of parallel processes to run"
 		)
+	parser.add_argument("-i",
+		"--incremental",
+		action="store_true",
+		help="Update only the mean baselines, from stored running sums"
+		)
+	parser.add_argument("-y",
+		"--horizons",
+		type=str,
+		default=",".join(str(h) for h in HORIZONS),
+		help="Comma-separated numbers of years to build baselines over; 'full' uses every year. E.g. '5,10,full'"
+		)
 	args = parser.parse_args()
-
-	log.debug("Parsing input image")
-	new_image = glam.getImageType(args.input_file)(args.input_file)
-	n_workers=args.n_workers
-
-	# extract directory, product, and doy from image object
-	data_directory = os.path.dirname(new_image.path)
-	product=new_image.product
-	doy=new_image.doy
-
-	# set baseline_locations
-	if "merra-2" in product:
-		sub_product = "merra-2-" + os.path.basename(new_image.path).split(".")[-2]
-	else:
-		sub_product = product
-	baseline_root = os.path.join("/gpfs","data1","cmongp2","GLAM","rasters","baselines",sub_product)
-	baseline_locations = {anomaly_type:os.path.join(baseline_root,anomaly_type) for anomaly_type in ["mean_5year","median_5year",'mean_10year','median_10year']} #,'mean_full','median_full']}
-
-	# get input paths
-	input_paths = getInputPathList(new_image)
-	if len(input_paths) < 10:
-		log.error(f"Only {len(input_paths)} input image paths found for {args.input_file}")
+	try:
+		horizons = tuple(h if h == "full" else int(h) for h in args.horizons.split(","))
+	except ValueError:
+		parser.error(f"argument -y/--horizons: expected comma-separated numbers of years or 'full', got '{args.horizons}'")
+	if (args.input_file is None) == (args.rebuild_all is None):
+		parser.error("give either input_file or -r/--rebuild_all")
+	try:
+		if args.rebuild_all is not None:
+			baselines.rebuildAll(args.rebuild_all,n_workers=args.n_workers,horizons=horizons,memory_mb=args.memory_mb,time=True)
+			return
+		addFileToBaselines(args.input_file,n_workers=args.n_workers,incremental=args.incremental,horizons=horizons,memory_mb=args.memory_mb)
+	except UnavailableError as e:
+		log.error(e)
 		sys.exit()
 
-	# get input raster metadata and dimensions
-	getmeta = rasterio.open(new_image.path)
-	metaprofile = getmeta.profile
-	hnum = getmeta.width
-	vnum = getmeta.height
-	del getmeta
-
-	# add BIGTIFF where necessary
-	if product in supported_products:
-		metaprofile['BIGTIFF'] = 'YES'
-
-	def _mp_serf(targetwindow,input_paths,dtype='int16') -> tuple:
-		"""Worker function for use with multiprocessing
-
-		Returns a tuple of targetwindow and outputstore;
-		outputstore holds a dictionary of calculated means/medians
-		for the targetwindow, with the following keys:
-			* mean_5year
-			* median_5year
-			* mean_10year
-			* median_10year
-			* mean_full
-			* median_full
-
-		***
-
-		Parameters
-		----------
-		targetwindow:rasterio window
-		input_paths:list
-			Ordered list of filepaths
 
-		"""
-
-		# track how many years we have looped over for the anomaly
-		outputstore = {}
-		valuestore = []
-		yearscounter = 0
-		# Read an input block
-		for inputfile in input_paths:
-			# inputfile = img.path
-			inputhandle = rasterio.open(inputfile, 'r')
-			thiswindowdata = inputhandle.read(1, window=targetwindow)
-			valuestore += [thiswindowdata]
-			yearscounter += 1
-			# If it's a benchmarking year (5, 10, or final) then write something to the
-			# output handle and close it
-			if yearscounter == 5:
-				# Calculate the 5-year mean and write it
-				data_5yr = np.array(valuestore)
-				mean_5yr_calc = np.ma.average(data_5yr, axis=0, weights=((data_5yr >= -1000) * (data_5yr <= 10000)))
-				mean_5yr_calc[mean_5yr_calc.mask==True] = -3000
-				outputstore['mean_5year'] = mean_5yr_calc.astype(dtype)
-				del mean_5yr_calc
-
-				# Calculate the 5-year median and write it
-				median_5yr_masked = np.ma.masked_outside(data_5yr, -1000, 10000)
-				median_5yr_calc = np.ma.median(median_5yr_masked, axis=0)
-				median_5yr_calc[median_5yr_calc.mask==True] = -3000
-				outputstore['median_5year'] = median_5yr_calc.astype(dtype)
-				del data_5yr, median_5yr_masked, median_5yr_calc
-
-			if yearscounter == 10:
-				# Calculate the 10-year mean and write it
-				data_10yr = np.array(valuestore)
-				mean_10yr_calc = np.ma.average(data_10yr, axis=0, weights=((data_10yr >= -1000) * (data_10yr <= 10000)))
-				mean_10yr_calc[mean_10yr_calc.mask==True] = -3000
-				outputstore['mean_10year'] = mean_10yr_calc.astype(dtype)
-				del mean_10yr_calc
-
-				# Calculate the 10-year median and write it
-				median_10yr_masked = np.ma.masked_outside(data_10yr, -1000, 10000)
-				median_10yr_calc = np.ma.median(median_10yr_masked, axis=0)
-				median_10yr_calc[median_10yr_calc.mask==True] = -3000
-				outputstore['median_10year'] = median_10yr_calc.astype(dtype)
-				del data_10yr, median_10yr_masked, median_10yr_calc
-
-			# if yearscounter == len(input_paths):
-			# 	# Calculate the full time series mean and write it
-			# 	data_full = np.array(valuestore)
-			# 	mean_full_calc = np.ma.average(data_full, axis=0, weights=((data_full >= -1000) * (data_full <= 10000)))
-			# 	mean_full_calc[mean_full_calc.mask==True] = -3000
-			# 	outputstore['mean_full'] = mean_full_calc.astype(dtype)
-			# 	del mean_full_calc
-
-			# 	# Calculate the full time series median and write it
-			# 	median_full_masked = np.ma.masked_outside(data_full, -1000, 10000)
-			# 	median_full_calc = np.ma.median(median_full_masked, axis=0)
-			# 	median_full_calc[median_full_calc.mask==True] = -3000
-			# 	outputstore['median_full'] = median_full_calc.astype(dtype)
-			# 	del data_full, median_full_masked, median_full_calc
-			inputhandle.close()
-		return(targetwindow, outputstore)
-
-	# since mp.map() only allows one argument, we have to make a function with only a single parameter...
-	def _mp_worker(targetwindow):
-		return _mp_serf(targetwindow,input_paths,metaprofile['dtype'])
-
-	log.debug("Starting baseline update")
-
-	# set output filenames
-	if (product in supported_products) or ("merra-2" in product): # can just use doy
-		mean_5yr_name = os.path.join(baseline_locations["mean_5year"], f"{sub_product}.{doy}.anomaly_mean_5year.tif")
-		median_5yr_name = os.path.join(baseline_locations["median_5year"], f"{sub_product}.{doy}.anomaly_median_5year.tif")
-		mean_10yr_name = os.path.join(baseline_locations["mean_10year"], f"{sub_product}.{doy}.anomaly_mean_10year.tif")
-		median_10yr_name = os.path.join(baseline_locations["median_10year"],f"{sub_product}.{doy}.anomaly_median_10year.tif")
-		# mean_full_name = os.path.join(baseline_locations["mean_full"], f"{product}.{doy}.anomaly_mean_full.tif")
-		# median_full_name = os.path.join(baseline_locations["median_full"], f"{product}.{doy}.anomaly_median_full.tif")
-	elif product == "chirps":
-		mean_5yr_name = os.path.join(baseline_locations["mean_5year"], f"{product}.{new_image.date}.anomaly_mean_5year.tif")
-		median_5yr_name = os.path.join(baseline_locations["median_5year"], f"{product}.{new_image.date}.anomaly_median_5year.tif")
-		mean_10yr_name = os.path.join(baseline_locations["mean_10year"], f"{product}.{new_image.date}.anomaly_mean_10year.tif")
-		median_10yr_name = os.path.join(baseline_locations["median_10year"],f"{product}.{new_image.date}.anomaly_median_10year.tif")
-		# mean_full_name = os.path.join(baseline_locations["mean_full"], f"{product}.{new_image.date}.anomaly_mean_full.tif")
-		# median_full_name = os.path.join(baseline_locations["median_full"], f"{product}.{new_image.date}.anomaly_median_full.tif")
-	elif product == "swi":
-		output_doy = str(getSwiBaselineDoy(new_image)).zfill(3)
-		mean_5yr_name = os.path.join(baseline_locations["mean_5year"], f"{product}.{output_doy}.anomaly_mean_5year.tif")
-		median_5yr_name = os.path.join(baseline_locations["median_5year"], f"{product}.{output_doy}.anomaly_median_5year.tif")
-		mean_10yr_name = os.path.join(baseline_locations["mean_10year"], f"{product}.{output_doy}.anomaly_mean_10year.tif")
-		median_10yr_name = os.path.join(baseline_locations["median_10year"],f"{product}.{output_doy}.anomaly_median_10year.tif")
-		# mean_full_name = os.path.join(baseline_locations["mean_full"], f"{product}.{output_doy}.anomaly_mean_full.tif")
-		# median_full_name = os.path.join(baseline_locations["median_full"], f"{product}.{output_doy}.anomaly_median_full.tif")
-	else:
-		log.error(f"Product {product} not recognized for output baseline file name generation")
-
-	# # open input MemoryFiles
-	# self.open()
-
-	# open output handles
-	log.debug("Opening handles")
-	mean_5yr_handle = rasterio.open(mean_5yr_name, 'w', **metaprofile)
-	median_5yr_handle = rasterio.open(median_5yr_name, 'w', **metaprofile)
-	if len(input_paths) >= 10:
-		mean_10yr_handle = rasterio.open(mean_10yr_name, 'w', **metaprofile)
-		median_10yr_handle = rasterio.open(median_10yr_name, 'w', **metaprofile)
-	# mean_full_handle = rasterio.open(mean_full_name, 'w', **metaprofile)
-	# median_full_handle = rasterio.open(median_full_name, 'w', **metaprofile)
-
-	# get windows
-	log.debug("Getting windows")
-	blocksize = 256
-	windows = []
-	for hstart in range(0, hnum, blocksize):
-		for vstart in range(0, vnum, blocksize):
-			hwin = blocksize
-			vwin = blocksize
-			if ((hstart + blocksize) > hnum):
-				hwin = (hnum % blocksize)
-			if ((vstart + blocksize) > vnum):
-				vwin = (vnum % blocksize)
-			targetwindow = Window(hstart, vstart, hwin, vwin)
-			# if ((hstart + blocksize) > hnum) or ((vstart + blocksize) > vnum):
-			# 	targetwindow = Window(hstart, vstart, (hnum % blocksize), (vnum % blocksize))
-			windows += [targetwindow]
-
-	# do multiprocessing
-	log.info(f"Processing ({sub_product} {new_image.date}) | {n_workers} parallel processes")
-	parallelStartTime = datetime.now()
-	p = multiprocessing.Pool(n_workers)
-
-	for win, values in p.imap(_mp_worker, windows):
-		mean_5yr_handle.write(values['mean_5year'], window=win, indexes=1)
-		median_5yr_handle.write(values['median_5year'], window=win, indexes=1)
-		if len(input_paths) >= 10:
-			mean_10yr_handle.write(values['mean_10year'], window=win, indexes=1)
-			median_10yr_handle.write(values['median_10year'], window=win, indexes=1)
-		# mean_full_handle.write(values['mean_full'], window=win, indexes=1)
-		# median_full_handle.write(values['median_full'], window=win, indexes=1)
-
-	## close pool
-	p.close()
-	p.join()
-
-	# ## close MemoryFiles
-	# self.close()
-
-	## close handles
-	mean_5yr_handle.close()
-	median_5yr_handle.close()
-	if len(input_paths) >= 10:
-		mean_10yr_handle.close()
-		median_10yr_handle.close()
-	# mean_full_handle.close()
-	# median_full_handle.close()
-
-	log.info(f"Finished parallel processing in {datetime.now() - parallelStartTime}")
-
-	# cloud-optimize new anomalies
-	log.debug("Converting baselines to cloud-optimized geotiffs and ingesting to S3")
-	cogStartTime = datetime.now()
-
-	output_paths = [mean_5yr_name, median_5yr_name]
-	if len(input_paths) >= 10:
-		output_paths = output_paths + [mean_10yr_name, median_10yr_name]#, mean_full_name, median_full_name]
-	arg_tuples= [(x,new_image.year) for x in output_paths]
-
-	p = multiprocessing.Pool(len(output_paths))
-	p.imap(optimize_and_ingest,arg_tuples)
-
-	# for f in [mean_5yr_name, median_5yr_name, mean_10yr_name, median_10yr_name, mean_full_name, median_full_name]:
-	# 	cloud_optimize_inPlace(f)
-
-	# log.info(f"Finished cloud-optimizing {datetime.now() - cogStartTime}")
-
-	# # ingest new anomalies
-	# log.debug("Ingesting updated anomaly baselines to AWS")
-	# ingestStartTime = datetime.now()
-	# arg_tuples= [(x,new_image.year) for x in output_paths]
-	# p.imap(anomaly_ingest,arg_tuples)
-
-	# log.info(f"Finished ingesting in {datetime.now() - ingestStartTime}")
-
-	# for f in [mean_5yr_name, median_5yr_name, mean_10yr_name, median_10yr_name, mean_full_name, median_full_name]:
-	# 	anom = glam.AnomalyBaseline(f)
-	# 	anom.year = new_image.year
-	# 	anom.ingest()
-
-	## close pool
-	p.close()
-	p.join()
-
-	log.info(f"Finished cloud-optimizing and ingesting in {datetime.now() - cogStartTime}")
-
-	endTime = datetime.now()
-	log.info(f"Finished in {endTime-startTime}")
-
-
-# def main():
-# 	parser = argparse.ArgumentParser(description="Update GLAM system imagery data")
-# 	parser.add_argument("input_file",
-# 		type=str,
-# 		help="Path to new file to be added to anomaly baselines"
-# 		)
-# 	parser.add_argument("-n",
-# 		"--n_workers",
-# 		type=int,
-# 		default=20,
-# 		help="Number of parallel processes to run"
-# 		)
-# 	args = parser.parse_args()
-
-# 	log.info("Parsing input image")
-# 	img = glam.getImageType(args.input_file)(args.input_file)
-# 	log.info("Building baseline")
-# 	updateBaselines(new_image=img,n_workers=args.n_workers)
-
-
-# if __name__ == "__main__":
-# 	main()
+if __name__ == "__main__":
+	main()
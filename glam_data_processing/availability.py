@@ -0,0 +1,280 @@
+#! /usr/bin/env python
+
+"""
+This module checks many product dates for availability at once
+
+Checks against each host run on that host's own small thread pool, so
+no archive receives more than a fixed number of requests at a time and
+a slow archive does not hold up the others. Every host gets a single
+requests.Session, so connections are kept alive from one check to the
+next. Probes ask for headers only, so a check moves no file data. A
+check that fails with a network error, or a server error (5xx), is
+retried with exponential backoff. Results come back in the order the dates were
+given, and are the same as calling the check on each date in turn.
+
+Defaults can be changed with the following environment variables:
+
+	GLAM_HOST_CONNECTIONS   checks in flight per host (default 4)
+	GLAM_CHECK_RETRIES      retries after a network error (default 3)
+	GLAM_CHECK_BACKOFF      seconds before the first retry (default 1)
+
+***
+
+Functions
+---------
+getHost
+getSession
+probe
+withRetries
+checkMany
+filterAvailable
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlparse
+
+from glam_data_processing._lazy import lazyImport
+
+requests = lazyImport("requests")
+
+## hosts
+
+# where availability checks for each product are sent
+PRODUCT_HOSTS = {
+	"merra-2":"goldsmr4.gesdisc.eosdis.nasa.gov",
+	"merra-2-min":"goldsmr4.gesdisc.eosdis.nasa.gov",
+	"merra-2-max":"goldsmr4.gesdisc.eosdis.nasa.gov",
+	"merra-2-mean":"goldsmr4.gesdisc.eosdis.nasa.gov",
+	"chirps":"data.chc.ucsb.edu",
+	"chirps-prelim":"data.chc.ucsb.edu",
+	"swi":"land.copernicus.vgt.vito.be",
+	"MOD09Q1":"ladsweb.modaps.eosdis.nasa.gov",
+	"MYD09Q1":"ladsweb.modaps.eosdis.nasa.gov",
+	"MOD09A1":"ladsweb.modaps.eosdis.nasa.gov",
+	"MOD13Q1":"ladsweb.modaps.eosdis.nasa.gov",
+	"MYD13Q1":"ladsweb.modaps.eosdis.nasa.gov",
+	"MOD13Q4N":"ladsweb.modaps.eosdis.nasa.gov",
+	"VNP09H1":"ladsweb.modaps.eosdis.nasa.gov"
+	}
+
+DEFAULT_CONNECTIONS = int(os.environ.get("GLAM_HOST_CONNECTIONS",4))
+DEFAULT_RETRIES = int(os.environ.get("GLAM_CHECK_RETRIES",3))
+DEFAULT_BACKOFF = float(os.environ.get("GLAM_CHECK_BACKOFF",1))
+
+# per-host overrides of DEFAULT_CONNECTIONS
+HOST_CONNECTIONS = {}
+
+## module state
+
+_sessions = {}
+_sessions_pid = None
+_lock = threading.Lock()
+
+
+def getHost(target:str) -> str:
+	"""Returns the host name for a URL, or the host that serves a product
+
+	***
+
+	Parameters
+	----------
+	target:str
+		Either a full URL, or a product name; e.g. "chirps"
+	"""
+	if "://" in target:
+		return urlparse(target).netloc
+	return PRODUCT_HOSTS.get(target,target)
+
+
+def getSession(target:str) -> "requests.Session":
+	"""Returns the shared keep-alive session for a host, creating it on first call
+
+	***
+
+	Parameters
+	----------
+	target:str
+		Either a full URL, or a product name; e.g. "chirps"
+	"""
+	global _sessions, _sessions_pid
+	host = getHost(target)
+	with _lock:
+		# sessions hold open sockets, which must not be shared with a parent process
+		if _sessions_pid != os.getpid():
+			_sessions = {}
+			_sessions_pid = os.getpid()
+		try:
+			return _sessions[host]
+		except KeyError:
+			connections = HOST_CONNECTIONS.get(host,DEFAULT_CONNECTIONS)
+			session = requests.Session()
+			adapter = requests.adapters.HTTPAdapter(pool_connections=1,pool_maxsize=connections)
+			session.mount("http://",adapter)
+			session.mount("https://",adapter)
+			_sessions[host] = session
+			return session
+
+
+def probe(url:str, auth:tuple = None, timeout:float = 60, retries:int = None, backoff:float = None) -> tuple:
+	"""Requests only the headers of a URL, and returns (status code, headers)
+
+	Sends a HEAD request, following redirects. If the server refuses
+	HEAD, falls back to a GET for the first byte alone, which is closed
+	without reading the body; a partial-content reply is reported as 200.
+	Uses the shared session for the URL's host. Connection errors and
+	timeouts are retried; if they persist, (None, {}) is returned, so the
+	file is reported as unavailable rather than failing the caller.
+
+	***
+
+	Parameters
+	----------
+	url:str
+		Full URL of file
+	auth:tuple
+		Default None; (username, password) for password-protected archives
+	timeout:float
+		Seconds to wait for the server to respond
+	retries:int
+		See withRetries()
+	backoff:float
+		See withRetries()
+	"""
+	session = getSession(url)
+	def request():
+		r = session.head(url,auth=auth,allow_redirects=True,timeout=timeout)
+		if r.status_code in (405, 501):
+			log.debug(f"HEAD not supported by {getHost(url)}; requesting first byte instead")
+			r = session.get(url,auth=auth,headers={"Range":"bytes=0-0"},stream=True,allow_redirects=True,timeout=timeout)
+			r.close() # returns the connection to the pool without downloading the body
+		return r
+	try:
+		r = withRetries(request,retries=retries,backoff=backoff)
+	except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+		log.warning(f"Failed to reach {getHost(url)} for {url}: {type(e).__name__}")
+		return None, {}
+	status = 200 if r.status_code == 206 else r.status_code
+	return status, r.headers
+
+
+def _isTransient(e:Exception) -> bool:
+	"""Returns whether an exception is a network failure worth retrying"""
+	if isinstance(e,HTTPError): # the server answered; that is a result, not a failure
+		return False
+	if isinstance(e,(URLError,ConnectionError,TimeoutError,socket.timeout)):
+		return True
+	if isinstance(e,requests.exceptions.HTTPError): # from raise_for_status(); a server error may pass
+		return (e.response is not None) and (e.response.status_code >= 500)
+	return isinstance(e,(requests.exceptions.ConnectionError,requests.exceptions.Timeout))
+
+
+def withRetries(func, *args, retries:int = None, backoff:float = None, **kwargs):
+	"""Calls func(*args, **kwargs), retrying with exponential backoff on network and server errors
+
+	Any other exception is raised immediately, as is the last network
+	error once retries are used up.
+
+	***
+
+	Parameters
+	----------
+	func:function
+		Function to call
+	retries:int
+		Number of retries after the first attempt; default GLAM_CHECK_RETRIES
+	backoff:float
+		Seconds to wait before the first retry, doubling after each;
+		default GLAM_CHECK_BACKOFF
+	"""
+	retries = DEFAULT_RETRIES if retries is None else retries
+	backoff = DEFAULT_BACKOFF if backoff is None else backoff
+	attempt = 0
+	while True:
+		try:
+			return func(*args,**kwargs)
+		except Exception as e:
+			if (attempt >= retries) or (not _isTransient(e)):
+				raise
+			wait = backoff * (2 ** attempt)
+			log.warning(f"{type(e).__name__} in {getattr(func,'__name__',func)}{args}; retrying in {wait} seconds")
+			time.sleep(wait)
+			attempt += 1
+
+
+def checkMany(check, items:list, host = None, connections:int = None, retries:int = None, backoff:float = None) -> list:
+	"""Runs check(*item) for every item, concurrently, and returns the results in order
+
+	***
+
+	Parameters
+	----------
+	check:function
+		Availability check; e.g. Downloader().isAvailable
+	items:list
+		Tuples of arguments to pass to check; e.g. [("chirps","2020-01-01"),...]
+	host:function
+		Default None; given an item's arguments, returns the host that
+		check will contact. If not set, the host is looked up from the
+		first argument with getHost()
+	connections:int
+		Default None; checks in flight per host. If not set, uses
+		HOST_CONNECTIONS or GLAM_HOST_CONNECTIONS
+	retries:int
+		See withRetries()
+	backoff:float
+		See withRetries()
+	"""
+	items = [tuple(i) for i in items]
+	if host is None:
+		host = lambda *args: getHost(args[0])
+
+	# group items by host, remembering where each one goes in the output
+	byHost = {}
+	for position, args in enumerate(items):
+		byHost.setdefault(host(*args),[]).append(position)
+
+	results = [None] * len(items)
+	executors = []
+	futures = {}
+	try:
+		for h, positions in byHost.items():
+			executor = ThreadPoolExecutor(max_workers=(connections or HOST_CONNECTIONS.get(h,DEFAULT_CONNECTIONS)),thread_name_prefix=f"check-{h}")
+			executors.append(executor)
+			for position in positions:
+				futures[position] = executor.submit(withRetries,check,*items[position],retries=retries,backoff=backoff)
+		for position in range(len(items)):
+			results[position] = futures[position].result()
+	finally:
+		# after a failure, don't start any checks still waiting
+		for future in futures.values():
+			future.cancel()
+		for executor in executors:
+			executor.shutdown(wait=False)
+	return results
+
+
+def filterAvailable(check, product:str, dates:list, **kwargs) -> list:
+	"""Returns those dates for which check(product, date) is True, in their original order
+
+	***
+
+	Parameters
+	----------
+	check:function
+		Availability check taking a product and a date; e.g. downloads.isAvailable
+	product:str
+		Name of product
+	dates:list
+		String dates to check
+	**kwargs
+		Passed to checkMany()
+	"""
+	available = checkMany(check,[(product,d) for d in dates],**kwargs)
+	return [d for d, a in zip(dates,available) if a]
@@ -12,16 +12,36 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger(__name__)
 
 from .util import *
-import glob, multiprocessing, rasterio
-import numpy as np
+from .exceptions import UnavailableError
+from . import catalog, cog, kernels, planner, runningsums, stacks
+import multiprocessing, rasterio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 BASELINE_DIR = os.path.join(RASTER_DIR,'baselines')
 PRODUCT_DIR = os.path.join(RASTER_DIR,'products')
 
 
-def updateBaselines(product, date:datetime, n_workers=20, block_scale_factor= 1, time=False) -> dict:
+def updateBaselines(product, date:datetime, n_workers=20, block_scale_factor=None, time=False, incremental=False, horizons=(5, 10), memory_mb=None) -> dict:
     """Updates anomaly baselines
 
+    A mean and a median baseline are written for each horizon. Every year
+    needed is read once, and all horizons come from that one stack, so a
+    longer horizon costs compute but no extra reads.
+
+    With incremental=True, only the mean baselines are updated, from
+    running sums stored next to them (see runningsums.py); this reads the
+    new and dropped years rather than all ten. Medians are left as they
+    are.
+
+    Baselines are written straight into tiled, compressed GeoTIFFs whose
+    tiles match the windows, under temporary names. Their overviews are
+    then built in parallel (see cog.finalizeCogs()), and only once every
+    baseline is complete are they moved over the old ones.
+
+    The window size and number of workers are planned to fit a memory
+    budget; see planner.py.
+
     ***
 
     Parameters
@@ -29,8 +49,17 @@ def updateBaselines(product, date:datetime, n_workers=20, block_scale_factor= 1,
     product:str
     date:datetime
     n_workers:int
+        Most worker processes to use; fewer if they would not fit in memory
     block_scale_factor:int
+        Default None; if set, windows are this many input blocks wide,
+        rather than planned
     time:bool
+    incremental:bool
+    horizons:tuple
+        Default (5, 10); numbers of years to build baselines over, latest
+        first. "full" uses every year in the archive
+    memory_mb:int
+        Default None; memory budget in MiB. See planner.memoryBudget()
 
     Returns
     -------
@@ -44,83 +73,293 @@ def updateBaselines(product, date:datetime, n_workers=20, block_scale_factor= 1,
 
     startTime = datetime.now()
 
-    # create dict of anomaly baseline folders for each baseline type
-    baseline_locations = {anomaly_type:os.path.join(BASELINE_DIR,product,anomaly_type) for anomaly_type in ["mean_5year","median_5year",'mean_10year','median_10year']}
     # get list of input data files
-    input_paths = _listFiles(product,date)
+    if "full" in horizons:
+        input_records = _listRecords(product,date,n_years_to_consider=None)
+    else:
+        input_records = _listRecords(product,date,n_years_to_consider=max(horizons))
+    input_paths = [r.path for r in input_records]
     # check to make sure we got at least 10
-    if len(input_paths) < 10:
+    if len(input_paths) < max([10] + [h for h in horizons if h != "full"]):
         raise UnavailableError(f"Only {len(input_paths)} input image paths found")
+    # years in each horizon, by name; e.g. {'5year':5, 'full':23}
+    spans = {horizonName(h):(len(input_paths) if h == "full" else h) for h in horizons}
     # get raster metadata and dimensions
     with rasterio.open(input_paths[0]) as tempmeta:
         metaprofile = tempmeta.profile
         width = tempmeta.width
         height = tempmeta.height
-    # add BIGTIFF where necessary
-    if product in NDVI_PRODUCTS:
-        metaprofile['BIGTIFF'] = 'YES'
-
-    # set output filenames
+    # set output filenames, in a folder for each baseline type
     output_date = _getMatchingBaselineDate(product,date)
-    mean_5yr_name = os.path.join(baseline_locations["mean_5year"], f"{product}.{output_date}.anomaly_mean_5year.tif")
-    median_5yr_name = os.path.join(baseline_locations["median_5year"], f"{product}.{output_date}.anomaly_median_5year.tif")
-    mean_10yr_name = os.path.join(baseline_locations["mean_10year"], f"{product}.{output_date}.anomaly_mean_10year.tif")
-    median_10yr_name = os.path.join(baseline_locations["median_10year"],f"{product}.{output_date}.anomaly_median_10year.tif")
-
-    # open output handles
-    log.debug("Opening handles")
-    mean_5yr_handle = rasterio.open(mean_5yr_name, 'w', **metaprofile)
-    median_5yr_handle = rasterio.open(median_5yr_name, 'w', **metaprofile)
-    mean_10yr_handle = rasterio.open(mean_10yr_name, 'w', **metaprofile)
-    median_10yr_handle = rasterio.open(median_10yr_name, 'w', **metaprofile)
+    output_names = _outputNames(product,output_date,spans)
 
-    # set block size and get windows
-    blocksize = metaprofile['blockxsize'] * int(block_scale_factor)
+    # set block size and number of workers, and get windows
+    plan = _plan(metaprofile, width, height, max(spans.values()), 2 * len(spans), n_workers, block_scale_factor, memory_mb)
+    blocksize, n_workers = plan.blocksize, plan.workers
     windows = getWindows(width,height,blocksize)
 
-    # use windows to create parallel args
-    parallel_args = [(w, input_paths, metaprofile['dtype']) for w in windows]
+    # write tiled and compressed, with one tile per window where the window size allows
+    outprofile = outputProfile(product,metaprofile,blocksize)
+    temp_names = tempNames(output_names)
+
+    try:
+        if incremental:
+            sources = [(r.year, r.path) for r in input_records]
+            p = multiprocessing.Pool(n_workers)
+            try:
+                runningsums.updateMeans(os.path.join(BASELINE_DIR,product,"running"), f"{product}.{output_date}", sources, {h:temp_names[f"mean_{horizonName(h)}"] for h in horizons}, outprofile, windows, p.imap)
+            except BaseException:
+                # stop at once, rather than waiting for the windows still queued
+                p.terminate()
+                raise
+            else:
+                p.close()
+            finally:
+                p.join()
+            written = [f"mean_{name}" for name in spans]
+        else:
+            _updateAll(input_paths[:max(spans.values())], spans, temp_names, outprofile, windows, n_workers)
+            written = list(temp_names)
+
+        # build overviews of every output at once, then move them into place
+        log.debug("Building overviews of baselines")
+        output_paths = cog.finalizeCogs({temp_names[t]:output_names[t] for t in written})
+    finally:
+        for temp in temp_names.values():
+            if os.path.exists(temp):
+                os.remove(temp)
 
-    # do multiprocessing
-    p = multiprocessing.Pool(n_workers)
+    # if time==True, log total time for anomaly generation
+    endTime = datetime.now()
+    if time:
+        log.info(f"Finished in {endTime-startTime}")
 
-    for win, values in p.imap(_mp_worker, parallel_args):
-        mean_5yr_handle.write(values['mean_5year'], window=win, indexes=1)
-        median_5yr_handle.write(values['median_5year'], window=win, indexes=1)
-        mean_10yr_handle.write(values['mean_10year'], window=win, indexes=1)
-        median_10yr_handle.write(values['median_10year'], window=win, indexes=1)
+    # return dict
+    return {'product':product, 'paths':output_paths}
 
-    ## close pool
-    p.close()
-    p.join()
 
-    ## close handles
-    mean_5yr_handle.close()
-    median_5yr_handle.close()
-    mean_10yr_handle.close()
-    median_10yr_handle.close()
+def rebuildAll(product, n_workers=20, block_scale_factor=None, horizons=(5, 10), memory_mb=None, time=False) -> dict:
+    """Rebuilds every anomaly baseline of a product in one job; every DOY, CHIRPS dekad, or SWI period
 
-    # cloud-optimize new anomalies
-    log.debug("Converting baselines to cloud-optimized geotiffs and ingesting to S3")
+    The archive is listed once and grouped by baseline date. Work is
+    scheduled a window at a time, for every baseline date, on one pool of
+    workers, so that each window of each archive file is read once and
+    every baseline that needs it is computed from that read. The window
+    size, number of workers, and windows in flight at once are planned
+    to fit a memory budget (see planner.py), counting each window's stack
+    of years and its outputs. A baseline date's
+    outputs are finished (overviews built, moved into place) as soon as
+    its last window is written, while the others carry on.
 
-    # cloud-optimize outputs
-    output_paths = (mean_5yr_name, median_5yr_name, mean_10yr_name, median_10yr_name)
+    Baseline dates with fewer years than the longest horizon (or fewer
+    than 10) are skipped with a warning.
 
-    p = multiprocessing.Pool(len(output_paths))
-    p.imap(cloud_optimize_inPlace,output_paths)
+    ***
 
-    ## close pool
-    p.close()
-    p.join()
+    Parameters
+    ----------
+    product:str
+    n_workers:int
+        Most worker processes to use; fewer if they would not fit in memory
+    block_scale_factor:int
+        Default None; if set, windows are this many input blocks wide,
+        rather than planned
+    horizons:tuple
+        Default (5, 10); numbers of years to build baselines over, latest
+        first. "full" uses every year in the archive
+    memory_mb:int
+        Default None; memory budget in MiB. See planner.memoryBudget()
+    time:bool
+
+    Returns
+    -------
+    Dictionary with the following key/value pairs:
+        product:str
+            Product name
+        paths:tuple
+            Tuple of filepaths of the anomalybaseline
+            files that were rebuilt
+    """
+    startTime = datetime.now()
+
+    groups = _groupArchive(product)
+    needed = max([10] + [h for h in horizons if h != "full"])
+    jobs = {} # baseline date: (input paths, spans)
+    for output_date, input_paths in sorted(groups.items()):
+        if len(input_paths) < needed:
+            log.warning(f"Skipping {product} {output_date}: only {len(input_paths)} input image paths found")
+            continue
+        spans = {horizonName(h):(len(input_paths) if h == "full" else h) for h in horizons}
+        jobs[output_date] = (input_paths[:max(spans.values())], spans)
+    if not jobs:
+        raise UnavailableError(f"No {product} baseline date has {needed} years of input")
+
+    # get raster metadata and dimensions; the whole archive shares them
+    with rasterio.open(next(iter(jobs.values()))[0][0]) as tempmeta:
+        metaprofile = tempmeta.profile
+        width = tempmeta.width
+        height = tempmeta.height
+    # size windows, workers, and windows in flight by the memory each window holds
+    years = max(len(paths) for paths, spans in jobs.values())
+    plan = _plan(metaprofile, width, height, years, 2 * len(horizons), n_workers, block_scale_factor, memory_mb)
+    blocksize, n_workers, in_flight = plan
+    windows = getWindows(width,height,blocksize)
+    outprofile = outputProfile(product,metaprofile,blocksize)
+    log.info(f"Rebuilding {len(jobs)} {product} baseline dates; {len(windows)} windows each, up to {in_flight} at once")
+
+    # baseline dates go through one at a time, so only one set of outputs is open for writing
+    tasks = ((output_date, w) for output_date in jobs for w in windows)
+    output_names = {output_date:_outputNames(product,output_date,spans) for output_date, (paths, spans) in jobs.items()}
+    temp_names = {output_date:tempNames(names) for output_date, names in output_names.items()}
+    remaining = {output_date:len(windows) for output_date in jobs}
+    handles = {}
+    finishing = []
+    output_paths = []
+    p = multiprocessing.Pool(n_workers)
+    finisher = ThreadPoolExecutor(max_workers=2,thread_name_prefix="finalize")
+    try:
+        pending = deque()
+        def submit() -> bool:
+            task = next(tasks, None)
+            if task is None:
+                return False
+            output_date, w = task
+            paths, spans = jobs[output_date]
+            pending.append((output_date, p.apply_async(_mp_worker, ((w, paths, metaprofile['dtype'], spans),))))
+            return True
+        while (len(pending) < in_flight) and submit():
+            pass
+        # results are written in the order submitted, which bounds what is held at once
+        while pending:
+            output_date, result = pending.popleft()
+            win, values = result.get()
+            submit()
+            if output_date not in handles:
+                handles[output_date] = {}
+                for t, name in temp_names[output_date].items():
+                    # folders for new horizons may not exist yet
+                    os.makedirs(os.path.dirname(name), exist_ok=True)
+                    handles[output_date][t] = rasterio.open(name, 'w', **outprofile)
+            for anomaly_type, handle in handles[output_date].items():
+                handle.write(values[anomaly_type], window=win, indexes=1)
+            remaining[output_date] -= 1
+            if remaining[output_date] == 0:
+                for handle in handles.pop(output_date).values():
+                    handle.close()
+                finishing.append(finisher.submit(cog.finalizeCogs,{temp_names[output_date][t]:output_names[output_date][t] for t in temp_names[output_date]}))
+        # wait for every baseline date to be finished, and raise the first error
+        for future in finishing:
+            output_paths += future.result()
+    except BaseException:
+        # stop at once, rather than waiting for the windows still queued
+        p.terminate()
+        raise
+    else:
+        p.close()
+    finally:
+        p.join()
+        for date_handles in handles.values():
+            for handle in date_handles.values():
+                handle.close()
+        finisher.shutdown(wait=True)
+        for names in temp_names.values():
+            for temp in names.values():
+                if os.path.exists(temp):
+                    os.remove(temp)
 
-    # if time==True, log total time for anomaly generation
-    endTime = datetime.now()
     if time:
-        log.info(f"Finished in {endTime-startTime}")
+        log.info(f"Finished in {datetime.now()-startTime}")
+
+    return {'product':product, 'paths':tuple(output_paths)}
+
+
+def _groupArchive(product) -> dict:
+    """Lists a product's archive once; returns {baseline date: file paths, one per year, latest first}"""
+    groups = {}
+    for record in catalog.records(os.path.join(PRODUCT_DIR,product)):
+        # skip names that are not well-formed images, for example intermediate images, and extra doys from leap years
+        if (record.date is None) or (record.doy > 365):
+            continue
+        groups.setdefault(_getMatchingBaselineDate(product,datetime.strptime(record.date,"%Y-%m-%d")),[]).append((record.year, record.path))
+    out = {}
+    for output_date, files in groups.items():
+        years = [y for y, f in files]
+        duplicates = sorted(set(y for y in years if years.count(y) > 1))
+        if duplicates:
+            log.warning(f"{product} {output_date}: multiple files found for years {duplicates}")
+        out[output_date] = [f for y, f in sorted(files, reverse=True)]
+    return out
 
-    # return dict
-    return {'product':product, 'paths':output_paths}
 
+def _plan(metaprofile:dict, width:int, height:int, years:int, n_outputs:int, n_workers:int, block_scale_factor, memory_mb) -> planner.Plan:
+    """Returns the window size and number of workers for a baseline run; see planner.planWindows()"""
+    native = planner.nativeBlock(metaprofile)
+    blocksize = None if block_scale_factor is None else native * int(block_scale_factor)
+    pixel_bytes = planner.baselinePixelBytes(years, metaprofile['dtype'], n_outputs)
+    return planner.planWindows(width, height, pixel_bytes, n_workers, native_block=native, blocksize=blocksize, budget_mb=memory_mb)
+
+
+def horizonName(horizon) -> str:
+    """Returns the name of a horizon used in baseline types; e.g. '5year' or 'full'"""
+    return "full" if horizon == "full" else f"{int(horizon)}year"
+
+
+def _outputNames(product, output_date:str, spans:dict) -> dict:
+    """Returns {baseline type: output path}, in a folder for each baseline type"""
+    output_names = {}
+    for name in spans:
+        for stat in ("mean", "median"):
+            anomaly_type = f"{stat}_{name}"
+            output_names[anomaly_type] = os.path.join(BASELINE_DIR, product, anomaly_type, f"{product}.{output_date}.anomaly_{anomaly_type}.tif")
+    return output_names
+
+
+def tempNames(output_names:dict) -> dict:
+    """Returns {baseline type: temporary path} that outputs are written to before they are finished"""
+    return {anomaly_type:os.path.splitext(name)[0] + ".TEMP.tif" for anomaly_type, name in output_names.items()}
+
+
+def outputProfile(product, metaprofile:dict, blocksize:int) -> dict:
+    """Returns the profile baselines are written with: tiled, one tile per window where the window size allows, and compressed; BIGTIFF where necessary"""
+    tilesize = blocksize if (blocksize % 16 == 0) and (blocksize <= 1024) else 512
+    return cog.cogProfile(metaprofile, blocksize=tilesize, bigtiff=(product in NDVI_PRODUCTS))
+
+
+def _updateAll(input_paths:list, spans:dict, output_names:dict, metaprofile:dict, windows:list, n_workers:int) -> tuple:
+    """Writes mean and median baselines for each horizon from one read of the inputs; returns the paths written"""
+    # open output handles
+    log.debug("Opening handles")
+    handles = {}
+    try:
+        for anomaly_type, name in output_names.items():
+            # folders for new horizons may not exist yet
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+            handles[anomaly_type] = rasterio.open(name, 'w', **metaprofile)
+
+        # use windows to create parallel args
+        parallel_args = [(w, input_paths, metaprofile['dtype'], spans) for w in windows]
+
+        # do multiprocessing; each worker opens the inputs once, and keeps them open for every window
+        p = multiprocessing.Pool(n_workers, initializer=stacks.initWorker, initargs=(input_paths,))
+        try:
+            for win, values in p.imap(_mp_worker, parallel_args):
+                for anomaly_type, handle in handles.items():
+                    handle.write(values[anomaly_type], window=win, indexes=1)
+        except BaseException:
+            # stop at once, rather than waiting for the windows still queued
+            p.terminate()
+            raise
+        else:
+            ## close pool
+            p.close()
+        finally:
+            p.join()
+    finally:
+        ## close handles
+        for handle in handles.values():
+            handle.close()
+
+    return tuple(output_names.values())
 
 
 def _getMatchingBaselineDate(product,date:datetime) -> str:
@@ -153,33 +392,35 @@ def _getSwiBaselinePeriods() -> list:
 def _listFiles(product,date:datetime,n_years_to_consider = 10) -> list:
     """Returns a list of matching files, one from each year
     Output is sorted by year; latest first
+    With n_years_to_consider=None, every year is considered
     """
-    allFiles = glob.glob(os.path.join(PRODUCT_DIR,product,"*.tif"))
-    output_files = []
-    years_considered = []
-    # COLLECT FILES BY PRODUCT
-    for f in allFiles:
-        meta = getMetadata(f)
-        # we only go back 10 years; skip file if gap is larger
-        if int(date.strftime("%Y")) - int(meta['year']) > (n_years_to_consider - 1):
-            continue
-        # also skip extra doys from leap years
-        if int(meta['doy']) > 365:
-            continue
-        years_considered.append(int(meta['year']))
-        years_considered = list(set(years_considered)) # remove duplicate years
-        # find matching baseline date for input and current file; add if they match
-        baseline_date = _getMatchingBaselineDate(product,date)
-        if _getMatchingBaselineDate(product,meta['date_obj']) == baseline_date:
-            output_files.append(f)
+    return [r.path for r in _listRecords(product,date,n_years_to_consider)]
+
+
+def _listRecords(product,date:datetime,n_years_to_consider = 10) -> list:
+    """Returns the archive catalog Records of _listFiles(); latest year first"""
+    # names are parsed once, and kept in the archive catalog; we only go back 10 years
+    directory = os.path.join(PRODUCT_DIR,product)
+    min_year = None if n_years_to_consider is None else int(date.strftime("%Y")) - (n_years_to_consider - 1)
+    # years considered come from every well-formed file, skipping extra doys from leap years
+    years_considered = set(r.year for r in catalog.records(directory, min_year=min_year) if (r.date is not None) and (r.doy <= 365))
+    # matching files come from an indexed lookup of the days of year that share this baseline date
+    baseline_date = _getMatchingBaselineDate(product,date)
+    if product == "chirps":
+        output_files = catalog.records(directory, month_day=date.strftime("%m-%d"), min_year=min_year)
+    else:
+        output_files = catalog.records(directory, doy=_matchingDoys(product,baseline_date), min_year=min_year)
     # check that we have exactly one file from each year
     n_years_considered = ((int(date.strftime("%Y")) - min(years_considered)) + 1)
     if len(output_files) != n_years_considered:
         log.warning(f"{n_years_considered} years considered but {len(output_files)} files collected!")
     # sort list by file year; latest first
-    output_files = sorted(output_files, key=lambda filepath: int(getMetadata(filepath)['year']), reverse=True)
-    # return the output list
-    return output_files
+    return sorted(output_files, key=lambda record: record.year, reverse=True)
+
+
+def _matchingDoys(product, baseline_date:str) -> list:
+    """Returns the days of year (1-365) whose baseline date is baseline_date"""
+    return [d for d in range(1,366) if _getMatchingBaselineDate(product,datetime.strptime(f"2001.{d:03d}","%Y.%j")) == baseline_date]
 
 
 def _mp_worker(args) -> tuple:
@@ -187,7 +428,8 @@ def _mp_worker(args) -> tuple:
 
     Returns a tuple of targetwindow and outputstore;
     outputstore holds a dictionary of calculated means/medians
-    for the targetwindow, with the following keys:
+    for the targetwindow, with keys 'mean_<horizon>' and
+    'median_<horizon>' for each horizon; e.g.:
         * mean_5year
         * median_5year
         * mean_10year
@@ -203,56 +445,19 @@ def _mp_worker(args) -> tuple:
         targetwindow:rasterio window
         input_paths:list
             Ordered list of filepaths
+        dtype:str
+        spans:dict
+            Years in each horizon, by name; e.g. {'5year':5, '10year':10}
 
     """
-    targetwindow, input_paths, dtype = args
+    targetwindow, input_paths, dtype, spans = args
 
-    # track how many years we have looped over for the anomaly
+    # read every year needed into one preallocated stack, latest first
+    stack = stacks.readStack(targetwindow, input_paths[:max(spans.values())])
+    means = kernels.horizonMeans(stack, list(spans.values()), dtype)
+    medians = kernels.horizonMedians(stack, list(spans.values()), dtype)
     outputstore = {}
-    valuestore = []
-    yearscounter = 0
-    # Read an input block
-    for inputfile in input_paths:
-        # inputfile = img.path
-        inputhandle = rasterio.open(inputfile, 'r')
-        thiswindowdata = inputhandle.read(1, window=targetwindow)
-        valuestore += [thiswindowdata]
-        yearscounter += 1
-        # If it's a benchmarking year (5, 10, or final) then write something to the
-        # output handle and close it
-        if yearscounter == 5:
-            # Calculate the 5-year mean and write it
-            data_5yr = np.array(valuestore)
-            mean_5yr_calc = np.ma.average(data_5yr, axis=0, weights=((data_5yr >= -1000) * (data_5yr <= 10000)))
-            mean_5yr_calc[mean_5yr_calc.mask==True] = -3000
-            outputstore['mean_5year'] = mean_5yr_calc.astype(dtype)
-            del mean_5yr_calc
-
-            # Calculate the 5-year median and write it
-            median_5yr_masked = np.ma.masked_outside(data_5yr, -1000, 10000)
-            median_5yr_calc = np.ma.median(median_5yr_masked, axis=0)
-            median_5yr_calc[median_5yr_calc.mask==True] = -3000
-            outputstore['median_5year'] = median_5yr_calc.astype(dtype)
-            del data_5yr, median_5yr_masked, median_5yr_calc
-
-        if yearscounter == 10:
-            # Calculate the 10-year mean and write it
-            data_10yr = np.array(valuestore)
-            mean_10yr_calc = np.ma.average(data_10yr, axis=0, weights=((data_10yr >= -1000) * (data_10yr <= 10000)))
-            mean_10yr_calc[mean_10yr_calc.mask==True] = -3000
-            outputstore['mean_10year'] = mean_10yr_calc.astype(dtype)
-            del mean_10yr_calc
-
-            # Calculate the 10-year median and write it
-            median_10yr_masked = np.ma.masked_outside(data_10yr, -1000, 10000)
-            median_10yr_calc = np.ma.median(median_10yr_masked, axis=0)
-            median_10yr_calc[median_10yr_calc.mask==True] = -3000
-            outputstore['median_10year'] = median_10yr_calc.astype(dtype)
-            del data_10yr, median_10yr_masked, median_10yr_calc
-            # after calculating the 10-year baseline, we can stop opening files
-            inputhandle.close()
-            break
-
-        # don't forget to close the inputhandle!
-        inputhandle.close()
+    for name, years in spans.items():
+        outputstore[f'mean_{name}'] = means[years]
+        outputstore[f'median_{name}'] = medians[years]
     return(targetwindow, outputstore)
@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+
+"""
+This module keeps a catalog of the product rasters in archive directories
+
+Finding the files for a baseline used to mean globbing the whole product
+directory and parsing every name (baselines._listFiles() twice per file;
+getInputPathList() by building a legacy Image for each one, with its
+dozens of mask and region globs), on every call; listMissing() and
+getAllTiffs() globbed again. Here the .tif files of each directory are
+kept in a small SQLite catalog, one row per file: path, product,
+collection, year, doy, date, size, and modification time, parsed once
+from the file name. Names that do not parse (intermediate files, for
+example) are kept with empty fields, so listings still include them.
+
+A directory is scanned again only when its modification time has
+changed, which happens whenever a file in it is added, removed, or
+renamed into place; then only new and changed files are parsed. A file
+rewritten in place, without a rename, keeps its old size and
+modification time in the catalog until something else in its directory
+changes. Lookups such as "same DOY, last ten years" are indexed queries.
+
+If the catalog file cannot be opened (a read-only or locked disk, say),
+the catalog is kept in memory for the life of the process.
+
+The catalog can be configured with the following environment variables:
+
+	GLAM_ARCHIVE_CATALOG   path to SQLite catalog file (default
+	                       'glam_archive.sqlite', next to 'glam_keys.json';
+	                       set to an empty string to keep it in memory only)
+
+***
+
+Classes
+-------
+Record
+
+Functions
+---------
+parseName
+refresh
+records
+paths
+clearCatalog
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import re, sqlite3, threading, time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+## settings
+
+CATALOG_PATH = os.environ.get("GLAM_ARCHIVE_CATALOG",os.path.join(os.path.dirname(os.path.dirname(__file__)),"glam_archive.sqlite"))
+SETTLE_SECONDS = 2 # a directory changed this recently may change again within its mtime's resolution
+
+Record = namedtuple("Record",["path","product","collection","year","doy","date","size","mtime"])
+Record.__doc__ = """One raster in the catalog: path, product, collection, year and doy (int), date ("%Y-%m-%d"), size in bytes, and modification time; product to date are None if the name does not parse"""
+
+_SCHEMA = (
+	"CREATE TABLE IF NOT EXISTS directories (directory TEXT PRIMARY KEY, mtime INTEGER);",
+	"CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, directory TEXT, product TEXT, collection TEXT, year INTEGER, doy INTEGER, date TEXT, size INTEGER, mtime REAL);",
+	"CREATE INDEX IF NOT EXISTS files_doy ON files (directory, product, doy, year);",
+	"CREATE INDEX IF NOT EXISTS files_date ON files (directory, product, date);",
+	)
+_COLUMNS = "path, product, collection, year, doy, date, size, mtime"
+_MERRA2_COLLECTIONS = {'min':'Minimum','mean':'Mean','max':'Maximum'}
+
+## module state
+
+_memory = None # shared in-memory catalog, when there is no file
+_lock = threading.RLock()
+
+
+@contextmanager
+def _connection():
+	"""Yields a connection to the catalog, committed on success; falls back to an in-memory catalog if the file cannot be used"""
+	global _memory
+	con = None
+	if CATALOG_PATH and (_memory is None):
+		try:
+			con = sqlite3.connect(CATALOG_PATH,timeout=30)
+			for statement in _SCHEMA:
+				con.execute(statement)
+		except sqlite3.Error:
+			log.warning(f"Failed to open archive catalog at {CATALOG_PATH}; keeping it in memory only")
+			if con is not None:
+				con.close()
+			con = None
+	if con is None:
+		with _lock:
+			if _memory is None:
+				_memory = sqlite3.connect(":memory:",check_same_thread=False)
+				for statement in _SCHEMA:
+					_memory.execute(statement)
+			with _memory:
+				yield _memory
+		return
+	try:
+		with con:
+			yield con
+	finally:
+		con.close()
+
+
+def parseName(path:str) -> dict:
+	"""Returns {'product', 'collection', 'year', 'doy', 'date'} parsed from a product file name, or None if it is not one
+
+	NDVI names are 'PRODUCT.YYYY.JJJ.tif' (collection '006'), and
+	ancillary names 'PRODUCT.YYYY-MM-DD.tif', with the merra-2 collection
+	('Minimum', 'Mean', 'Maximum') second to last, as the legacy Image
+	classes read them.
+	"""
+	parts = os.path.basename(path).split(".")
+	if len(parts) < 3:
+		return None
+	try:
+		if re.fullmatch(r"\d{4}",parts[1]) and re.fullmatch(r"\d{3}",parts[2]):
+			dateObj = datetime.strptime(f"{parts[1]}.{parts[2]}","%Y.%j")
+			collection = "006"
+		elif re.fullmatch(r"\d{4}-\d{2}-\d{2}",parts[1]):
+			dateObj = datetime.strptime(parts[1],"%Y-%m-%d")
+			collection = _MERRA2_COLLECTIONS.get(parts[-2],'0') if parts[0] == "merra-2" else '0'
+		else:
+			return None
+	except ValueError:
+		return None
+	return {"product":parts[0],"collection":collection,"year":dateObj.year,"doy":int(dateObj.strftime("%j")),"date":dateObj.strftime("%Y-%m-%d")}
+
+
+def refresh(directory:str) -> None:
+	"""Brings the catalog of one directory up to date, scanning it only if its modification time has changed"""
+	directory = os.path.abspath(directory)
+	try:
+		dir_mtime = os.stat(directory).st_mtime_ns
+	except FileNotFoundError:
+		dir_mtime = None
+	with _connection() as con:
+		row = con.execute("SELECT mtime FROM directories WHERE directory = ?;",(directory,)).fetchone()
+		if (row is not None) and (dir_mtime is not None) and (row[0] == dir_mtime):
+			return None
+		known = {path:(size,mtime) for path, size, mtime in con.execute("SELECT path, size, mtime FROM files WHERE directory = ?;",(directory,))}
+		seen = set()
+		changed = []
+		if dir_mtime is not None:
+			with os.scandir(directory) as entries:
+				for entry in entries:
+					if (not entry.name.endswith(".tif")) or (not entry.is_file()):
+						continue
+					try:
+						st = entry.stat()
+					except FileNotFoundError: # removed since listed
+						continue
+					seen.add(entry.path)
+					if known.get(entry.path) == (st.st_size,st.st_mtime):
+						continue
+					meta = parseName(entry.path) or dict.fromkeys(("product","collection","year","doy","date"))
+					changed.append((entry.path,directory,meta["product"],meta["collection"],meta["year"],meta["doy"],meta["date"],st.st_size,st.st_mtime))
+		gone = [(path,) for path in known if path not in seen]
+		con.executemany("INSERT OR REPLACE INTO files (path, directory, product, collection, year, doy, date, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",changed)
+		con.executemany("DELETE FROM files WHERE path = ?;",gone)
+		# a directory that changed just now may change again without its mtime moving; look again next time
+		if (dir_mtime is None) or (time.time() - dir_mtime / 1e9 < SETTLE_SECONDS):
+			con.execute("DELETE FROM directories WHERE directory = ?;",(directory,))
+		else:
+			con.execute("INSERT OR REPLACE INTO directories (directory, mtime) VALUES (?, ?);",(directory,dir_mtime))
+		log.debug(f"Catalog of {directory}: {len(changed)} files added or changed, {len(gone)} removed")
+
+
+def records(directory:str, product:str = None, collection:str = None, doy = None, month_day:str = None, min_year:int = None, max_year:int = None) -> list:
+	"""Returns a list of Records for the rasters in directory that match every filter given, latest date first
+
+	The directory's catalog is refreshed first. With no filters, every
+	.tif is returned, including those whose names do not parse.
+
+	***
+
+	Parameters
+	----------
+	directory:str
+		Directory of product rasters
+	product:str
+		Default None; e.g. 'MOD13Q1' or 'merra-2'
+	collection:str
+		Default None; e.g. '006' or 'Minimum'
+	doy:int or list
+		Default None; day of year, or a list of days of year any of which
+		matches
+	month_day:str
+		Default None; month and day, "%m-%d"
+	min_year:int
+		Default None; earliest year
+	max_year:int
+		Default None; latest year
+	"""
+	directory = os.path.abspath(directory)
+	refresh(directory)
+	clauses = ["directory = ?"]
+	values = [directory]
+	if isinstance(doy,(list,tuple,set)):
+		doys = sorted(int(d) for d in doy)
+		clauses.append(f"doy IN ({', '.join('?' * len(doys))})")
+		values += doys
+		doy = None
+	for column, value in (("product",product),("collection",collection),("doy",doy),("substr(date,6)",month_day)):
+		if value is not None:
+			clauses.append(f"{column} = ?")
+			values.append(int(value) if column == "doy" else value)
+	if min_year is not None:
+		clauses.append("year >= ?")
+		values.append(int(min_year))
+	if max_year is not None:
+		clauses.append("year <= ?")
+		values.append(int(max_year))
+	with _connection() as con:
+		rows = con.execute(f"SELECT {_COLUMNS} FROM files WHERE {' AND '.join(clauses)} ORDER BY date DESC, path;",values).fetchall()
+	return [Record(*row) for row in rows]
+
+
+def paths(directory:str, **filters) -> list:
+	"""Returns the paths of records(directory, **filters)"""
+	return [r.path for r in records(directory,**filters)]
+
+
+def clearCatalog() -> None:
+	"""Forgets every directory in the catalog, so each is scanned again when next used"""
+	with _connection() as con:
+		con.execute("DELETE FROM directories;")
+		con.execute("DELETE FROM files;")
@@ -0,0 +1,420 @@
+#! /usr/bin/env python
+
+"""
+This module writes rasters as cloud-optimized GeoTIFFs (COGs)
+
+Every GLAM product ends up as a tiled, compressed GeoTIFF with internal
+overviews, and ancillary products are first reprojected to MODIS
+sinusoidal and clipped to the valid extent of that projection. Each of
+those steps used to read and rewrite the whole file, with extra copies in
+between. Here the reprojection and clip are chained as virtual (VRT)
+datasets, and the result is written to disk once, overviews included,
+using multithreaded GDAL. GDAL's COG driver is used where available;
+older GDAL builds the overviews on an intermediate copy held in /vsimem/,
+or on disk if it is too large to hold in memory.
+
+Rasters computed window by window (anomaly baselines) skip the rewrite
+altogether: they are written straight into a tiled, compressed layout
+(cogProfile()), and their internal overviews are then built in place
+with multithreaded GDAL (addOverviews(), finalizeCogs()). The overviews
+follow the full-resolution data in the file rather than preceding it,
+which readers using HTTP range requests handle with a few more header
+reads; the full-resolution tiles are never decompressed and written
+again.
+
+Defaults can be changed with the following environment variables:
+
+	GLAM_GDAL_THREADS   threads for warping and compression (default ALL_CPUS)
+	GLAM_VSIMEM_MB      largest intermediate copy held in memory, in
+	                    megabytes, where the COG driver is missing (default 1024)
+
+***
+
+Functions
+---------
+vsimemPath
+overviewLevels
+writeCog
+writeInPlace
+cloudOptimize
+cogProfile
+addOverviews
+finalizeCogs
+openSinusoidal
+sinusoidalCog
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.exceptions import BadInputError
+
+gdal = lazyImport("gdal", on_load=lambda m: m.UseExceptions())
+
+## settings
+
+THREADS = os.environ.get("GLAM_GDAL_THREADS","ALL_CPUS")
+VSIMEM_MB = float(os.environ.get("GLAM_VSIMEM_MB",1024))
+
+## projection
+
+# 'SINUSOIDAL' is the WKT for MODIS sinusoidal projection
+SINUSOIDAL = 'PROJCS["Sinusoidal",GEOGCS["GCS_Undefined",DATUM["Undefined",SPHEROID["User_Defined_Spheroid",6371007.181,0.0]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],UNIT["Meter",1.0]]'
+
+# valid extent of MODIS sinusoidal; reprojection can take file
+# boundaries outside of it, in which case they are clipped back down
+MAX_NORTH = 9962342 # 9972315.0495 * 0.999
+MAX_WEST = -22735470 # -22758229.000 * 0.999
+MAX_SOUTH = -9143189 # -9152341.5816 * 0.999
+MAX_EAST = 20958445 # 20979424.893 * 0.999
+
+_counter = 0
+_lock = threading.Lock()
+
+
+def vsimemPath(name:str) -> str:
+	"""Returns a unique /vsimem/ path for an intermediate dataset"""
+	global _counter
+	with _lock:
+		_counter += 1
+		return f"/vsimem/glam_{os.getpid()}_{_counter}_{name}"
+
+
+def overviewLevels(x_size:int, y_size:int, min_size:int = 256) -> list:
+	"""Returns the overview factors gdaladdo chooses by default: halving until the image fits in min_size"""
+	levels = []
+	factor = 1
+	while (-(-x_size // factor) > min_size) or (-(-y_size // factor) > min_size):
+		factor *= 2
+		levels.append(factor)
+	return levels
+
+
+def writeCog(src:"gdal.Dataset", out_file:str, compress:str = "LZW", predictor:bool = True, bigtiff:bool = False) -> None:
+	"""Writes an open GDAL dataset to out_file as a tiled, compressed GeoTIFF with internal overviews
+
+	***
+
+	Parameters
+	----------
+	src:gdal.Dataset
+		Dataset to write; e.g. a VRT or an in-memory (MEM) dataset
+	out_file:str
+		Path to output COG
+	compress:str
+		GDAL compression method; default "LZW"
+	predictor:bool
+		Default True; whether to apply horizontal differencing before compression
+	bigtiff:bool
+		Default False; whether to force BigTIFF output
+	"""
+	if gdal.GetDriverByName("COG") is not None:
+		options = [f"COMPRESS={compress}",f"NUM_THREADS={THREADS}","RESAMPLING=NEAREST",f"BIGTIFF={'YES' if bigtiff else 'IF_SAFER'}"]
+		if predictor:
+			options.append("PREDICTOR=YES")
+		gdal.Translate(out_file,src,format="COG",creationOptions=options)
+		return None
+
+	# no COG driver; build overviews on an uncompressed tiled copy, then
+	# copy it and its overviews to the output
+	bytesPerPixel = gdal.GetDataTypeSize(src.GetRasterBand(1).DataType) // 8
+	size = src.RasterXSize * src.RasterYSize * src.RasterCount * bytesPerPixel
+	if size <= VSIMEM_MB * 1024 * 1024:
+		intermediate_file = vsimemPath(os.path.basename(out_file))
+	else:
+		intermediate_file = os.path.splitext(out_file)[0] + ".OVERVIEWS.tif"
+	try:
+		tiled = gdal.Translate(intermediate_file,src,format="GTiff",creationOptions=["TILED=YES","BIGTIFF=IF_SAFER"])
+		oldThreads = gdal.GetConfigOption("GDAL_NUM_THREADS")
+		gdal.SetConfigOption("GDAL_NUM_THREADS",THREADS)
+		try:
+			tiled.BuildOverviews("NEAREST",overviewLevels(tiled.RasterXSize,tiled.RasterYSize))
+		finally:
+			gdal.SetConfigOption("GDAL_NUM_THREADS",oldThreads)
+		options = ["TILED=YES","COPY_SRC_OVERVIEWS=YES",f"COMPRESS={compress}",f"NUM_THREADS={THREADS}"]
+		if predictor:
+			options.append("PREDICTOR=2")
+		if bigtiff:
+			options.append("BIGTIFF=YES")
+		gdal.Translate(out_file,tiled,format="GTiff",creationOptions=options)
+		del tiled
+	finally:
+		if intermediate_file.startswith("/vsimem/"):
+			gdal.Unlink(intermediate_file)
+		elif os.path.exists(intermediate_file):
+			os.remove(intermediate_file)
+
+
+def writeInPlace(write, in_file:str, out_file:str = None) -> str:
+	"""Calls write(path) on a temporary path, then moves the result to out_file, and returns out_file
+
+	The temporary file is removed if write() fails, so in_file is never
+	left half-written.
+
+	***
+
+	Parameters
+	----------
+	write:function
+		Called as write(path) to write the output to path; e.g. with
+		writeCog()
+	in_file:str
+		Path to input raster, replaced if out_file is not set
+	out_file:str
+		Default None; path to output raster
+	"""
+	out_file = out_file or in_file
+	temp_file = os.path.splitext(out_file)[0] + ".COG.TEMP.tif"
+	try:
+		write(temp_file)
+		os.replace(temp_file,out_file)
+	finally:
+		if os.path.exists(temp_file):
+			os.remove(temp_file)
+	return out_file
+
+
+def cloudOptimize(in_file:str, out_file:str = None, compress:str = "LZW", predictor:bool = True, bigtiff:bool = False) -> str:
+	"""Rewrites a raster as a cloud-optimized GeoTIFF in one pass, and returns the output path
+
+	***
+
+	Parameters
+	----------
+	in_file:str
+		Path to input raster
+	out_file:str
+		Default None; path to output COG. If not set, in_file is replaced
+	compress:str
+		GDAL compression method; default "LZW"
+	predictor:bool
+		Default True; whether to apply horizontal differencing before compression
+	bigtiff:bool
+		Default False; whether to force BigTIFF output
+	"""
+	def write(path:str) -> None:
+		src = gdal.Open(in_file,0)
+		writeCog(src,path,compress=compress,predictor=predictor,bigtiff=bigtiff)
+		del src
+	return writeInPlace(write,in_file,out_file)
+
+
+def cogProfile(profile:dict, blocksize:int = 512, compress:str = "LZW", predictor:bool = True, bigtiff:bool = False) -> dict:
+	"""Returns a copy of a rasterio profile for writing a tiled, compressed GeoTIFF, ready for addOverviews()
+
+	Windows written to it should line up with its blocks, so that each
+	block is compressed once.
+
+	***
+
+	Parameters
+	----------
+	profile:dict
+		rasterio profile of the output; dtype, size, transform, etc.
+	blocksize:int
+		Default 512; width and height of tiles, a multiple of 16
+	compress:str
+		GDAL compression method; default "LZW"
+	predictor:bool
+		Default True; whether to apply a predictor before compression
+		(horizontal differencing for integers, floating point for floats)
+	bigtiff:bool
+		Default False; whether to force BigTIFF output
+	"""
+	out = dict(profile,driver="GTiff",tiled=True,blockxsize=blocksize,blockysize=blocksize,compress=compress.lower(),interleave="band")
+	out.pop("predictor",None)
+	if predictor:
+		out["predictor"] = 3 if str(profile.get("dtype","")).startswith("float") else 2
+	out["BIGTIFF"] = "YES" if bigtiff else "IF_SAFER"
+	return out
+
+
+@contextmanager
+def _threadConfig(**options):
+	"""Context manager setting GDAL configuration options for the calling thread only"""
+	old = {k:gdal.GetThreadLocalConfigOption(k,None) for k in options}
+	for k, v in options.items():
+		gdal.SetThreadLocalConfigOption(k,v)
+	try:
+		yield None
+	finally:
+		for k, v in old.items():
+			gdal.SetThreadLocalConfigOption(k,v)
+
+
+def addOverviews(path:str, compress:str = "LZW", predictor:bool = True) -> str:
+	"""Builds internal overviews of a tiled GeoTIFF in place with multithreaded GDAL, and returns path
+
+	The overviews are compressed like the file itself (see cogProfile()),
+	and resampled with nearest neighbour, as gdaladdo and the COG driver
+	do here. GDAL errors are raised as RuntimeError.
+
+	***
+
+	Parameters
+	----------
+	path:str
+		Path to tiled GeoTIFF
+	compress:str
+		GDAL compression method for the overviews; default "LZW"
+	predictor:bool
+		Default True; whether to apply a predictor before compression
+	"""
+	options = {"GDAL_NUM_THREADS":THREADS,"COMPRESS_OVERVIEW":compress}
+	dataset = gdal.Open(path,gdal.GA_Update)
+	try:
+		levels = overviewLevels(dataset.RasterXSize,dataset.RasterYSize)
+		block = dataset.GetRasterBand(1).GetBlockSize()[0]
+		options["GDAL_TIFF_OVR_BLOCKSIZE"] = str(block)
+		if predictor:
+			floating = gdal.GetDataTypeName(dataset.GetRasterBand(1).DataType).startswith("Float")
+			options["PREDICTOR_OVERVIEW"] = "3" if floating else "2"
+		if levels:
+			with _threadConfig(**options):
+				dataset.BuildOverviews("NEAREST",levels)
+		dataset.FlushCache()
+	finally:
+		del dataset
+	return path
+
+
+def finalizeCogs(paths:dict, compress:str = "LZW", predictor:bool = True) -> tuple:
+	"""Builds overviews for several tiled GeoTIFFs at once, then moves each into place; returns the final paths
+
+	Every file is finished or none is moved: if any fails, the first
+	error is raised once all have stopped, and the files written so far
+	are left at their temporary paths for the caller to remove.
+
+	***
+
+	Parameters
+	----------
+	paths:dict
+		{temporary path: final path}
+	compress:str
+		See addOverviews()
+	predictor:bool
+		See addOverviews()
+	"""
+	if not paths:
+		return ()
+	with ThreadPoolExecutor(max_workers=len(paths),thread_name_prefix="overviews") as executor:
+		futures = [executor.submit(addOverviews,temp,compress,predictor) for temp in paths]
+		errors = [f.exception() for f in futures] # waits for each
+	for e in errors:
+		if e is not None:
+			raise e
+	for temp, final in paths.items():
+		os.replace(temp,final)
+	return tuple(paths.values())
+
+
+@contextmanager
+def openSinusoidal(in_file:str, src_srs:str = None, src_nodata = None, dst_nodata = None) -> "gdal.Dataset":
+	"""Context manager giving a virtual dataset of in_file reprojected to MODIS sinusoidal and clipped to the valid extent
+
+	Nearest-neighbour resampling is used, with every pixel transformed
+	exactly (no approximation), so the result does not depend on how GDAL
+	divides the work into chunks. The VRTs are held in /vsimem/ and
+	removed on exit.
+
+	***
+
+	Parameters
+	----------
+	in_file:str
+		Path to input raster, or any dataset name GDAL can open
+	src_srs:str
+		See sinusoidalCog()
+	src_nodata:float
+		See sinusoidalCog()
+	dst_nodata:float
+		Default None; value for pixels outside the input. If not set, uses
+		src_nodata or the input's own nodata value
+	"""
+	src = gdal.Open(in_file,0)
+	srs = src_srs or src.GetProjection() or "EPSG:4326"
+	del src
+	warpOptions = {
+		"format":"VRT",
+		"srcSRS":srs,
+		"dstSRS":SINUSOIDAL,
+		"errorThreshold":0,
+		"multithread":True,
+		"warpOptions":[f"NUM_THREADS={THREADS}"]
+		}
+	if src_nodata is not None:
+		warpOptions["srcNodata"] = src_nodata
+		warpOptions["dstNodata"] = src_nodata
+	if dst_nodata is not None:
+		warpOptions["dstNodata"] = dst_nodata
+	warpPath = vsimemPath("warp.vrt")
+	clipPath = vsimemPath("clip.vrt")
+	try:
+		warped = gdal.Warp(warpPath,in_file,**warpOptions)
+
+		## check extents against MODIS
+		gt = warped.GetGeoTransform()
+		west = gt[0]
+		north = gt[3]
+		east = west + (gt[1] * warped.RasterXSize)
+		south = north + (gt[5] * warped.RasterYSize)
+		del warped
+		if (north > MAX_NORTH) or (west < MAX_WEST) or (south < MAX_SOUTH) or (east > MAX_EAST):
+			projWin = [max(west,MAX_WEST),min(north,MAX_NORTH),min(east,MAX_EAST),max(south,MAX_SOUTH)]
+			out = gdal.Translate(clipPath,warpPath,format="VRT",projWin=projWin)
+		else:
+			out = gdal.Open(warpPath,0)
+		yield out
+		del out
+	finally:
+		for path in (clipPath,warpPath):
+			try:
+				gdal.Unlink(path)
+			except RuntimeError: # never created
+				pass
+
+
+def sinusoidalCog(in_file:str, out_file:str = None, src_srs:str = None, src_nodata = None, compress:str = "LZW", predictor:bool = True) -> str:
+	"""Reprojects a raster to MODIS sinusoidal, clips it to the valid extent, and writes a COG
+
+	Reprojection and clipping happen in virtual datasets, so the data are
+	written to disk only once. Returns the output path. GDAL errors are
+	raised as RuntimeError.
+
+	***
+
+	Parameters
+	----------
+	in_file:str
+		Path to input raster, or any dataset name GDAL can open (e.g. a
+		NetCDF subdataset or a /vsimem/ path)
+	out_file:str
+		Default None; path to output COG. If not set, in_file is replaced
+	src_srs:str
+		Default None; projection of the input. If not set, uses the
+		input's own projection, or geographic (EPSG:4326) if it has none,
+		as with Merra-2 and CHIRPS
+	src_nodata:float
+		Default None; nodata value to apply to the input. If not set,
+		uses the input's own nodata value
+	compress:str
+		GDAL compression method; default "LZW"
+	predictor:bool
+		Default True; whether to apply horizontal differencing before compression
+	"""
+	if (out_file is None) and (in_file.startswith("/vsi") or (":" in os.path.basename(in_file))):
+		raise BadInputError(f"An output path is required for dataset '{in_file}'")
+
+	def write(path:str) -> None:
+		with openSinusoidal(in_file,src_srs,src_nodata) as out:
+			writeCog(out,path,compress=compress,predictor=predictor)
+
+	return writeInPlace(write,in_file,out_file)
@@ -3,8 +3,13 @@ import logging, os
 logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger("glam_command_line")
 
-import argparse, glob, json, octvi, subprocess, sys
+import argparse, glob, json, multiprocessing, sys, threading, time
+from concurrent.futures import ProcessPoolExecutor
 import glam_data_processing.legacy as glam
+from glam_data_processing import fetch, pipeline
+from glam_data_processing._lazy import lazyImport
+octvi = lazyImport("octvi")
+anomalyBaseline = lazyImport("glam_data_processing.add_file_to_anomaly_baseline")
 from getpass import getpass
 from datetime import datetime
 
@@ -89,8 +94,7 @@ def updateData():
 		'--product',
 		default=None,
 		required=False,
-		choices=octvi.supported_products+glam.ancillary_products,
-		help="Only update the specified product")
+		help=f"Only update the specified product; an NDVI product supported by octvi, or one of: {', '.join(glam.ancillary_products)}")
 	parser.add_argument("-ml",
 		"--mask_level",
 		default="ALL",
@@ -134,7 +138,40 @@ def updateData():
 		action='count',
 		default=0,
 		help="Display more messages; print traceback on failure")
+	parser.add_argument('-j',
+		'--jobs',
+		type=int,
+		default=1,
+		help="Number of files each stage (download, ingest, stats, baseline) works on at once; stages always overlap. NDVI files go one at a time")
+	parser.add_argument('-sw',
+		'--stage_workers',
+		'--stage-workers',
+		default=None,
+		help="Override --jobs for individual stages; e.g. 'download=3,stats=2'")
+	parser.add_argument('-bw',
+		'--baseline_workers',
+		'--baseline-workers',
+		type=int,
+		default=20,
+		help="Number of worker processes that update anomaly baselines; the pool is started once and shared by every file")
 	args = parser.parse_args()
+	# checked here rather than with 'choices', so that --help does not import octvi
+	if (args.product is not None) and (args.product not in octvi.supported_products+glam.ancillary_products):
+		parser.error(f"argument -p/--product: invalid choice: '{args.product}' (choose from {', '.join(octvi.supported_products+glam.ancillary_products)})")
+	if args.jobs < 1:
+		parser.error("argument -j/--jobs: must be at least 1")
+	if args.baseline_workers < 1:
+		parser.error("argument -bw/--baseline_workers: must be at least 1")
+	stageWorkers = {stage:args.jobs for stage in ("download","ingest","stats","baseline")}
+	if args.stage_workers:
+		try:
+			for pair in args.stage_workers.split(","):
+				stage, workers = pair.split("=")
+				assert stage.strip() in stageWorkers
+				stageWorkers[stage.strip()] = int(workers)
+				assert int(workers) >= 1
+		except (AssertionError, ValueError):
+			parser.error(f"argument -sw/--stage_workers: expected comma-separated stage=workers pairs, with stages from {', '.join(stageWorkers.keys())}")
 
 	## confirm exclusivity
 	try:
@@ -174,8 +211,14 @@ def updateData():
 			log.debug(message)
 	speak(f"Running with verbosity level {args.verbose}")
 
-	## set anomaly baseline script name
-	anomaly_script = os.path.join(os.path.dirname(__file__),"add_file_to_anomaly_baseline.py")
+	## anomaly baselines are updated in this process, on one pool of workers started when first needed
+	baselinePool = {"executor":None,"lock":threading.Lock()}
+	def getBaselineExecutor() -> ProcessPoolExecutor:
+		with baselinePool["lock"]:
+			if baselinePool["executor"] is None:
+				# spawned, so that workers do not inherit the pipeline's threads and open connections
+				baselinePool["executor"] = ProcessPoolExecutor(max_workers=args.baseline_workers,mp_context=multiprocessing.get_context("spawn"))
+			return baselinePool["executor"]
 
 	## get toDoList or directory listing
 	# toDoList
@@ -199,96 +242,144 @@ def updateData():
 		for f in dirFiles:
 			img = glam.getImageType(f)(f)
 			missing.append((img.product,img.date,tuple([img.path])))
-	try:
-		j = 0
-		l = len([f for f in missing])
-		for f in missing:
-			j += 1
-			product = f[0]
-			if product in octvi.supported_products and args.ancillary:
-				continue
-			if product in glam.ancillary_products and args.ndvi:
-				continue
-			if args.product and product != args.product:
-				continue
-			if args.list_missing:
-				print("{0} {1}".format(*f))
-				continue
-			log.info("{0} {1}, {2} of {3}".format(*f,j,l))
-			try:
-				# no directory given; pull from source
-				if not args.input_directory:
-					if product in octvi.supported_products:
-						# CHECKSUM!!!!! Current threshold for NDVI mosaic: 1GB
-						pathSize = 0
-						tries = 1
-						sizeThreshold = 1000000000
-						while pathSize < sizeThreshold: # threshold
-							try:
-								os.remove(paths[0])
-							except:
-								pass
-							if tries > 3: # don't try more than three times
-								raise glam.UnavailableError("File size less than 1GB after 3 tries")
-							paths = downloader.pullFromSource(*f,tempDir)
-							try:
-								pathSize = os.path.getsize(paths[0])
-								if pathSize < sizeThreshold:
-									log.warning(f"File size of {pathSize} bytes below threshold")
-							except IndexError:
-								raise glam.UnavailableError("No file detected")
-							tries += 1 # increment tries
-					else:
-						paths = downloader.pullFromSource(*f,tempDir)
-						# check that at least one file was downloaded
-						if len(paths) <1:
-							raise glam.UnavailableError("No file detected")
-						speak("-downloaded")
-				# directory provided; use paths on disk
-				else:
-					paths = f[2]
-				# iterate over file paths
-				for p in paths:
-					speak(p)
-					image = glam.getImageType(p)(p)
-					if (image.product == 'chirps') and (not args.stats) and (not args.ingest) and (args.mask_level=="ALL") and (args.admin_level=="ALL"):
-						speak("-purging corresponding chirps-prelim product")
-						try:
-							glam.purge('chirps-prelim',image.date,os.environ['glam_purge_key'])
-						except KeyError:
-							log.warning("glam_purge_key not set. Chirps preliminary product not purged.")
-					image.setStatus('downloaded',True)
-					speak(f"-collection: {image.collection}",2)
-					if not args.stats:
-						image.ingest()
-						image.setStatus('processed',True)
-						speak("--ingested")
-					if not args.ingest:
-						image.uploadStats(crop_level=args.mask_level,admin_level=args.admin_level)
-						image.setStatus('statGen',True)
-						speak("--stats generated")
-					# generate anomaly baselines
-					if (not args.no_anomaly_baseline) and (not (image.product in ["mera-2","chirps-prelim","MOD13Q4N"])):
-						anomaly_args = ["python",anomaly_script,p,"-n","20"]
-						try:
-							subprocess.call(anomaly_args)
-							speak("--anomaly baseline updated")
-						except:
-							log.exception("Failed to generate anomaly baseline")
-					if args.output_directory is None:
-						os.remove(p)
-						speak("--file removed")
-			except glam.UnavailableError:
-				log.info("(No file available)")
-			except:
-				if args.verbose > 0:
-					log.exception("(FAILED)")
+	# status changes are written once per file, in a single transaction
+	statusBuffer = glam.StatusBuffer()
+
+	## pick out the files to work on
+	todo = []
+	for f in missing:
+		product = f[0]
+		if product in octvi.supported_products and args.ancillary:
+			continue
+		if product in glam.ancillary_products and args.ndvi:
+			continue
+		if args.product and product != args.product:
+			continue
+		if args.list_missing:
+			print("{0} {1}".format(*f))
+			continue
+		todo.append(f)
+	l = len(todo)
+
+	## stages of the pipeline; each takes and returns a dict describing one file
+	def download(job:dict) -> dict:
+		f = job["file"]
+		log.info("{0} {1}, {2} of {3}".format(f[0],f[1],job["number"],l))
+		# no directory given; pull from source
+		if not args.input_directory:
+			if f[0] in octvi.supported_products:
+				# CHECKSUM!!!!! Current threshold for NDVI mosaic: 1GB
+				# octvi builds the mosaic from many tiles, so it can't be resumed
+				# like other downloads; a short mosaic is pulled again after a
+				# pause that doubles each time, as in fetch.download()
+				sizeThreshold = 1000000000
+				for tries in range(1,4): # don't try more than three times
+					paths = downloader.pullFromSource(*f,tempDir)
+					try:
+						pathSize = os.path.getsize(paths[0])
+					except IndexError:
+						raise glam.UnavailableError("No file detected")
+					if pathSize >= sizeThreshold:
+						break
+					log.warning(f"File size of {pathSize} bytes below threshold")
+					os.remove(paths[0])
+					if tries < 3:
+						time.sleep(fetch.BACKOFF * (2 ** (tries-1)))
 				else:
-					log.error("(FAILED)")
+					raise glam.UnavailableError("File size less than 1GB after 3 tries")
+			else:
+				paths = downloader.pullFromSource(*f,tempDir)
+				# check that at least one file was downloaded
+				if len(paths) <1:
+					raise glam.UnavailableError("No file detected")
+				speak("-downloaded")
+		# directory provided; use paths on disk
+		else:
+			paths = f[2]
+		job["paths"] = list(paths)
+		return job
+
+	def ingest(job:dict) -> dict:
+		job["images"] = []
+		for p in job["paths"]:
+			speak(p)
+			image = glam.getImageType(p)(p)
+			if (image.product == 'chirps') and (not args.stats) and (not args.ingest) and (args.mask_level=="ALL") and (args.admin_level=="ALL"):
+				speak("-purging corresponding chirps-prelim product")
+				try:
+					glam.purge('chirps-prelim',image.date,os.environ['glam_purge_key'])
+				except KeyError:
+					log.warning("glam_purge_key not set. Chirps preliminary product not purged.")
+			image.setStatus('downloaded',True,buffer=statusBuffer)
+			speak(f"-collection: {image.collection}",2)
+			if not args.stats:
+				image.ingest()
+				image.setStatus('processed',True,buffer=statusBuffer)
+				speak("--ingested")
+			job["images"].append(image)
+		return job
+
+	def stats(job:dict) -> dict:
+		if not args.ingest:
+			for image in job["images"]:
+				image.uploadStats(crop_level=args.mask_level,admin_level=args.admin_level)
+				image.setStatus('statGen',True,buffer=statusBuffer)
+				speak("--stats generated")
+		return job
+
+	def baseline(job:dict) -> dict:
+		# generate anomaly baselines
+		if not args.no_anomaly_baseline:
+			for image, p in zip(job["images"],job["paths"]):
+				if image.product in ["mera-2","chirps-prelim","MOD13Q4N"]:
+					continue
+				try:
+					anomalyBaseline.addFileToBaselines(p,executor=getBaselineExecutor(),n_workers=args.baseline_workers)
+					speak("--anomaly baseline updated")
+				except glam.UnavailableError as e:
+					log.warning(f"Anomaly baseline not updated: {e}")
+				except:
+					log.exception("Failed to generate anomaly baseline")
+		finish(job)
+		return job
+
+	def finish(job:dict, remove:bool = True) -> None:
+		if remove and (args.output_directory is None):
+			for p in job.get("paths",[]):
+				if os.path.exists(p):
+					os.remove(p)
+					speak("--file removed")
+		try:
+			statusBuffer.flush()
+		except:
+			log.exception("Failed to write status to database; will retry after next file")
+
+	def failed(stage:str, job:dict, e:Exception) -> None:
+		if isinstance(e,glam.UnavailableError):
+			log.info("{0} {1} (No file available)".format(*job["file"]))
+		elif args.verbose > 0:
+			log.error("{0} {1} (FAILED in {2})".format(*job["file"][:2],stage),exc_info=e)
+		else:
+			log.error("{0} {1} (FAILED in {2})".format(*job["file"][:2],stage))
+		# downloads are cleaned up, but files from --input_directory are only removed once processed
+		finish(job,remove=not args.input_directory)
+
+	## run stages side by side, with at most one NDVI file in each stage at a time
+	ndviOrProduct = lambda job: "ndvi" if job["file"][0] in octvi.supported_products else job["file"][0]
+	stages = [pipeline.Stage(name,func,workers=stageWorkers[name],key=ndviOrProduct,limits={"ndvi":1}) for name, func in (("download",download),("ingest",ingest),("stats",stats),("baseline",baseline))]
+	try:
+		pipeline.Pipeline(stages,on_error=failed,label=lambda job: "{0} {1}".format(*job["file"])).run({"file":f,"number":j+1} for j, f in enumerate(todo))
 	finally:
+		if baselinePool["executor"] is not None:
+			baselinePool["executor"].shutdown()
 		if not args.input_directory and args.output_directory is None:
 			for f in glob.glob(os.path.join(tempDir,"*")):
 				os.remove(f)
+		# a database error here must not hide an error already on its way out
+		try:
+			statusBuffer.flush()
+		except:
+			log.exception("Failed to write status to database; statuses still queued are lost")
 
 def rectifyStats():
 	parser = argparse.ArgumentParser(description="Backfill any missing statistics to database")
@@ -23,6 +23,7 @@ from pyproj import CRS
 from rasterio import features
 from rasterio.enums import Resampling
 from gdalnumeric import *
+from glam_data_processing.cog import cloudOptimize
 #print(sys.executable)
 
 
@@ -337,22 +338,7 @@ def rasterToBinary(input_raster,output_dir,name_override=None):
 
 def cloud_optimize_inPlace(in_file:str,compress="LZW") -> None:
 	"""Takes path to input and output file location. Reads tif at input location and writes cloud-optimized geotiff of same data to output location."""
-	## add overviews to file
-	cloudOpArgs = ["gdaladdo",in_file]
-	subprocess.call(cloudOpArgs)
-
-	## copy file
-	intermediate_file = in_file.replace(".tif",".TEMP.tif")
-	with open(intermediate_file,'wb') as a:
-		with open(in_file,'rb') as b:
-			shutil.copyfileobj(b,a)
-
-	## add tiling to file
-	cloudOpArgs = ["gdal_translate",intermediate_file,in_file,'-q','-co', "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', f"COMPRESS={compress}"]#, "-co", "PREDICTOR=2"]
-	subprocess.call(cloudOpArgs)
-
-	## remove intermediate
-	os.remove(intermediate_file)
+	cloudOptimize(in_file,compress=compress,predictor=False)
 
 
 def shapefileConversion(in_shapefile,model_raster,out_dir,name_override=None,clean=True,temp_dir_override=None,binary=True,*args,**kwargs):
@@ -480,7 +466,7 @@ def main():
 	if args.input_type == "RASTER":
 		rasterConversion(args.in_shapefile,args.model_raster,args.out_dir,args.name_override,args.keep_intermediate,binary=binary)
 	else:
-		shapefileConversion(args.in_shapefile,args.model_raster,args.out_dir,args.name_override,args.keep_intermediate,binary=binary,args.zone_field)
+		shapefileConversion(args.in_shapefile,args.model_raster,args.out_dir,args.name_override,args.keep_intermediate,binary=binary,zone_field=args.zone_field)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+
+"""
+This module reads credentials for the GLAM data archives and database
+
+Credentials are stored in 'glam_keys.json', two directory levels above
+__init__.py (see the 'glamconfigure' script), and are copied into
+environment variables. The file is read the first time a credential is
+actually needed, not when the package is imported.
+
+***
+
+Classes
+-------
+Credential
+CredentialsSet
+
+Functions
+---------
+readCredentialsFile
+loadCredentials
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import json, threading
+
+from glam_data_processing.exceptions import NoCredentialsError
+
+CREDENTIAL_KEYS = ["merrausername","merrapassword","swiusername","swipassword","glam_mysql_user","glam_mysql_pass"]
+
+_loaded = False
+_lock = threading.RLock()
+
+
+def readCredentialsFile() -> None:
+	"""Attempts to read glam_keys.json and write to environment variables
+
+	Raises NoCredentialsError if the file does not exist.
+	"""
+	credDir = os.path.dirname(os.path.dirname(__file__))
+	credFile = os.path.join(credDir,"glam_keys.json")
+	try:
+		with open(credFile,'r') as f:
+			keys = json.loads(f.read())
+		log.debug(f"Found credentials file: {credFile}")
+	except FileNotFoundError:
+		raise NoCredentialsError("Credentials file ('glam_keys.json') not found.")
+	for k in CREDENTIAL_KEYS:
+		try:
+			log.debug(f"Adding variable to environment: {k}")
+			os.environ[k] = keys[k]
+		except KeyError:
+			log.debug("Variable not found in credentials file")
+			continue
+
+
+def loadCredentials() -> None:
+	"""Reads the credentials file into the environment, once per process"""
+	global _loaded
+	with _lock:
+		if _loaded:
+			return None
+		_loaded = True
+		try:
+			readCredentialsFile()
+		except NoCredentialsError:
+			log.warning("No credentials file found. Reading directly from environment variables instead.")
+
+
+class Credential:
+	"""Class attribute that resolves to a credential's value, or None, on access"""
+	def __init__(self, key:str):
+		self.key = key
+	def __get__(self, instance, owner):
+		loadCredentials()
+		return os.environ.get(self.key)
+
+
+class CredentialsSet:
+	"""Class attribute that reports whether all of the given credentials are set"""
+	def __init__(self, *keys):
+		self.keys = keys
+	def __get__(self, instance, owner):
+		loadCredentials()
+		return all(k in os.environ for k in self.keys)
@@ -0,0 +1,342 @@
+#! /usr/bin/env python
+
+"""
+This module manages the shared connection to the GLAM system database
+
+A single SQLAlchemy engine is created the first time it is needed, rather
+than at import time, and its connection pool is shared by every class in
+the package. Tables are reflected the first time they are requested. A
+process created with os.fork() drops the engine it inherited and builds
+its own on first use, so parent and child never share a socket.
+
+Pool behaviour can be tuned with the following environment variables, or
+at runtime with configureEngine():
+
+	GLAM_DB_POOL_SIZE       persistent connections kept open (default 2)
+	GLAM_DB_MAX_OVERFLOW    extra connections allowed under load (default 3)
+	GLAM_DB_POOL_RECYCLE    seconds before a connection is replaced (default 3600)
+	GLAM_DB_POOL_PRE_PING   test connections before use (default true)
+
+***
+
+Classes
+-------
+LazyEngine
+LazyMetadata
+LazyTable
+CredentialsMissing
+StatusBuffer
+
+Functions
+---------
+completedSql
+statusUpdateSql
+hasCredentials
+configureEngine
+getEngine
+getDbMetadata
+getTable
+disposeEngine
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import threading
+
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.credentials import loadCredentials
+from glam_data_processing.exceptions import BadInputError, NoCredentialsError
+
+db = lazyImport("sqlalchemy")
+
+## rds endpoint
+
+ENDPOINT = "glam-production.c1khdx2rzffa.us-east-1.rds.amazonaws.com"
+DATABASE = "modis_dev"
+
+## connection pool settings
+
+POOL_SETTINGS = {
+	"pool_size":int(os.environ.get("GLAM_DB_POOL_SIZE",2)),
+	"max_overflow":int(os.environ.get("GLAM_DB_MAX_OVERFLOW",3)),
+	"pool_recycle":int(os.environ.get("GLAM_DB_POOL_RECYCLE",3600)),
+	"pool_pre_ping":os.environ.get("GLAM_DB_POOL_PRE_PING","true").lower() not in ("0","false","no")
+	}
+
+## product_status columns
+
+STATUS_STAGES = ['downloaded','processed','statGen']
+
+## module state
+
+_engine = None
+_engine_pid = None
+_metadata = None
+_tables = {}
+_orphans = [] # engines inherited across a fork; kept referenced so the child never closes the parent's sockets
+_lock = threading.RLock()
+
+
+def hasCredentials() -> bool:
+	"""Returns whether database credentials are set in the environment"""
+	loadCredentials()
+	return ('glam_mysql_user' in os.environ) and ('glam_mysql_pass' in os.environ)
+
+
+def configureEngine(**kwargs) -> None:
+	"""Updates connection pool settings
+
+	Any existing engine is disposed, so the new settings take
+	effect the next time a connection is requested.
+
+	***
+
+	Parameters
+	----------
+	pool_size:int
+		Number of persistent connections kept in the pool
+	max_overflow:int
+		Number of additional connections allowed when the pool is exhausted
+	pool_recycle:int
+		Age in seconds after which a connection is replaced
+	pool_pre_ping:bool
+		Whether to test each connection for liveness on checkout
+	"""
+	for k in kwargs.keys():
+		if k not in POOL_SETTINGS:
+			raise BadInputError(f"Pool setting '{k}' not recognized. Expected one of: {', '.join(POOL_SETTINGS.keys())}")
+	with _lock:
+		POOL_SETTINGS.update(kwargs)
+		disposeEngine()
+
+
+def getEngine() -> "sqlalchemy.engine.Engine":
+	"""Returns the shared database engine, creating it on first call"""
+	global _engine, _engine_pid
+	with _lock:
+		# an engine created by another process (e.g. a parent we were
+		# forked from) must not be used here
+		if (_engine is not None) and (_engine_pid != os.getpid()):
+			_abandonEngine()
+		if _engine is None:
+			loadCredentials()
+			try:
+				mysql_user = os.environ['glam_mysql_user']
+				mysql_pass = os.environ['glam_mysql_pass']
+			except KeyError:
+				raise NoCredentialsError("Database credentials not found. Use 'glamconfigure' on command line to set archive credentials.")
+			log.debug(f"Creating database engine with settings: {POOL_SETTINGS}")
+			_engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{ENDPOINT}/{DATABASE}', **POOL_SETTINGS)
+			_engine_pid = os.getpid()
+		return _engine
+
+
+def getDbMetadata() -> "sqlalchemy.MetaData":
+	"""Returns the shared MetaData object that holds all reflected tables"""
+	global _metadata
+	with _lock:
+		if _metadata is None:
+			_metadata = db.MetaData()
+		return _metadata
+
+
+def getTable(name:str) -> "sqlalchemy.Table":
+	"""Returns a reflected table, reflecting it from the database on first request
+
+	***
+
+	Parameters
+	----------
+	name:str
+		Name of the table in the GLAM database; e.g. 'product_status'
+	"""
+	with _lock:
+		try:
+			return _tables[name]
+		except KeyError:
+			log.debug(f"Reflecting table: {name}")
+			_tables[name] = db.Table(name, getDbMetadata(), autoload=True, autoload_with=getEngine())
+			return _tables[name]
+
+
+def disposeEngine() -> None:
+	"""Closes all pooled connections and discards the shared engine
+
+	Reflected tables are kept, since they do not depend on any
+	particular connection.
+	"""
+	global _engine, _engine_pid
+	with _lock:
+		if _engine is None:
+			return None
+		if _engine_pid == os.getpid():
+			_engine.dispose()
+		else:
+			_abandonEngine()
+		_engine = None
+		_engine_pid = None
+
+
+def _abandonEngine() -> None:
+	"""Drops an engine inherited from another process without touching its connections"""
+	global _engine, _engine_pid
+	if _engine is None:
+		return None
+	try:
+		_engine.dispose(close=False) # sqlalchemy >= 1.4.33
+	except TypeError:
+		_orphans.append(_engine)
+	_engine = None
+	_engine_pid = None
+
+
+def _afterFork() -> None:
+	"""Run in every child process immediately after os.fork()"""
+	global _lock
+	_lock = threading.RLock() # the parent's lock may have been held by another thread at fork time
+	_abandonEngine()
+
+if hasattr(os,"register_at_fork"):
+	os.register_at_fork(after_in_child=_afterFork)
+
+
+def completedSql(new_values:dict = None) -> str:
+	"""Returns an assignment that recomputes 'completed' within an UPDATE of product_status
+
+	'completed' is true when both 'processed' and 'statGen' are true, and
+	is left unchanged if either is NULL.
+
+	***
+
+	Parameters
+	----------
+	new_values:dict
+		Default None; maps stage names to SQL expressions for the values
+		being set in the same statement, so the result does not depend on
+		the order in which the database applies assignments; e.g.
+		{'processed':'1'}
+	"""
+	if new_values is None:
+		new_values = {}
+	processed = new_values.get('processed','processed')
+	statGen = new_values.get('statGen','statGen')
+	return f"completed = COALESCE({processed} = 1 AND {statGen} = 1, completed)"
+
+
+def statusUpdateSql(stages) -> str:
+	"""Returns an UPDATE statement that sets the given stages of one product_status row
+
+	The statement also recomputes 'completed' for that row, and takes
+	bound parameters :product, :date, and one :<stage> per stage.
+
+	***
+
+	Parameters
+	----------
+	stages:list
+		Names of product_status columns to set; each one of
+		'downloaded', 'processed', or 'statGen'
+	"""
+	for stage in stages:
+		if stage not in STATUS_STAGES:
+			raise BadInputError(f"Stage '{stage}' not recognized. Expected one of: {', '.join(STATUS_STAGES)}")
+	assignments = [f"{stage} = :{stage}" for stage in stages] + [completedSql({stage:f":{stage}" for stage in stages})]
+	return f"UPDATE product_status SET {', '.join(assignments)} WHERE product = :product AND date = :date;"
+
+
+class StatusBuffer:
+	"""
+	Collects product_status changes and writes them in a single transaction
+
+	Changes to the same row are merged, so that each row is updated
+	once per flush no matter how many stages were set. Rows that set the
+	same stages are written together with executemany(). The buffer is
+	flushed on leaving a 'with' block, and is safe to share between threads.
+
+	...
+
+	Methods
+	-------
+	set(product:str,date:str,stage:str,status:bool) -> None:
+		queues a status change
+	flush() -> int:
+		writes all queued changes; returns number of rows written
+	"""
+
+	def __init__(self):
+		self._pending = {}
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._pending)
+
+	def __repr__(self):
+		return f"<Instance of StatusBuffer, {len(self)} rows pending>"
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.flush()
+		return False
+
+	def set(self, product:str, date:str, stage:str, status:bool) -> None:
+		if stage not in STATUS_STAGES:
+			raise BadInputError(f"Stage '{stage}' not recognized. Expected one of: {', '.join(STATUS_STAGES)}")
+		with self._lock:
+			self._pending.setdefault((product,date),{})[stage] = bool(status)
+
+	def flush(self) -> int:
+		with self._lock:
+			pending = self._pending
+			self._pending = {}
+		if not pending:
+			return 0
+		# group rows by the set of stages they change
+		groups = {}
+		for (product,date), changes in pending.items():
+			stages = tuple(s for s in STATUS_STAGES if s in changes)
+			groups.setdefault(stages,[]).append(dict(changes,product=product,date=date))
+		try:
+			with getEngine().begin() as connection:
+				for stages, rows in groups.items():
+					connection.execute(db.text(statusUpdateSql(stages)),rows)
+		except Exception:
+			# put changes back, without overwriting anything queued since
+			with self._lock:
+				for key, changes in pending.items():
+					self._pending[key] = dict(changes,**self._pending.get(key,{}))
+			raise
+		log.debug(f"Flushed status changes for {len(pending)} rows")
+		return len(pending)
+
+
+## class attributes
+
+class LazyEngine:
+	"""Class attribute that resolves to the shared engine on access"""
+	def __get__(self, instance, owner):
+		return getEngine()
+
+
+class LazyMetadata:
+	"""Class attribute that resolves to the shared MetaData object on access"""
+	def __get__(self, instance, owner):
+		return getDbMetadata()
+
+
+class LazyTable:
+	"""Class attribute that resolves to a reflected table on access"""
+	def __init__(self, name:str):
+		self.name = name
+	def __get__(self, instance, owner):
+		return getTable(self.name)
+
+
+class CredentialsMissing:
+	"""Class attribute that reports whether database credentials are absent at time of access"""
+	def __get__(self, instance, owner):
+		return not hasCredentials()
@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+
+"""
+This module decodes downloaded source files without temporary copies
+
+CHIRPS files arrive gzipped, preliminary CHIRPS files as plain GeoTIFFs,
+and SWI files as NetCDF. Rather than writing each to disk, unzipping it
+to a second file, and copying it a third time to set nodata or extract a
+variable, downloads are streamed (and unzipped on the fly) into GDAL's
+in-memory filesystem, /vsimem/, and NetCDF variables are opened in place
+as subdatasets. Nodata is passed on to the projection step as metadata.
+The server's Content-Length is checked against the bytes received while
+the file streams.
+
+***
+
+Functions
+---------
+iterResponse
+iterFile
+writeVsimem
+netcdfSubdataset
+unlink
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import zlib
+
+from glam_data_processing import cog
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.exceptions import UnavailableError
+
+gdal = lazyImport("gdal", on_load=lambda m: m.UseExceptions())
+
+CHUNK_SIZE = 1024*1024
+
+
+def iterResponse(r:"requests.Response"):
+	"""Yields the body of a streamed requests response in chunks"""
+	return r.iter_content(chunk_size = CHUNK_SIZE)
+
+
+def iterFile(f):
+	"""Yields the contents of an open binary file-like object (e.g. from urlopen) in chunks"""
+	return iter(lambda: f.read(CHUNK_SIZE),b"")
+
+
+def writeVsimem(chunks, name:str, expected_size:int = None, gunzip:bool = False) -> str:
+	"""Writes a stream of bytes to a new /vsimem/ file, and returns its path
+
+	Raises UnavailableError if the number of bytes received does not
+	match expected_size. Nothing is left in /vsimem/ on failure; on
+	success, the caller should unlink() the path once it is finished
+	with it.
+
+	***
+
+	Parameters
+	----------
+	chunks:iterable
+		Chunks of bytes; see iterResponse() and iterFile()
+	name:str
+		Name of the file, used to build a unique /vsimem/ path; e.g.
+		"chirps.2020-01-01.tif"
+	expected_size:int
+		Default None; number of bytes promised by the server, before any
+		decompression. If not set, the size is not checked
+	gunzip:bool
+		Default False; whether to decompress gzip data while writing
+	"""
+	path = cog.vsimemPath(name)
+	observedSize = 0
+	decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gunzip else None
+	f = gdal.VSIFOpenL(path,"wb")
+	try:
+		for chunk in chunks:
+			observedSize += len(chunk)
+			if decompressor is not None:
+				data = decompressor.decompress(chunk)
+				while decompressor.eof and decompressor.unused_data: # next gzip member
+					rest = decompressor.unused_data
+					gdal.VSIFWriteL(data,1,len(data),f)
+					decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+					data = decompressor.decompress(rest)
+				chunk = data
+			if chunk:
+				gdal.VSIFWriteL(chunk,1,len(chunk),f)
+		if decompressor is not None:
+			data = decompressor.flush()
+			if data:
+				gdal.VSIFWriteL(data,1,len(data),f)
+			if not decompressor.eof:
+				raise UnavailableError(f"Truncated gzip data for {name}")
+		if (expected_size is not None) and (observedSize != int(expected_size)):
+			raise UnavailableError(f"Checksum failure for {name}\nExpected file size:\t{expected_size} bytes\nObserved file size:\t{observedSize} bytes")
+	except BaseException:
+		gdal.VSIFCloseL(f)
+		f = None
+		unlink(path)
+		raise
+	finally:
+		if f is not None:
+			gdal.VSIFCloseL(f)
+	return path
+
+
+def netcdfSubdataset(path:str, variable:str) -> str:
+	"""Returns the GDAL name of one variable in a NetCDF file, for opening it in place
+
+	Raises UnavailableError if the file has no such variable.
+
+	***
+
+	Parameters
+	----------
+	path:str
+		Path to NetCDF file
+	variable:str
+		Name of variable; e.g. "SWI_010"
+	"""
+	dataset = gdal.Open(path,0)
+	subdatasets = dataset.GetSubDatasets()
+	del dataset
+	for sd in subdatasets:
+		if sd[0].split(":")[-1] == variable:
+			return sd[0]
+	raise UnavailableError(f"Variable {variable} not found in {path}")
+
+
+def unlink(path:str) -> None:
+	"""Removes a file from /vsimem/, if it exists"""
+	try:
+		gdal.Unlink(path)
+	except RuntimeError: # does not exist
+		pass
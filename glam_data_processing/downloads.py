@@ -20,41 +20,27 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 #logging.basicConfig(level="DEBUG")
 log = logging.getLogger(__name__)
 
-import boto3, collections, ftplib, glob, gdal, gzip, json, math, octvi, re, requests, shutil, subprocess, sys, urllib
-from botocore.exceptions import ClientError
-boto3.set_stream_logger('botocore', level='INFO')
+import collections, ftplib, glob, json, math, re, sys, urllib
 from datetime import datetime
 from ftplib import FTP
-from gdalnumeric import *
-gdal.UseExceptions()
-import numpy as np
-from osgeo import osr
 from urllib.error import URLError
 from urllib.request import urlopen, Request, URLError, HTTPError
 
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.availability import filterAvailable, probe
+from glam_data_processing.listings import chirpsUrl, merra2Listing, octviDates
+from glam_data_processing import decode, fetch, merra2, regrid
+from glam_data_processing.credentials import readCredentialsFile
 from glam_data_processing.exceptions import BadInputError, NoCredentialsError, UnavailableError
 
-## getting credentials
+## heavy dependencies are imported on first use
 
-def readCredentialsFile() -> None:
-	"""Reads merra / swi usernames and passwords from credentials file into environment variables"""
-	# credentials file is stored at ../glam_keys.json
-	credDir = os.path.dirname(os.path.dirname(__file__))
-	credFile = os.path.join(credDir,"glam_keys.json")
-	try:
-		with open(credFile,'r') as f:
-			keys = json.loads(f.read())
-		log.debug(f"Found credentials file: {credFile}")
-	except FileNotFoundError:
-		raise NoCredentialsError("Credentials file ('glam_keys.json') not found.")
-	# read credentials from file into local environment variables
-	for k in ["merrausername","merrapassword","swiusername","swipassword"]:
-		try:
-			log.debug(f"Adding variable to environment: {k}")
-			os.environ[k] = keys[k]
-		except KeyError:
-			log.debug(f"Variable not found in credentials file")
-			continue
+boto3 = lazyImport("boto3", on_load=lambda m: m.set_stream_logger('botocore', level='INFO'))
+botoExceptions = lazyImport("botocore.exceptions")
+gdal = lazyImport("gdal", on_load=lambda m: m.UseExceptions())
+gdalnumeric = lazyImport("gdalnumeric")
+np = lazyImport("numpy")
+octvi = lazyImport("octvi")
 
 
 def pullFromSource(product:str,date:str,output_directory:str,file_name_override:str = None) -> tuple:
@@ -95,122 +81,6 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 		return ()
 
 
-	# helper functions
-
-
-	def project_to_sinusoidal_inPlace(in_file:str) -> int:
-			"""
-			This function, given a path to a file, projects it to sinusoidal in place
-
-			...
-
-			Parameters
-			----------
-			in_file:str
-				string path to input file; file name must match "{product}.{date}*.tif"
-
-			Return values
-			-------------
-			0: function executed successfully
-			1: projection failed
-			2: gdal failed to read file
-			"""
-			product = os.path.basename(in_file).split(".")[0]
-			# Merra-2 and CHIRPS come as un-projected arrays, and must be defined to geographic before projecting to sinusoidal
-			if len(gdal.Open(in_file,0).GetProjection()) == 0:
-				srs = osr.SpatialReference() # create SpatialReference object
-				srs.ImportFromEPSG(4326) # standard geographic coordinate system EPSG number
-				ds = None
-				try:
-					ds = gdal.Open(in_file,gdal.GA_Update) # open file in update mode
-				except RuntimeError: # thrown if file path is bad
-					log.error(f"--projection failed: {in_file} does not exist")
-				if ds:
-					res = ds.SetProjection(srs.ExportToWkt()) # define projection to geographic
-					if res != 0:
-						log.error("--projection failed: {}".format(str(res)))
-						return 1
-					ds = None
-				else:
-					log.error("--could not open with GDAL")
-					return 2
-			# reproject to sinusoidal
-			## copy to intermediate file
-			intermediate_file = in_file.replace(".tif",".TEMP.tif")
-			with open(intermediate_file,'wb') as a:
-				with open(in_file,'rb') as b:
-					shutil.copyfileobj(b,a)
-			# 'sinus' is the WKT for MODIS sinusoidal projection
-			sinus = 'PROJCS["Sinusoidal",GEOGCS["GCS_Undefined",DATUM["Undefined",SPHEROID["User_Defined_Spheroid",6371007.181,0.0]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],UNIT["Meter",1.0]]' # MODIS sinusoidal projection
-			if product:# == "swi":
-				intF= gdal.Open(intermediate_file,0)
-				in_srs = intF.GetProjection()
-				intF = None
-				gdal.Warp(in_file,intermediate_file,srcSRS = in_srs,dstSRS = sinus) #
-			else:
-				gdal.Warp(in_file,intermediate_file,dstSRS = sinus) # reproject back to original file name, this time in MODIS sinusoidal
-			os.remove(intermediate_file) # delete intermediate file
-			# CHECK EXTENTS AGAINST MODIS
-			## sometimes the projection takes the file boundaries outside the valid extent of
-			## MODIS sinusoidal. When that happens, we have to clip it back down.
-			needsClipped = False
-			ds = gdal.Open(in_file,0)
-			gt = ds.GetGeoTransform()
-			cell = gt[1]
-			x = ds.RasterXSize
-			y = ds.RasterYSize
-			north = gt[3]
-			west = gt[0]
-			east = west+(cell*x)
-			south = north-(cell*y)
-			maxNorth= 9962342# 9972315.0495 * 0.999
-			maxWest= -22735470# -22758229.000 * 0.999
-			maxSouth = -9143189# -9152341.5816 * 0.999
-			maxEast= 20958445# 20979424.893 * 0.999
-			if north > maxNorth:
-				north = maxNorth
-				needsClipped = True
-			if west < maxWest:
-				west = maxWest
-				needsClipped = True
-			if south < maxSouth:
-				south = maxSouth
-				needsClipped = True
-			if east > maxEast:
-				east = maxEast
-				needsClipped = True
-			if needsClipped:
-				# clip with GDAL_translate
-				clipFile = in_file.replace(".tif",".CLIPPING.tif")
-				with open(clipFile,'wb') as a:
-					with open(in_file,'rb') as b:
-						shutil.copyfileobj(b,a)
-				clip_args = ["gdal_translate", "-q", "-projwin",str(west),str(north),str(east),str(south),clipFile,in_file]
-				subprocess.call(clip_args)
-				os.remove(clipFile)
-			return 0
-
-
-	def cloud_optimize_inPlace(in_file:str) -> None:
-		"""Takes path to input and output file location. Reads tif at input location and writes cloud-optimized geotiff of same data to output location."""
-		## add overviews to file
-		cloudOpArgs = ["gdaladdo",in_file]
-		subprocess.call(cloudOpArgs)
-
-		## copy file
-		intermediate_file = in_file.replace(".tif",".TEMP.tif")
-		with open(intermediate_file,'wb') as a:
-			with open(in_file,'rb') as b:
-				shutil.copyfileobj(b,a)
-
-		## add tiling to file
-		cloudOpArgs = ["gdal_translate",intermediate_file,in_file,'-q','-co', "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', "COMPRESS=LZW", "-co", "PREDICTOR=2"]
-		subprocess.call(cloudOpArgs)
-
-		## remove intermediate
-		os.remove(intermediate_file)
-
-
 	# individual download functions
 
 
@@ -230,175 +100,48 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 		"""
 
 		# handle variable options
-		minimum = maximum = mean = False
 		if variable == "ALL":
-			minimum = True
-			maximum = True
-			mean = True
-		elif variable == "MIN":
-			minimum = True
-		elif variable == "MAX":
-			maximum = True
-		elif variable == "MEAN":
-			mean = True
+			metrics = ["min","max","mean"]
+		elif variable in ("MIN","MAX","MEAN"):
+			metrics = [variable.lower()]
 		else:
 			raise BadInputError(f"Parameter 'variable' expected one of MIN, MEAN, MAX, ALL, but got '{variable}'")
 
 
 
-		## define how to mosaic list of file paths into a multi-day composite
-		def mosaic_merra2(path_list:list,metric:str) -> str:
-			"""
-			Takes a list of file paths, and mosaics results to a file ('merra-2.{date}.{metric}.tif') in output directory
-			Returns file path to mosaic
-			"""
-			def create_array_from_dataset(path):
-				"""Converts data set to NumPy array"""
-				sds = gdal.Open(path,0)
-				band = sds.GetRasterBand(1)
-				outArray=BandReadAsArray(band)
-				del sds
-				return outArray
-			def save_array_to_file(in_array,out_path):
-				"""Takes numPy array, out file path, and model file (for size, geo_transform, and projection) to create geoTiff output"""
-				driver = gdal.GetDriverByName('GTiff')
-				dataset = driver.Create(out_path,576,361,1,gdal.GDT_Float32,['COMPRESS=LZW'])
-				dataset.GetRasterBand(1).WriteArray(in_array)
-				dataset.SetGeoTransform((-180.3125, 0.625, 0.0, 90.25, 0.0, -0.5))
-				dataset.GetRasterBand(1).SetNoDataValue(1E15)
-				dataset.FlushCache() # Write to disk
-				del dataset
-				return 0
-
-			out = os.path.join(out_dir,f"merra-2.{date}.tif")
-
-			metric_arrays = []
-			for f in path_list:
-				metric_arrays.append(create_array_from_dataset(f))
-			metric_cube = np.dstack(metric_arrays)
-			if metric == "min":
-				oa = np.amin(metric_cube,axis=2)
-				on = out.replace(".tif",".min.tif")
-			elif metric == "max":
-				oa = np.amax(metric_cube,axis=2)
-				on = out.replace(".tif",".max.tif")
-			elif metric == "mean":
-				oa = np.mean(metric_cube,axis=2)
-				on = out.replace(".tif",".mean.tif")
-			else:
-				w=f"WARNING: {k} does not match known stat (min, max, mean)\nSource: Merra-2, {out}"
-				log.warning(w)
-			save_array_to_file(oa,on)
-			return on
-
-		## generate list of urls (we have to mosaic merra)
-		m2Urls = []
-		for i in range(5): # we are collecting the requested date along with 4 previous days
-			mDate = datetime.strptime(date,"%Y-%m-%d") - timedelta(days=i)
-			mYear = mDate.strftime("%Y")
-			mMonth = mDate.strftime("%m").zfill(2)
-			mDay = mDate.strftime("%d").zfill(2)
-			pageUrl = f"https://goldsmr4.gesdisc.eosdis.nasa.gov/data/MERRA2/M2SDNXSLV.5.12.4/{mYear}/{mMonth}/"
-			try:
-				pageObject = urlopen(pageUrl)
-				pageText = str(pageObject.read())
-				ex = re.compile(f'MERRA2\S*{mYear}{mMonth}{mDay}.nc4') # regular expression that matches file name of desired date file
-				mFileName = re.search(ex,pageText).group() # matches desired file name from web page
-				mUrl = pageUrl + mFileName
-				m2Urls.append(mUrl)
-			except HTTPError: # if any file in the range is missing, don't generate the mosaic at all
-				log.warning(f"No Merra-2 file exists for {date}")
-				return ()
-
-		## dictionary of empty lists of metric-specific file paths, waiting to be filled
-		merraFiles = {}
-		if minimum:
-			merraFiles['min']=[]
-		if maximum:
-			merraFiles['max']=[]
-		if mean:
-			merraFiles['mean']=[]
-
-		## loop over list of urls
-		log.debug(m2Urls)
-		for url in m2Urls:
-			urlDate = url.split(".")[-2]
-			## use requests module to download MERRA-2 file (.nc4)
-			with requests.Session() as session:
-				session.auth = (credentials['merraUsername'], credentials['merraPassword'])
-				r1 = session.request('get',url)
-				r = session.get(r1.url,auth=(credentials['merraUsername'], credentials['merraPassword']))
-			outNc4 = os.path.join(out_dir,f"merra-2.{urlDate}.NETCDF.TEMP.nc") # NetCDF file path
-			# write output .nc4 file
-			with open(outNc4,"wb") as fd: # write data in chunks
-				for chunk in r.iter_content(chunk_size = 1024*1024):
-					fd.write(chunk)
-
-			##CHECKSUM
-			observedSize = int(os.stat(outNc4).st_size) # size of downloaded file in bytes
-			expectedSize = int(r.headers['Content-Length']) # size of promised file in bytes, extracted from server-delivered headers
-
-			## checksum failure; return empty tuple
-			if observedSize != expectedSize: # checksum failure
-				w=f"WARNING:\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-				log.warning(w)
-				return () # no files for you today, but we'll try again tomorrow!
-
-
-			# as of now it's a .nc4 file, we need TIFFs of just the 3 subdatasets we're interested in (T2MMEAN, T2MIN, T2MAX)
-
-			## extract subdataset names
-			dataset= gdal.Open(outNc4,0)
-
-			if minimum:
-				sdMin = dataset.GetSubDatasets()[3][0] # full name of T2MMIN subdataset
-				minOut = os.path.join(out_dir,f"M2_MIN.{urlDate}.TEMP.tif")
-				subprocess.call(["gdal_translate","-q",sdMin,minOut]) # calling the command line to produce the tiff
-				merraFiles['min'].append(minOut)
-
-			if maximum:
-				sdMax = dataset.GetSubDatasets()[1][0] # full name of T2MMAX subdataset
-				maxOut = os.path.join(out_dir,f"M2_MAX.{urlDate}.TEMP.tif")
-				subprocess.call(["gdal_translate","-q",sdMax,maxOut]) # calling the command line to produce the tiff
-				merraFiles['max'].append(maxOut)
-
-			if mean:
-				sdMean = dataset.GetSubDatasets()[2][0] # full name of T2MMEAN subdataset
-				meanOut = os.path.join(out_dir,f"M2_MEAN.{urlDate}.TEMP.tif")
-				subprocess.call(["gdal_translate","-q",sdMean,meanOut]) # calling the command line to produce the tiff
-				merraFiles['mean'].append(meanOut)
-
-
-			## delete netCDF file and GDAL dataset object
+		## define how to write a composite array to file
+		def save_array_to_file(in_array,out_path):
+			"""Takes numPy array, out file path, and model file (for size, geo_transform, and projection) to create geoTiff output"""
+			driver = gdal.GetDriverByName('GTiff')
+			dataset = driver.Create(out_path,576,361,1,gdal.GDT_Float32,['COMPRESS=LZW'])
+			dataset.GetRasterBand(1).WriteArray(in_array)
+			dataset.SetGeoTransform((-180.3125, 0.625, 0.0, 90.25, 0.0, -0.5))
+			dataset.GetRasterBand(1).SetNoDataValue(1E15)
+			dataset.FlushCache() # Write to disk
 			del dataset
-			os.remove(outNc4)
-
-
+			return 0
 
-		# merraFiles now stores a list of files for each metric type
-		# for each metric, we mosaic all the files by that metric
-		# e.g. minimum of the "mins", maximum of all "maxes", mean of all "means"
+		## composite the requested date along with 4 previous days
+		# minimum of the "mins", maximum of all "maxes", mean of all "means" are
+		# accumulated as each day arrives; days extracted for an earlier
+		# composite are read from the local cache, so usually only the newest
+		# day is downloaded
+		try:
+			composite = merra2.compositeDays(merra2.compositeDates(date),out_dir,(credentials['merraUsername'], credentials['merraPassword']),metrics=metrics)
+		except UnavailableError as e: # if any file in the range is missing, don't generate the mosaic at all
+			log.warning(e)
+			return () # no files for you today, but we'll try again tomorrow!
 
-		## loop over metric in ("min","mean","max")
+		## loop over requested metrics
 		merraOut = []
-		log.debug(merraFiles)
-		for metric in merraFiles.keys():
+		for metric in composite.metrics:
 
-			## get list of files to be mosaicked
-			mosaic_fileList = merraFiles[metric]
+			## write mosaic to file ('merra-2.{date}.{metric}.tif') in output directory
+			mosaicPath = os.path.join(out_dir,f"merra-2.{date}.{metric}.tif")
+			save_array_to_file(composite.result(metric),mosaicPath)
 
-			## mosaic into out product
-			mosaicPath = mosaic_merra2(mosaic_fileList, metric)
-
-			## delete individual files
-			for f in mosaic_fileList:
-				os.remove(f)
-
-			## project mosaic to sinusoidal
-			project_to_sinusoidal_inPlace(mosaicPath)
-
-			## cloud-optimize mosaic
-			cloud_optimize_inPlace(mosaicPath)
+			## project mosaic to sinusoidal and cloud-optimize
+			regrid.sinusoidalCog(mosaicPath)
 
 			## add mosaic to list
 			merraOut.append(mosaicPath)
@@ -417,7 +160,6 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 		try:
 			## define file locations
 			file_unzipped = os.path.join(out_dir,f"chirps.{date}.tif") # output location for final file
-			file_zipped=file_unzipped+".gz" # initial location for zipped version of file
 
 			## get url to be downloaded
 			cDate = datetime.strptime(date,"%Y-%m-%d")
@@ -427,52 +169,27 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 			# falls in (1-10, 11-20, 21-end). Chirps urls use these integers instead of day
 			cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
 			url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif.gz"
-
-			# download the gnuzip file
-			with requests.Session() as session:
-				# not sure if both these steps are strictly necessary. Try removing
-				# one and see if everything breaks!
-				r1 = session.request('get',url)
-				r = session.get(r1.url)
-			# nonexistent imagery gives a 404 response
-			if r.status_code != 200:
+			if chirpsUrl("chirps",date) is None: # not in directory listing
 				log.warning(f"Url {url} not found")
 				return ()
-			# write zipped .gz file to disk
-			with open(file_zipped,"wb") as fd: # write data in chunks
-				for chunk in r.iter_content(chunk_size = 1024*1024):
-					fd.write(chunk)
-
-			##CHECKSUM
-			observedSize = int(os.stat(file_zipped).st_size) # size of downloaded file in bytes
-			expectedSize = int(r.headers['Content-Length']) # size of promised file in bytes, extracted from server-delivered headers
-
-			## checksum failure; return empty tuple
-			if observedSize != expectedSize: # checksum failure
-				w=f"WARNING:\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-				log.warning(w)
+
+			## download the gnuzip file, unzipping into memory and checking size as it streams;
+			## a copy in the source cache is used instead, if there is one
+			try:
+				chunks, expectedSize = fetch.stream(url)
+				file_mem = decode.writeVsimem(chunks,os.path.basename(file_unzipped),expectedSize,gunzip=True)
+			except UnavailableError as e: # e.g. nonexistent imagery gives a 404 response
+				log.warning(e)
 				return () # no files for you today, but we'll try again tomorrow!
 
-			## use gzip to unzip file to final location
-			tf = file_unzipped.replace(".tif",".UNMASKED.tif")
-			with gzip.open(file_zipped) as fz:
-				with open(tf,"w+b") as fu:
-					shutil.copyfileobj(fz,fu)
-			os.remove(file_zipped) # delete zipped version
-
-			## apply nodata mask to file
-			chirps_noData_args = ["gdal_translate","-q","-a_nodata", "-9999",tf,file_unzipped] # apply NoData mask
-			subprocess.call(chirps_noData_args)
-			os.remove(tf) # delete unmasked file
-
-			## project file to sinusoidal
-			prj = project_to_sinusoidal_inPlace(file_unzipped)
-			if prj != 0:
+			## project file to sinusoidal and cloud-optimize; nodata is applied as it is read
+			try:
+				regrid.sinusoidalCog(file_mem,file_unzipped,src_nodata=-9999)
+			except RuntimeError:
 				log.warning(f"Failed to project {file_unzipped}")
 				return ()
-
-			## cloud-optimize file
-			cloud_optimize_inPlace(file_unzipped)
+			finally:
+				decode.unlink(file_mem)
 
 			## return file path string in tuple
 			return tuple([file_unzipped])
@@ -491,7 +208,6 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 		try:
 			# create formatted output filename
 			file_out = os.path.join(out_dir,f"chirps-prelim.{date}.tif")
-			tf = file_out.replace(".tif",".UNMASKED.tif") # temporary file to store before applying nodata mask
 
 			## get url to be downloaded
 			cDate = datetime.strptime(date,"%Y-%m-%d")
@@ -501,47 +217,27 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 			# based on which third of the month it falls in (1-10, 11-20, 20-end)
 			cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
 			url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/prelim/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif"
-
-			## download file at url
-			with requests.Session() as session:
-				# not sure why both these steps are necessary, but too afraid to try
-				# removing one and seeing if it breaks things
-				r1 = session.request('get',url)
-				r = session.get(r1.url)
-			# nonexistent files don't throw an error, they just return a
-			# 404 response
-			if r.status_code != 200:
+			if chirpsUrl("chirps-prelim",date) is None: # not in directory listing
 				log.warning(f"Url {url} not found")
 				return ()
-			# write output tif file
-			with open(tf,"wb") as fd: # write data in chunks
-				for chunk in r.iter_content(chunk_size = 1024*1024):
-					fd.write(chunk)
-
-			## checksum
-			observedSize = int(os.stat(tf).st_size) # size of downloaded file (bytes)
-			expectedSize = int(urlopen(Request(url)).info().get("Content-length")) # size anticipated from header (bytes)
-
-			## checksum fails, log warning and return empty list
-			if observedSize != expectedSize:
-				w=f"WARNING:\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-				log.warning(w)
-				os.remove(tf)
-				return ()
 
-			## apply nodata mask to file
-			chirps_noData_args = ["gdal_translate","-q","-a_nodata", "-9999",tf,file_out] # apply NoData mask
-			subprocess.call(chirps_noData_args)
-			os.remove(tf) # delete unmasked file
+			## download file at url into memory, checking size as it streams;
+			## a copy in the source cache is used instead, if there is one
+			try:
+				chunks, expectedSize = fetch.stream(url)
+				file_mem = decode.writeVsimem(chunks,os.path.basename(file_out),expectedSize)
+			except UnavailableError as e: # e.g. nonexistent files give a 404 response
+				log.warning(e)
+				return ()
 
-			## project file to sinusoidal
-			prj = project_to_sinusoidal_inPlace(file_out)
-			if prj != 0:
+			## project file to sinusoidal and cloud-optimize; nodata is applied as it is read
+			try:
+				regrid.sinusoidalCog(file_mem,file_out,src_nodata=-9999)
+			except RuntimeError:
 				log.warning(f"Failed to project {file_out}")
 				return ()
-
-			## cloud-optimize file
-			cloud_optimize_inPlace(file_out)
+			finally:
+				decode.unlink(file_mem)
 
 			## return tuple of file path
 			return tuple([file_out])
@@ -568,48 +264,26 @@ def pullFromSource(product:str,date:str,output_directory:str,file_name_override:
 		url = f"https://land.copernicus.vgt.vito.be/PDF/datapool/Vegetation/Soil_Water_Index/Daily_SWI_12.5km_Global_V3/{year}/{month}/{day}/SWI_{year}{month}{day}1200_GLOBE_ASCAT_V3.1.1/c_gls_SWI_{year}{month}{day}1200_GLOBE_ASCAT_V3.1.1.nc"
 		file_nc = out.replace("tif","nc") # temporary NetCDF file; later to be converted to tiff
 
-		## use requests module to download MERRA-2 file (.nc4)
-		with requests.Session() as session:
-			session.auth = (credentials['swiUsername'], credentials['swiPassword'])
-			r1 = session.request('get',url)
-			r = session.get(r1.url,auth=(credentials['swiUsername'], credentials['swiPassword'])) # copernicus demands credentials twice!
-			headers = r.headers
-		# write output .nc file
-		with open(file_nc,"wb") as fd: # write data in chunks
-			for chunk in r.iter_content(chunk_size = 1024*1024):
-				fd.write(chunk)
-
-		## checksum
-		observedSize = int(os.stat(file_nc).st_size) # size of downloaded file (bytes)
-		expectedSize = int(headers['Content-Length']) # size anticipated from header (bytes)
-
-		## if checksum is failed, log and return empty
-		if int(observedSize) != int(expectedSize):
-			w=f"\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-			log.warning(w)
-			os.remove(file_nc)
+		## download SWI file (.nc), resuming if the connection drops; copernicus demands credentials twice!
+		try:
+			fetch.download(url,file_nc,auth=(credentials['swiUsername'], credentials['swiPassword']))
+		except UnavailableError as e:
+			log.warning(e)
 			return ()
 
-		## extract desired band as GeoTiff
-		dataset= gdal.Open(file_nc,0)
-		# search all subdatasets for 10-day swi
-		for sd in dataset.GetSubDatasets():
-			if sd[0].split(":")[-1] == "SWI_010":
-				subdataset=sd[0]
-		del dataset
-		# translate subdataset to its own tiff and delete full netCDF
-		swiArgs = ["gdal_translate","-q",subdataset,out] # arguments for gdal to transform subdataset into independent Tiff
-		subprocess.call(swiArgs) # calling the command line to produce the tiff
-		os.remove(file_nc)
-
-		## project file to sinusoidal
-		prj = project_to_sinusoidal_inPlace(out)
-		if prj != 0:
+		## open 10-day swi in place, then project it to sinusoidal and cloud-optimize;
+		## the NetCDF library needs a real file, so only the .nc touches disk
+		try:
+			subdataset = decode.netcdfSubdataset(file_nc,"SWI_010")
+			regrid.sinusoidalCog(subdataset,out)
+		except UnavailableError as e:
+			log.warning(e)
+			return ()
+		except RuntimeError:
 			log.warning(f"Failed to project {out}")
 			return ()
-
-		## cloud-optimize file
-		cloud_optimize_inPlace(out)
+		finally:
+			os.remove(file_nc)
 
 		## return tuple of file path string
 		return tuple([out])
@@ -837,7 +511,7 @@ def pullFromS3(product:str,date:str,out_dir:str,collection=0) -> tuple:
 			results.append(outFile)
 			try:
 				s3_client.download_file(s3_bucket,s3_key,outFile) # actually pull file
-			except ClientError: # thrown if file doesn't exist
+			except botoExceptions.ClientError: # thrown if file doesn't exist
 				log.error("File not available on S3")
 				return ()
 			except Exception: # other exceptions suggest failure during download
@@ -849,7 +523,7 @@ def pullFromS3(product:str,date:str,out_dir:str,collection=0) -> tuple:
 		results.append(outFile)
 		try:
 			s3_client.download_file(s3_bucket,s3_key,outFile) # actually pull file
-		except ClientError: # thrown if file doesn't exist
+		except botoExceptions.ClientError: # thrown if file doesn't exist
 			log.error("File not available on S3")
 			return ()
 		except Exception: # other exceptions suggest failure during download
@@ -869,7 +543,7 @@ def pullFromS3(product:str,date:str,out_dir:str,collection=0) -> tuple:
 		results.append(outFile)
 		try:
 			s3_client.download_file(s3_bucket,s3_key,outFile) # pull from S3
-		except ClientError: # thrown if file does not exist
+		except botoExceptions.ClientError: # thrown if file does not exist
 			log.error("File not available on S3")
 			return ()
 		except Exception: # other exceptions suggest failure during download
@@ -882,7 +556,7 @@ def pullFromS3(product:str,date:str,out_dir:str,collection=0) -> tuple:
 		results.append(outFile)
 		try:
 			s3_client.download_file(s3_bucket,s3_key,outFile) # Pull from S3
-		except ClientError: # thrown if file does not exist
+		except botoExceptions.ClientError: # thrown if file does not exist
 			log.error("File not available on S3")
 			return ()
 		except Exception: # other exceptions suggest failure during download
@@ -925,54 +599,23 @@ def isAvailable(product:str, date:str) -> bool:
 	# merra-2 always requires special behavior
 	if product in ["merra-2", "merra-2-min", "merra-2-max", "merra-2-mean"]:
 		product = "merra-2"
-		allGood = True # This flag is not actually used...
 		for i in range(5): # we are collecting the requested date along with 4 previous days
-			mDate = datetime.strptime(date,"%Y-%m-%d") - timedelta(days=i)
-			mYear = mDate.strftime("%Y")
-			mMonth = mDate.strftime("%m").zfill(2)
-			mDay = mDate.strftime("%d").zfill(2)
-			pageUrl = f"https://goldsmr4.gesdisc.eosdis.nasa.gov/data/MERRA2/M2SDNXSLV.5.12.4/{mYear}/{mMonth}/"
-			try:
-				pageObject = urlopen(pageUrl)
-				pageText = str(pageObject.read())
-				ex = re.compile(f'MERRA2\S*{mYear}{mMonth}{mDay}.nc4') # regular expression that matches file name of desired date file
-				mFileName = re.search(ex,pageText).group() # matches desired file name from web page
-			except HTTPError: # if any file in the desired date range is missing, the composite is incomplete. So we return False.
+			mDate = (datetime.strptime(date,"%Y-%m-%d") - timedelta(days=i)).strftime("%Y-%m-%d")
+			listing = merra2Listing(mDate) # each month's page is fetched once per run
+			if not listing: # if any file in the desired date range is missing, the composite is incomplete. So we return False.
 				return False
-			except AttributeError:
-				log.warning(f"Failed to find Merra-2 URL for {mDate.strftime('%Y-%m-%d')}. We seem to have caught the merra-2 team in the middle of uploading their data... check {pageUrl} to be sure.")
+			if mDate not in listing:
+				log.warning(f"Failed to find Merra-2 URL for {mDate}. We seem to have caught the merra-2 team in the middle of uploading their data.")
 				return False
 		return True
 
 	elif product == "chirps":
-		## get url to be downloaded
-			cDate = datetime.strptime(date,"%Y-%m-%d")
-			cYear = cDate.strftime("%Y")
-			cMonth = cDate.strftime("%m").zfill(2)
-			cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
-			## CHIRPS data has been moved off of FTP server onto HTTPS
-			# url = f"ftp://ftp.chg.ucsb.edu/pub/org/chg/products/CHIRPS-2.0/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif.gz"
-			url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif.gz"
-			## try to open url
-			try:
-				fh = urlopen(Request(url))
-				return True
-			except URLError:
-				return False
+		## look for file in directory listing, which is fetched once per run
+		return chirpsUrl("chirps",date) is not None
 
 	elif product == "chirps-prelim":
-		## get url to be downloaded
-		cDate = datetime.strptime(date,"%Y-%m-%d")
-		cYear = cDate.strftime("%Y")
-		cMonth = cDate.strftime("%m").zfill(2)
-		cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
-		url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/prelim/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif"
-		## try to open url
-		try:
-			fh = urlopen(Request(url))
-			return True
-		except URLError:
-			return False
+		## look for file in directory listing, which is fetched once per run
+		return chirpsUrl("chirps-prelim",date) is not None
 
 	elif product == "swi":
 		dateObj = datetime.strptime(date,"%Y-%m-%d") # convert string date to datetime object
@@ -980,17 +623,15 @@ def isAvailable(product:str, date:str) -> bool:
 		month = dateObj.strftime("%m".zfill(2))
 		day = dateObj.strftime("%d".zfill(2))
 		url = f"https://land.copernicus.vgt.vito.be/PDF/datapool/Vegetation/Soil_Water_Index/Daily_SWI_12.5km_Global_V3/{year}/{month}/{day}/SWI_{year}{month}{day}1200_GLOBE_ASCAT_V3.1.1/c_gls_SWI_{year}{month}{day}1200_GLOBE_ASCAT_V3.1.1.nc"
-		with requests.Session() as session:
-			session.auth = (credentials["swiUsername"], credentials['swiPassword'])
-			request = session.request('get',url)
-			if request.status_code == 200:
-				if request.headers['Content-Type'] == 'application/octet-stream':
-					return True
-			else:
-				return False
+		status, headers = probe(url,auth=(credentials["swiUsername"], credentials['swiPassword']))
+		if status == 200:
+			if headers.get('Content-Type') == 'application/octet-stream':
+				return True
+		else:
+			return False
 
 	elif product in octvi.supported_products:
-		if len(octvi.url.getDates(product,date)) > 0:
+		if len(octviDates(product,date)) > 0:
 			return True
 		else:
 			return False
@@ -1133,10 +774,8 @@ def listAvailable(product:str, start_date:str, format_doy = False) -> list:
 	else:
 		raise BadInputError(f"Product '{product}' not recognized")
 
-	# filter products
-	for rd in raw_dates:
-		if isAvailable(product,rd):
-			filtered_dates.append(rd)
+	# filter products; dates are checked concurrently
+	filtered_dates = filterAvailable(isAvailable,product,raw_dates)
 
 	# convert to DOY format if requested
 	if format_doy:
@@ -0,0 +1,397 @@
+#! /usr/bin/env python
+
+"""
+This module downloads source files to disk, resuming interrupted transfers
+
+Download functions used to write the whole body and only then compare
+the file's size with the Content-Length header, so a dropped connection
+meant starting again from nothing. Here the body is streamed into a
+'.part' file next to the output and hashed as it arrives. If the
+connection drops or the body comes up short, the transfer is retried
+with exponential backoff, and only the missing bytes are requested
+(with an HTTP Range header). A '.part' file is kept when a download
+fails, so the next run can pick up where it stopped, as long as the
+server's ETag or Last-Modified header shows the file has not changed.
+Once the size (and the digest, if one is expected) checks out, the
+'.part' file is renamed to the output path, so a file at the output
+path is always complete.
+
+If a source cache is configured (see sourcecache.py), a file the cache
+already holds is copied from there instead, as long as the server still
+reports the same version of it, and new downloads are added to it.
+Downloads that are decoded straight into memory use stream() to get the
+same benefit.
+
+Defaults can be changed with the following environment variables:
+
+	GLAM_FETCH_RETRIES   retries after a dropped or short transfer (default 5)
+	GLAM_FETCH_BACKOFF   seconds before the first retry (default 2)
+
+***
+
+Classes
+-------
+Download
+
+Functions
+---------
+remoteVersion
+download
+stream
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import hashlib, re, shutil, threading
+from collections import namedtuple
+
+from glam_data_processing import sourcecache
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.availability import getHost, getSession, withRetries
+from glam_data_processing.exceptions import UnavailableError
+
+requests = lazyImport("requests")
+
+## settings
+
+RETRIES = int(os.environ.get("GLAM_FETCH_RETRIES",5))
+BACKOFF = float(os.environ.get("GLAM_FETCH_BACKOFF",2))
+CHUNK_SIZE = 64*1024 # a dropped connection loses at most one chunk
+
+Download = namedtuple("Download",["path","size","digest","validator"])
+Download.__doc__ = """A finished download: output path, size in bytes, hex digest of the contents, and the server's ETag or Last-Modified header (or None)"""
+
+
+def _contentRange(header:str) -> tuple:
+	"""Returns (first byte, total size) from a Content-Range header; either may be None"""
+	match = re.match(r"bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)",header or "")
+	if match is None:
+		return None, None
+	first, total = match.groups()
+	return (None if first is None else int(first)), (None if total == "*" else int(total))
+
+
+def _discard(part:str) -> None:
+	"""Removes a .part file and the validator saved with it"""
+	for f in (part, part + ".validator"):
+		try:
+			os.remove(f)
+		except FileNotFoundError:
+			pass
+
+
+def _get(session:"requests.Session", url:str, auth:tuple, method:str = "get", **kwargs) -> "requests.Response":
+	"""Sends a request, repeating it with auth if the server sends someone off to log in"""
+	r = session.request(method,url,auth=auth,allow_redirects=True,**kwargs)
+	if (r.status_code == 401) or (getHost(r.url) != getHost(url)):
+		# sent off to log in; authenticate there and follow the redirect back
+		r.close()
+		r = session.request(method,r.url,auth=auth,allow_redirects=True,**kwargs)
+	return r
+
+
+def remoteVersion(url:str, session:"requests.Session" = None, auth:tuple = None, timeout:float = 60) -> tuple:
+	"""Returns (validator, size) the server gives for url now, without downloading it
+
+	The validator is the ETag or Last-Modified header. Either value is
+	None if the server does not give it, or if the request fails.
+
+	***
+
+	Parameters
+	----------
+	url:str
+		URL of file
+	session:requests.Session
+		Default None; session to ask with. If not set, uses the shared
+		session for the URL's host
+	auth:tuple
+		Default None; (username, password). If not set, uses the session's own
+	timeout:float
+		Seconds to wait for the server to respond
+	"""
+	session = session or getSession(url)
+	auth = auth or session.auth
+	try:
+		with _get(session,url,auth,"head",timeout=timeout) as r:
+			if r.status_code == 200:
+				size = r.headers.get("Content-Length")
+				return (r.headers.get("ETag") or r.headers.get("Last-Modified")), (None if size is None else int(size))
+			if r.status_code not in (405, 501):
+				return None, None
+		# HEAD refused; ask for the first byte alone, and close without reading the body
+		with _get(session,url,auth,headers={"Range":"bytes=0-0"},stream=True,timeout=timeout) as r:
+			if r.status_code == 206:
+				return (r.headers.get("ETag") or r.headers.get("Last-Modified")), _contentRange(r.headers.get("Content-Range"))[1]
+			if r.status_code == 200:
+				size = r.headers.get("Content-Length")
+				return (r.headers.get("ETag") or r.headers.get("Last-Modified")), (None if size is None else int(size))
+	except requests.exceptions.RequestException as e:
+		log.debug(f"Could not check version of {url}: {e}")
+	return None, None
+
+
+def _cachedCopy(cache:"sourcecache.SourceCache", url:str, session:"requests.Session", auth:tuple, expected_size:int = None, digest:str = None) -> dict:
+	"""Returns the cache's record for url if it holds the version the server has now, otherwise None"""
+	if cache is None:
+		return None
+	validator, size = remoteVersion(url,session,auth)
+	hit = cache.get(url,validator,size)
+	if hit is None:
+		return None
+	if (expected_size is not None) and (hit["size"] != int(expected_size)):
+		return None
+	if (digest is not None) and (digest.lower() != hit["digest"]):
+		return None
+	log.info(f"Using cached copy of {url}")
+	return hit
+
+
+def download(url:str, out_path:str, session:"requests.Session" = None, auth:tuple = None, expected_size:int = None, digest:str = None, algorithm:str = "sha256", retries:int = None, backoff:float = None, cancelled:threading.Event = None, timeout:float = 300, cache:"sourcecache.SourceCache" = None) -> Download:
+	"""Downloads url to out_path, resuming from a .part file, and returns a Download
+
+	If the server sends someone off to log in (a 401 response, or a
+	redirect to another host), the request is repeated there with auth.
+	Raises UnavailableError if the server does not have the file, if the
+	transfer still falls short once retries are used up, if the size or
+	digest does not match, or if cancelled is set.
+
+	***
+
+	Parameters
+	----------
+	url:str
+		URL of file
+	out_path:str
+		Path to output file on disk; bytes are collected in out_path + ".part"
+	session:requests.Session
+		Default None; session to download with. If not set, uses the
+		shared session for the URL's host
+	auth:tuple
+		Default None; (username, password). If not set, uses the session's own
+	expected_size:int
+		Default None; size of the file in bytes, if known in advance
+	digest:str
+		Default None; expected hex digest of the file, if known in advance
+	algorithm:str
+		Default "sha256"; hashlib algorithm used for the digest
+	retries:int
+		Default None; retries after a dropped or short transfer. If not
+		set, uses GLAM_FETCH_RETRIES
+	backoff:float
+		Default None; seconds to wait before the first retry, doubling
+		after each. If not set, uses GLAM_FETCH_BACKOFF
+	cancelled:threading.Event
+		Default None; if set while streaming, the download stops early
+	timeout:float
+		Seconds to wait for the server to respond
+	cache:sourcecache.SourceCache
+		Default None; cache of source files to copy from and add to. If
+		not set, uses sourcecache.defaultCache(); only used when
+		algorithm is "sha256"
+	"""
+	session = session or getSession(url)
+	auth = auth or session.auth
+	cache = sourcecache.defaultCache() if cache is None else cache
+	if algorithm != "sha256":
+		cache = None
+
+	## copy from the source cache, if it holds the current version
+	hit = _cachedCopy(cache,url,session,auth,expected_size,digest)
+	if hit is not None:
+		temp = out_path + ".part"
+		try:
+			shutil.copyfile(hit["path"],temp)
+			os.replace(temp,out_path)
+			_discard(temp) # validator of any earlier partial download
+			return Download(out_path,hit["size"],hit["digest"],hit["validator"])
+		except OSError as e: # evicted while copying
+			log.debug(f"Failed to copy {url} from cache: {e}")
+			_discard(temp)
+
+	retries = RETRIES if retries is None else retries
+	backoff = BACKOFF if backoff is None else backoff
+	part = out_path + ".part"
+	state = {"hasher":hashlib.new(algorithm),"size":0,"validator":None}
+
+	## pick up bytes left by an earlier run, if we can tell whether the file has changed since
+	if os.path.exists(part) and os.path.exists(part + ".validator"):
+		with open(part + ".validator") as f:
+			state["validator"] = f.read().strip() or None
+		with open(part,"rb") as f:
+			for chunk in iter(lambda: f.read(CHUNK_SIZE),b""):
+				state["hasher"].update(chunk)
+				state["size"] += len(chunk)
+		log.info(f"Resuming download of {url} from byte {state['size']}")
+	else:
+		_discard(part)
+
+	def restart() -> None:
+		_discard(part)
+		state["hasher"] = hashlib.new(algorithm)
+		state["size"] = 0
+		state["validator"] = None
+
+	def attempt() -> None:
+		headers = {}
+		if state["size"] > 0:
+			headers["Range"] = f"bytes={state['size']}-"
+			if state["validator"] is not None:
+				headers["If-Range"] = state["validator"] # server sends the whole file if it has changed
+		with _get(session,url,auth,headers=headers,stream=True,timeout=timeout) as r:
+			if r.status_code == 416: # nothing left to send
+				first, total = _contentRange(r.headers.get("Content-Range"))
+				if total == state["size"]:
+					return None
+				restart()
+				raise ConnectionError(f"Server refused to resume {url}")
+			if r.status_code >= 500:
+				raise ConnectionError(f"Server returned status {r.status_code} for {url}")
+			if r.status_code not in (200,206):
+				raise UnavailableError(f"Server returned status {r.status_code} for {url}")
+			if r.status_code == 206:
+				first, total = _contentRange(r.headers.get("Content-Range"))
+				if first != state["size"]:
+					restart()
+					raise ConnectionError(f"Server resumed {url} from byte {first}, not {state['size']}")
+			else:
+				if state["size"] > 0:
+					log.info(f"Server sent all of {url} again; starting over")
+				restart()
+				total = r.headers.get("Content-Length") # size of promised file in bytes, extracted from server-delivered headers
+				total = None if total is None else int(total)
+			if (total is not None) and (expected_size is not None) and (total != int(expected_size)):
+				raise UnavailableError(f"Server offers {total} bytes for {url}; expected {expected_size}")
+
+			validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+			if validator != state["validator"]:
+				state["validator"] = validator
+				if validator is not None: # otherwise an interrupted transfer can't be resumed by a later run
+					with open(part + ".validator","w") as f:
+						f.write(validator)
+
+			with open(part,"ab") as fd: # write data in chunks, hashing as they go
+				try:
+					for chunk in r.iter_content(chunk_size = CHUNK_SIZE):
+						if (cancelled is not None) and cancelled.is_set():
+							raise UnavailableError(f"Download of {url} cancelled")
+						if (total is not None) and (state["size"] + len(chunk) > total):
+							restart()
+							raise ConnectionError(f"Server sent more than {total} bytes for {url}")
+						fd.write(chunk)
+						state["hasher"].update(chunk)
+						state["size"] += len(chunk)
+				except requests.exceptions.RequestException as e: # connection dropped partway through
+					raise ConnectionError(f"{type(e).__name__} while streaming {url}: {e}") from e
+			if (total is not None) and (state["size"] < total):
+				raise ConnectionError(f"Transfer of {url} stopped at {state['size']} of {total} bytes")
+
+	try:
+		withRetries(attempt,retries=retries,backoff=backoff)
+	except (ConnectionError, requests.exceptions.RequestException) as e: # retries used up
+		if state["validator"] is None:
+			_discard(part)
+		raise UnavailableError(f"Failed to download {url}: {e}")
+	except BaseException:
+		if state["validator"] is None:
+			_discard(part)
+		raise
+
+	## checksum
+	observedDigest = state["hasher"].hexdigest()
+	if (expected_size is not None) and (state["size"] != int(expected_size)):
+		_discard(part)
+		raise UnavailableError(f"Checksum failure for {url}\nExpected file size:\t{expected_size} bytes\nObserved file size:\t{state['size']} bytes")
+	if (digest is not None) and (digest.lower() != observedDigest):
+		_discard(part)
+		raise UnavailableError(f"Checksum failure for {url}\nExpected {algorithm}:\t{digest}\nObserved {algorithm}:\t{observedDigest}")
+
+	os.replace(part,out_path)
+	_discard(part)
+	if cache is not None:
+		cache.put(url,out_path,observedDigest,state["validator"])
+	return Download(out_path,state["size"],observedDigest,state["validator"])
+
+
+def stream(url:str, session:"requests.Session" = None, auth:tuple = None, timeout:float = 300, cache:"sourcecache.SourceCache" = None) -> tuple:
+	"""Returns (chunks, expected size) for the body of url, for decoding straight into memory
+
+	Chunks come from the source cache if it holds the version the server
+	has now; otherwise they are streamed from the server, and copied into
+	the cache as they pass, once the whole body has arrived. Raises
+	UnavailableError if the server does not return the file, or if the
+	connection drops while streaming. Unlike download(), nothing is
+	resumed or retried.
+
+	***
+
+	Parameters
+	----------
+	url:str
+		URL of file
+	session:requests.Session
+		Default None; session to download with. If not set, uses the
+		shared session for the URL's host
+	auth:tuple
+		Default None; (username, password). If not set, uses the session's own
+	timeout:float
+		Seconds to wait for the server to respond
+	cache:sourcecache.SourceCache
+		Default None; cache of source files to read from and add to. If
+		not set, uses sourcecache.defaultCache()
+	"""
+	session = session or getSession(url)
+	auth = auth or session.auth
+	cache = sourcecache.defaultCache() if cache is None else cache
+
+	hit = _cachedCopy(cache,url,session,auth)
+	if hit is not None:
+		def cachedChunks():
+			with open(hit["path"],"rb") as f:
+				yield from iter(lambda: f.read(CHUNK_SIZE),b"")
+		return cachedChunks(), hit["size"]
+
+	r = _get(session,url,auth,stream=True,timeout=timeout)
+	if r.status_code != 200:
+		r.close()
+		raise UnavailableError(f"Server returned status {r.status_code} for {url}")
+	expectedSize = r.headers.get("Content-Length") # size of promised file in bytes, extracted from server-delivered headers
+	expectedSize = None if expectedSize is None else int(expectedSize)
+
+	def chunks():
+		temp = None
+		if cache is not None:
+			try:
+				temp = cache.tempPath()
+			except OSError as e:
+				log.warning(f"Failed to cache {url} in {cache.directory}: {e}")
+		hasher = hashlib.sha256()
+		observedSize = 0
+		try:
+			with r:
+				fd = None if temp is None else open(temp,"wb")
+				try:
+					for chunk in r.iter_content(chunk_size = CHUNK_SIZE):
+						observedSize += len(chunk)
+						if fd is not None:
+							fd.write(chunk)
+							hasher.update(chunk)
+						yield chunk
+				except requests.exceptions.RequestException as e: # connection dropped partway through
+					raise UnavailableError(f"{type(e).__name__} while streaming {url}: {e}")
+				finally:
+					if fd is not None:
+						fd.close()
+			if (temp is not None) and ((expectedSize is None) or (observedSize == expectedSize)):
+				try:
+					cache.add(url,temp,hasher.hexdigest(),r.headers.get("ETag") or r.headers.get("Last-Modified"))
+				except OSError as e:
+					log.warning(f"Failed to cache {url} in {cache.directory}: {e}")
+		finally:
+			if (temp is not None) and os.path.exists(temp):
+				os.remove(temp)
+
+	return chunks(), expectedSize
@@ -3,8 +3,9 @@ import logging, os
 logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger("glam_command_line")
 
-import argparse, glob, json, subprocess, sys
+import argparse, json, subprocess, sys
 import glam_data_processing.legacy as glam
+from glam_data_processing import catalog
 from datetime import datetime
 
 # create temporary directory for shenanigans
@@ -50,7 +51,7 @@ def download_and_statsOneFile(product,date,directory,admin_level,mask_level,admi
 
 def getAllTiffs(in_dir) -> list:
 	"""Takes input directory path, returns list of all tiff full paths"""
-	return glob.glob(os.path.join(in_dir,"*.tif"))
+	return catalog.paths(in_dir)
 
 
 def getProductDateTuple(file_path) -> tuple:
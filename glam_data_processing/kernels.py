@@ -0,0 +1,311 @@
+#! /usr/bin/env python
+
+"""
+This module holds the per-pixel arithmetic behind the anomaly baselines
+
+Baseline inputs are mostly int16 rasters (Merra-2 is float32). A value
+counts towards a baseline when it lies between VALID_MIN and VALID_MAX,
+inclusive, and pixels with no valid value in any year are written as
+NODATA. Workers read the years of a window into one preallocated stack,
+latest year first, and the functions here reduce it without masked
+arrays:
+
+	* means come from sums and counts of valid values: int32 sums divided
+	  in float64 for integer inputs, and sums and division in the input's
+	  own type for floats, as np.ma.average() does. Integer sums can also
+	  be kept between runs and updated one year at a time; see
+	  runningsums.py
+	* medians come from a partial sort of each pixel's years, with invalid
+	  values replaced by a sentinel that sorts after every valid one. The
+	  sort inserts one year plane at a time with np.minimum() and
+	  np.maximum() calls over whole planes, keeping only the lowest half;
+	  the middle of each pixel's valid values is then picked by its count
+
+Several horizons (5 years, 10 years, the full record, ...) come from one
+stack in one pass: means from prefix sums, and medians picked as each
+horizon's last year is inserted. A longer horizon costs compute but no
+more reads.
+
+Both give exactly what the np.ma.average() and np.ma.median() calls they
+replace gave, at a fraction of the time and memory. Run this module to
+compare them:
+
+	python -m glam_data_processing.kernels
+
+***
+
+Functions
+---------
+validMask
+sumDtype
+sumCount
+addYear
+meanFromSums
+meanOf
+medianOf
+horizonMeans
+horizonMedians
+benchmark
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import time
+
+from glam_data_processing._lazy import lazyImport
+
+np = lazyImport("numpy")
+
+VALID_MIN = -1000
+VALID_MAX = 10000
+NODATA = -3000
+
+
+def validMask(data:"np.ndarray") -> "np.ndarray":
+	"""Returns a boolean array; True where data lies in the valid range"""
+	return (data >= VALID_MIN) & (data <= VALID_MAX)
+
+
+def sumDtype(dtype) -> "np.dtype":
+	"""Returns the dtype sums of valid values are kept in: int32 for integer inputs, the input's own type for floats"""
+	if np.issubdtype(np.dtype(dtype),np.integer):
+		return np.dtype(np.int32)
+	return np.dtype(dtype)
+
+
+def sumCount(stack:"np.ndarray") -> tuple:
+	"""Returns (sums, counts) of the valid values in a stack of years; counts are int32
+
+	***
+
+	Parameters
+	----------
+	stack:np.ndarray
+		Array of shape (years, rows, columns)
+	"""
+	valid = validMask(stack)
+	# multiplying is much faster than np.where(), and is what np.ma.average() did
+	sums = (stack * valid).sum(axis=0,dtype=sumDtype(stack.dtype))
+	counts = valid.sum(axis=0,dtype=np.int32)
+	return sums, counts
+
+
+def addYear(sums:"np.ndarray", counts:"np.ndarray", data:"np.ndarray", sign:int = 1) -> None:
+	"""Adds one year's valid values to sums and counts, in place; or, with sign=-1, takes them away
+
+	***
+
+	Parameters
+	----------
+	sums:np.ndarray
+		Sums of valid values; see sumDtype()
+	counts:np.ndarray
+		int32 counts of valid values
+	data:np.ndarray
+		One year of input, the same shape as sums
+	sign:int
+		Default 1; 1 to add the year, -1 to remove it
+	"""
+	valid = validMask(data)
+	sums += sign * (data * valid).astype(sums.dtype)
+	counts += sign * valid.astype(np.int32)
+
+
+def _nodata(dtype:str):
+	"""Returns NODATA as dtype, converted from float as the masked-array results were"""
+	return np.array(NODATA,dtype=np.float64).astype(dtype)
+
+
+def meanFromSums(sums:"np.ndarray", counts:"np.ndarray", dtype:str) -> "np.ndarray":
+	"""Returns mean baseline values from sums and counts; NODATA where the count is zero
+
+	Integer sums are divided in float64, and float sums in their own
+	type, then converted to dtype, as np.ma.average() followed by
+	astype(dtype) does.
+	"""
+	divisor = np.maximum(counts,1)
+	if not np.issubdtype(sums.dtype,np.integer):
+		divisor = divisor.astype(sums.dtype)
+	out = (sums / divisor).astype(dtype)
+	out[counts == 0] = _nodata(dtype)
+	return out
+
+
+def meanOf(stack:"np.ndarray", dtype:str) -> "np.ndarray":
+	"""Returns the mean of the valid values in a stack of years, as dtype; NODATA where there are none"""
+	return meanFromSums(*sumCount(stack),dtype)
+
+
+def medianOf(stack:"np.ndarray", dtype:str) -> "np.ndarray":
+	"""Returns the median of the valid values in a stack of years, as dtype; NODATA where there are none
+
+	With an even number of valid values, the two middle values are
+	averaged as np.ma.median() does: in float64 for integer inputs, in the
+	input's own type for floats.
+
+	***
+
+	Parameters
+	----------
+	stack:np.ndarray
+		Array of shape (years, rows, columns)
+	dtype:str
+		dtype of output
+	"""
+	return horizonMedians(stack,[len(stack)],dtype)[len(stack)]
+
+
+def horizonMeans(stack:"np.ndarray", horizons:list, dtype:str) -> dict:
+	"""Returns {horizon: mean of the first horizon years of stack}, from running (prefix) sums over the years
+
+	Each result is identical to meanOf(stack[:horizon], dtype).
+
+	***
+
+	Parameters
+	----------
+	stack:np.ndarray
+		Array of shape (years, rows, columns), latest year first
+	horizons:list
+		Numbers of years, each no more than len(stack)
+	dtype:str
+		dtype of output
+	"""
+	# the sums start from the first year, not from zero, so floats are added in the same order as by sumCount()
+	valid = validMask(stack[0])
+	sums = (stack[0] * valid).astype(sumDtype(stack.dtype))
+	counts = valid.astype(np.int32)
+	out = {}
+	for i in range(max(horizons)):
+		if i > 0:
+			addYear(sums,counts,stack[i])
+		if (i + 1) in horizons:
+			out[i+1] = meanFromSums(sums,counts,dtype)
+	return out
+
+
+def horizonMedians(stack:"np.ndarray", horizons:list, dtype:str) -> dict:
+	"""Returns {horizon: median of the first horizon years of stack}, from one pass of incremental selection
+
+	Years are inserted one at a time into an elementwise-sorted list of
+	planes, with np.minimum()/np.maximum() over whole planes; invalid
+	values become a sentinel that sorts after every valid one. Only the
+	lowest half of the longest horizon is kept, which is all a median
+	needs, and each horizon's median is picked as its last year goes in.
+	Each result is identical to medianOf(stack[:horizon], dtype).
+
+	***
+
+	Parameters
+	----------
+	stack:np.ndarray
+		Array of shape (years, rows, columns), latest year first
+	horizons:list
+		Numbers of years, each no more than len(stack)
+	dtype:str
+		dtype of output
+	"""
+	stack = stack[:max(horizons)]
+	valid = validMask(stack)
+	counts = np.zeros(stack.shape[1:],dtype=np.int32)
+	if np.issubdtype(stack.dtype,np.integer):
+		# invalid values become the largest value the type holds
+		planes = stack * valid + ~valid * stack.dtype.type(np.iinfo(stack.dtype).max)
+	else:
+		planes = np.where(valid,stack,np.inf).astype(stack.dtype,copy=False)
+	keep = len(stack) // 2 + 1
+	kept = []
+	spare = np.empty_like(planes[0])
+	out = {}
+	for i, plane in enumerate(planes):
+		counts += valid[i]
+		kept.append(plane)
+		for j in range(len(kept) - 1,0,-1):
+			a, b = kept[j-1], kept[j]
+			np.minimum(a,b,out=spare)
+			np.maximum(a,b,out=b)
+			kept[j-1] = spare
+			spare = a
+		if len(kept) > keep: # highest values can no longer be a median
+			kept.pop()
+		if (i + 1) in horizons:
+			out[i+1] = _middle(kept,counts,stack.dtype,dtype)
+	return out
+
+
+def _middle(kept:list, counts:"np.ndarray", in_dtype:"np.dtype", dtype:str) -> "np.ndarray":
+	"""Returns the median of each pixel from its lowest values in order and its count of valid values"""
+	ordered = np.stack(kept)
+	low = np.take_along_axis(ordered,np.maximum((counts - 1) // 2,0)[np.newaxis],axis=0)[0]
+	high = np.take_along_axis(ordered,(counts // 2)[np.newaxis],axis=0)[0]
+	if np.issubdtype(in_dtype,np.integer):
+		middle = (low.astype(np.float64) + high) / 2
+	else:
+		middle = (low + high) / in_dtype.type(2)
+	out = middle.astype(dtype)
+	out[counts == 0] = _nodata(dtype)
+	return out
+
+
+def _maskedMean(stack:"np.ndarray", dtype:str) -> "np.ndarray":
+	"""The mean as the baseline workers used to compute it"""
+	mean = np.ma.average(stack, axis=0, weights=((stack >= VALID_MIN) * (stack <= VALID_MAX)))
+	mean[mean.mask==True] = NODATA
+	return mean.astype(dtype)
+
+
+def _maskedMedian(stack:"np.ndarray", dtype:str) -> "np.ndarray":
+	"""The median as the baseline workers used to compute it"""
+	median = np.ma.median(np.ma.masked_outside(stack, VALID_MIN, VALID_MAX), axis=0)
+	median[median.mask==True] = NODATA
+	return median.astype(dtype)
+
+
+def benchmark(years:int = 10, size:int = 256, dtype:str = "int16", repeats:int = 5) -> dict:
+	"""Times the masked-array reductions against meanOf() and medianOf() on one random window
+
+	Returns {name: best time in seconds}, and raises AssertionError if the
+	results differ.
+
+	***
+
+	Parameters
+	----------
+	years:int
+		Default 10; number of years in the stack
+	size:int
+		Default 256; width and height of the window in pixels
+	dtype:str
+		Default "int16"; dtype of the stack
+	repeats:int
+		Default 5; the best of this many runs is kept
+	"""
+	rng = np.random.default_rng(0)
+	stack = rng.integers(VALID_MIN - 500,VALID_MAX + 500,(years,size,size)).astype(dtype)
+	stack[rng.random(stack.shape) < 0.2] = NODATA
+	timings = {}
+	results = {}
+	for name, func in (("np.ma.average",_maskedMean),("meanOf",meanOf),("np.ma.median",_maskedMedian),("medianOf",medianOf)):
+		best = None
+		for i in range(repeats):
+			start = time.perf_counter()
+			results[name] = func(stack,dtype)
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best,elapsed)
+		timings[name] = best
+	assert np.array_equal(results["np.ma.average"],results["meanOf"])
+	assert np.array_equal(results["np.ma.median"],results["medianOf"])
+	return timings
+
+
+if __name__ == "__main__":
+	for dtype in ("int16","float32"):
+		timings = benchmark(dtype=dtype)
+		print(f"{dtype}, 10 years of 256 x 256:")
+		for name, seconds in timings.items():
+			print(f"  {name:<14} {seconds*1000:8.1f} ms")
+		print(f"  mean speedup   {timings['np.ma.average'] / timings['meanOf']:8.1f}x")
+		print(f"  median speedup {timings['np.ma.median'] / timings['medianOf']:8.1f}x")
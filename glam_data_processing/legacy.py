@@ -94,23 +94,22 @@ log = logging.getLogger(__name__)
 #log.info(f"{os.path.basename(__file__)} started {datetime.today()}")
 
 ## import modules
-import sys, glob, gdal, boto3, hashlib, json, math, gzip, multiprocessing, octvi, shutil, requests, ftplib, re, subprocess, collections, urllib
-from botocore.exceptions import ClientError
-boto3.set_stream_logger('botocore', level='INFO')
-from gdalnumeric import *
-gdal.UseExceptions()
-from osgeo import osr
+import sys, glob, hashlib, json, math, multiprocessing, shutil, ftplib, re, collections, urllib
 from urllib.error import URLError
 from urllib.request import urlopen, Request, URLError, HTTPError
 from ftplib import FTP
-import numpy as np
-import pandas as pd
-import terracotta as tc
-import sqlalchemy as db
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func
-from sqlalchemy.ext.declarative import declarative_base
-Base = declarative_base()
+
+## heavy dependencies are imported on first use; see _lazy.py
+from ._lazy import lazyImport
+gdal = lazyImport("gdal", on_load=lambda m: m.UseExceptions())
+gdalnumeric = lazyImport("gdalnumeric")
+boto3 = lazyImport("boto3", on_load=lambda m: m.set_stream_logger('botocore', level='INFO'))
+botoExceptions = lazyImport("botocore.exceptions")
+octvi = lazyImport("octvi")
+np = lazyImport("numpy")
+pd = lazyImport("pandas")
+tc = lazyImport("terracotta")
+db = lazyImport("sqlalchemy")
 
 ancillary_products = ["chirps","chirps-prelim","swi","merra-2"]
 
@@ -134,9 +133,10 @@ for admin in admins_brazil:
 admin_crops_matchup["Mali"] = ["Mali","maize",'rice',"cropland","nomask"] # only overlap
 admin_crops_matchup["ICPAC"] = ["ICPAC","JRC_MARS","maize","rice","soybean","winterwheat","cropland","nomask"] # only overlap
 
-## rds endpoint
+## rds endpoint and shared database connection
 
-endpoint = "glam-production.c1khdx2rzffa.us-east-1.rds.amazonaws.com"
+from .database import ENDPOINT, CredentialsMissing, LazyEngine, LazyMetadata, LazyTable, StatusBuffer, completedSql, getEngine, statusUpdateSql
+endpoint = ENDPOINT
 
 ## decorators
 
@@ -149,61 +149,18 @@ def log_io(func):
 
 ## custom error classes
 
-class BadInputError(Exception):
-	def __init__(self, data):
-		self.data = data
-	def __str__(self):
-		return repr(self.data)
-
-class UploadFailureError(Exception):
-	def __init__(self, data):
-		self.data = data
-	def __str__(self):
-		return repr(self.data)
-
-class UnavailableError(Exception):
-	def __init__(self,data):
-		self.data=data
-	def __str__(self):
-		return repr(self.data)
-
-class RecordNotFoundError(Exception):
-	def __init__(self,data):
-		self.data=data
-	def __str__(self):
-		return repr(self.data)
-
-class NoCredentialsError(Exception):
-	def __init__(self,data):
-		self.data=data
-	def __str__(self):
-		return repr(self.data)
+from .exceptions import BadInputError, UploadFailureError, UnavailableError, RecordNotFoundError, NoCredentialsError
 
 ## getting credentials
 
-def readCredentialsFile() -> None:
-	#log.info(__file__)
-	credDir = os.path.dirname(os.path.dirname(__file__))
-	credFile = os.path.join(credDir,"glam_keys.json")
-	#log.info(credFile)
-	try:
-		with open(credFile,'r') as f:
-			keys = json.loads(f.read())
-		log.debug(f"Found credentials file: {credFile}")
-	except FileNotFoundError:
-		raise NoCredentialsError("Credentials file ('glam_keys.json') not found.")
-	for k in ["merrausername","merrapassword","swiusername","swipassword","glam_mysql_user","glam_mysql_pass"]:
-		try:
-			log.debug(f"Adding variable to environment: {k}")
-			os.environ[k] = keys[k]
-		except KeyError:
-			log.debug(f"Variable not found in credentials file")
-			continue
+# the credentials file is read the first time a credential is needed
+from .credentials import Credential, CredentialsSet, readCredentialsFile, loadCredentials
 
-try:
-	readCredentialsFile()
-except NoCredentialsError:
-	log.warning("No credentials file found. Reading directly from environment variables instead.")
+## availability checks
+
+from .availability import checkMany, probe
+from .listings import chirpsUrl, merra2Listing, octviDates
+from . import catalog, decode, fetch, merra2, regrid
 
 ## checking for statscode
 
@@ -211,6 +168,68 @@ statscodeDir = os.path.join(os.path.dirname(__file__),"statscode")
 if not os.path.exists(statscodeDir):
 	log.warning("'statscode' directory not found. This folder should be in the same directory as __init__.py, and should contain all the crop mask and admin region rasters. Image objects cannot be instantialized without it.")
 
+## calendar helpers
+
+def _candidateDates(latest, today, cadence:str, step:int = None, year_day:int = None) -> list:
+	"""Returns string dates ("%Y-%m-%d") that follow 'latest' in a product's release calendar
+
+	Dates are generated up to and including the first one on or after
+	'today'.
+
+	***
+
+	Parameters
+	----------
+	latest:datetime.date
+		Date of the most recent record
+	today:datetime.date
+		Date to generate up to
+	cadence:str
+		One of "fixed" (every 'step' days), "yearly" (every 'step' days,
+		restarting on January 'year_day' each year), or "dekad" (the
+		1st, 11th, and 21st of each month)
+	step:int
+		Days between dates, for "fixed" and "yearly" cadences
+	year_day:int
+		Day of January on which a "yearly" cadence restarts
+	"""
+	if latest >= today:
+		return []
+	first = np.datetime64(latest,'D')
+	last = np.datetime64(today,'D')
+	if cadence == "fixed":
+		n = -(-int((last-first).astype(int)) // step) # ceiling division
+		dates = first + step*np.arange(1,n+1)
+	elif cadence == "yearly":
+		years = np.arange(first.astype('datetime64[Y]'),last.astype('datetime64[Y]')+2)
+		# finish the current year from the latest date...
+		yearEnd = (years[0]+1).astype('datetime64[D]')
+		segments = [first + step*np.arange(1,(int((yearEnd-first).astype(int))-1)//step+1)]
+		# ...then restart each following year on January {year_day}
+		for y in years[1:]:
+			segments.append(np.arange(y.astype('datetime64[D]')+(year_day-1),(y+1).astype('datetime64[D]'),step))
+		dates = np.concatenate(segments)
+	elif cadence == "dekad":
+		# a date past the 12th moves on 15 days and back to the 1st of that month; otherwise it moves on 10 days
+		head = []
+		while True:
+			if latest.day > 12:
+				latest = (latest + timedelta(days=15)).replace(day=1)
+			else:
+				latest = latest + timedelta(days=10)
+			head.append(np.datetime64(latest,'D'))
+			if latest.day in (1,11,21):
+				break
+		months = np.arange(np.datetime64(latest,'M'),last.astype('datetime64[M]')+2)
+		calendar = (months.astype('datetime64[D]')[:,None] + np.array([0,10,20])).ravel()
+		dates = np.concatenate([np.array(head[:-1],dtype='datetime64[D]'),calendar[calendar >= head[-1]]])
+	else:
+		raise BadInputError(f"Cadence '{cadence}' not recognized")
+	reached = np.flatnonzero(dates >= last)
+	if reached.size > 0:
+		dates = dates[:reached[0]+1]
+	return [str(d) for d in dates]
+
 ## other class definitions
 
 # instance creates and stores list of pending-download files for each type (merra,chirps,swi). Note that the attribute is named merra and not merra-2
@@ -232,6 +251,8 @@ class ToDoList:
 		stores the metadata
 	product_status: sqlalchemy table object
 		a table recording the extent to which the image has been processed into the glam system
+	schedule:dict
+		for each product, the attribute its dates are stored in and the calendar on which new files are released
 	chirps:list
 		a list of string dates (%Y-%m-%d), representing potentially available chirps files
 	chirps_prelim:list
@@ -257,20 +278,24 @@ class ToDoList:
 		removes images that are not yet available for download
 	"""
 
-	# mysql credentials
-	try:
-		mysql_user = os.environ['glam_mysql_user']
-		mysql_pass = os.environ['glam_mysql_pass']
-		mysql_db = 'modis_dev'
-
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
-		metadata = db.MetaData()
-		product_status = db.Table('product_status',metadata,autoload=True,autoload_with=engine)
-
-	except KeyError:
-		log.warning("Database credentials not found. ToDoList objects cannot be instantialized. Use 'glamconfigure' on command line to set archive credentials.")
-
-
+	# shared database connection; engine is created and tables reflected on first use
+	engine = LazyEngine()
+	metadata = LazyMetadata()
+	product_status = LazyTable('product_status')
+
+	# how new dates are found for each product:
+	# product: (attribute, cadence, step in days, day of January each year restarts on, first date if no records exist)
+	schedule = {
+		"merra-2":("merra","fixed",1,None,None),
+		"chirps":("chirps","dekad",None,None,None),
+		"chirps-prelim":("chirps_prelim","dekad",None,None,None),
+		"swi":("swi","fixed",5,None,None),
+		"MOD09Q1":("mod09q1","yearly",8,1,"2000.049"),
+		"MYD09Q1":("myd09q1","yearly",8,1,"2002.185"),
+		"MOD13Q1":("mod13q1","yearly",16,1,"2000.049"),
+		"MYD13Q1":("myd13q1","yearly",16,9,"2002.185"),
+		"MOD13Q4N":("mod13q4n","fixed",1,None,"2002.185")
+		}
 
 	def __init__(self):
 
@@ -306,249 +331,51 @@ class ToDoList:
 
 	def refresh(self) -> None:
 		"""Updates ToDoList to include all currently missing imagery."""
+		today = datetime.date(datetime.today())
+		missing = {p:[] for p in self.schedule.keys()}
+		latest = {p:None for p in self.schedule.keys()}
+		newRows = []
 
-		def getDbMissing(prod:str) -> list:
-			"""Return list of string dates of files in database where 'product'=={prod} and 'downloaded'==False"""
-			with self.engine.begin() as connection:
-				r = connection.execute(f"SELECT date FROM product_status WHERE product='{prod}' AND completed = 0;").fetchall()
-			return [x[0].strftime("%Y-%m-%d") for x in r]
-
-		def getLatestDate(prod:str) -> datetime.date:
-			with self.engine.begin() as connection:
-				return connection.execute(f"SELECT MAX(date) FROM product_status WHERE product='{prod}';").fetchone()[0] # gets datetime.date object
+		# 'completed' is kept up to date by every statement that sets 'processed' or 'statGen'
+		with self.engine.begin() as connection:
+			# latest date of each product, along with every incomplete date
+			r = connection.execute("SELECT l.product, l.latest, s.date FROM (SELECT product, MAX(date) AS latest FROM product_status GROUP BY product) l LEFT JOIN product_status s ON s.product = l.product AND s.completed = 0 ORDER BY l.product, s.date;").fetchall()
+			for prod, latestDate, missingDate in r:
+				if prod not in self.schedule:
+					continue
+				latest[prod] = latestDate
+				if missingDate is not None:
+					missing[prod].append(missingDate.strftime("%Y-%m-%d"))
+
+			# dates between the latest record and today
+			for prod, (attr, cadence, step, yearDay, defaultStart) in self.schedule.items():
+				start = latest[prod]
+				if start is None:
+					if defaultStart is None:
+						log.warning(f"No records found for {prod}; cannot determine which dates are missing")
+						setattr(self,attr,missing[prod])
+						continue
+					start = datetime.date(datetime.strptime(defaultStart,"%Y.%j"))
+				chrono = _candidateDates(start,today,cadence,step,yearDay)
+				for d in chrono:
+					log.debug(f"Found missing file in valid date range: {prod} for {d}")
+				newRows += [{"product":prod,"date":d} for d in chrono]
+				setattr(self,attr,missing[prod]+chrono)
 
-		def updateDatabase(product:str,unprocessed_date_string:str) -> None:
-			with self.engine.begin() as connection:
-				connection.execute(f"INSERT INTO product_status (product, date, downloaded, processed, completed) VALUES ('{product}', '{unprocessed_date_string}', 0, 0, 0);")
-
-		def getAllMerra2() -> list:
-			"""Return list of string dates of all missing merra-2 files"""
-
-			def getDbMerra2() -> list:
-				"""Return list of string dates of merra-2 files in database where 'downloaded'==False"""
-				return getDbMissing('merra-2')
-
-			def getChronoMerra2() -> list:
-				"""Return list of string dates of merra-2 files between last database entry and current time"""
-				latest = getLatestDate('merra-2')
-				today = datetime.date(datetime.today())
-				cm2 = [] # output list of merra-2 files
-				while latest < today:
-					latest = latest + timedelta(days=1)
-					log.debug(f"Found missing file in valid date range: merra-2 for {latest.strftime('%Y-%m-%d')}")
-					cm2.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('merra-2',latest.strftime("%Y-%m-%d"))
-				return cm2
-
-			return getDbMerra2() + getChronoMerra2()
-
-		def getAllChirps() -> list:
-			"""Return list of string dates of all missing chirps files"""
-
-			def getDbChirps() -> list:
-				"""Return list of string dates of chirps files in database where 'downloaded'==False"""
-				return getDbMissing('chirps')
-
-			def getChronoChirps() -> list:
-				"""Return list of string dates of chirps files between last database entry and current time"""
-				latest = getLatestDate('chirps')
-				today = datetime.date(datetime.today())
-				cc = []
-				while latest < today:
-					if int(latest.strftime("%d")) > 12:
-						latest = latest+timedelta(days=15) # push the date into the next month, but not past the 11th day of the next month
-						latest = datetime.date(datetime.strptime(latest.strftime("%Y-%m")+"-01","%Y-%m-%d")) # once we're in next month, slam the day back down to 01
-					else:
-						latest = latest+timedelta(days=10) # 01 becomes 11, 11 becomes 21
-					log.debug(f"Found missing file in valid date range: chirps for {latest.strftime('%Y-%m-%d')}")
-					cc.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('chirps',latest.strftime("%Y-%m-%d"))
-				return cc
-
-			return getDbChirps() + getChronoChirps()
-
-		def getAllChirpsPrelim() -> list:
-			"""Return list of string dates of all missing preliminary chirps files"""
-			def getDbChirpsPrelim() -> list:
-				"""Return list of string dates of chirps-prelim files in database where 'downloaded'==False"""
-				return getDbMissing('chirps-prelim')
-
-			def getChronoChirpsPrelim() -> list:
-				"""Return list of string dates of chirps-prelim files between last database entry and current time"""
-				latest = getLatestDate('chirps-prelim')
-				today = datetime.date(datetime.today())
-				cc = []
-				while latest < today:
-					if int(latest.strftime("%d")) > 12:
-						latest = latest+timedelta(days=15) # push the date into the next month, but not past the 11th day of the next month
-						latest = datetime.date(datetime.strptime(latest.strftime("%Y-%m")+"-01","%Y-%m-%d")) # once we're in next month, slam the day back down to 01
-					else:
-						latest = latest+timedelta(days=10) # 01 becomes 11, 11 becomes 21
-					log.debug(f"Found missing file in valid date range: chirps-prelim for {latest.strftime('%Y-%m-%d')}")
-					cc.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('chirps-prelim',latest.strftime("%Y-%m-%d"))
-				return cc
-
-			return getDbChirpsPrelim() + getChronoChirpsPrelim()
-
-		def getAllSwi() -> list:
-			"""Return list of string dates of all missing swi files"""
-
-			def getDbSwi() -> list:
-				"""Return list of string dates of swi files in database where 'downloaded'==False"""
-				return getDbMissing('swi')
-
-			def getChronoSwi() -> list:
-				"""Return list of string dates of swi files between last database entry and current time"""
-				latest = getLatestDate('swi')
-				today = datetime.date(datetime.today())
-				cs = []
-				while latest < today:
-					latest = latest + timedelta(days=5)
-					log.debug(f"Found missing file in valid date range: swi for {latest.strftime('%Y-%m-%d')}")
-					cs.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('swi',latest.strftime("%Y-%m-%d"))
-				return cs
-
-			return getDbSwi() + getChronoSwi()
-
-		def getAllMod09q1() -> list:
-			"""Return list of string dates of all missing MOD09Q1 files"""
-
-			def getChronoMod09q1() -> list:
-				"""Return list of string dates of MOD09Q1 files between last database entry and current time"""
-				latest = getLatestDate("MOD09Q1")
-				if latest is None:
-					latest = datetime.date(datetime.strptime("2000.049","%Y.%j"))
-				today = datetime.date(datetime.today())
-				cm = []
-				while latest < today:
-					oldYear = latest.strftime("%Y")
-					latest = latest + timedelta(days = 8)
-					if latest.strftime("%Y") != oldYear:
-						latest = latest.replace(day=1)
-					log.debug(f"Found missing file in valid date range: MOD09Q1 for {latest.strftime('%Y-%m-%d')}")
-					cm.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('MOD09Q1',latest.strftime("%Y-%m-%d"))
-				return cm
-
-			return getDbMissing("MOD09Q1") + getChronoMod09q1()
-
-		def getAllMyd09q1() -> list:
-			"""Return list of string dates of all missing MYD09Q1 files"""
-
-			def getChronoMyd09q1() -> list:
-				"""Return list of string dates for MYD09Q1 files between last database entry and current time"""
-				latest = getLatestDate("MYD09Q1")
-				if latest is None:
-					latest = datetime.date(datetime.strptime("2002.185","%Y.%j"))
-				today = datetime.date(datetime.today())
-				cm = []
-				while latest < today:
-					oldYear = latest.strftime("%Y")
-					latest = latest + timedelta(days = 8)
-					if latest.strftime("%Y") != oldYear:
-						latest = latest.replace(day=1)
-					log.debug(f"Found missing file in valid date range: MYD09Q1 for {latest.strftime('%Y-%m-%d')}")
-					cm.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('MYD09Q1',latest.strftime("%Y-%m-%d"))
-				return cm
-
-			return getDbMissing("MYD09Q1") + getChronoMyd09q1()
-
-		def getAllMod13q1() -> list:
-			"""Return list of string dates of all missing MOD13Q1 files"""
-
-			def getChronoMod13q1() -> list:
-				"""Return list of string dates for MOD13Q1 files between last database entry and current time"""
-				latest = getLatestDate("MOD13Q1")
-				if latest is None:
-					latest = datetime.date(datetime.strptime("2000.049","%Y.%j"))
-				today = datetime.date(datetime.today())
-				cm = []
-				while latest < today:
-					oldYear = latest.strftime("%Y")
-					latest = latest + timedelta(days = 16)
-					if latest.strftime("%Y") != oldYear:
-						latest = latest.replace(day=1)
-					log.debug(f"Found missing file in valid date range: MOD13Q1 for {latest.strftime('%Y-%m-%d')}")
-					cm.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('MOD13Q1',latest.strftime("%Y-%m-%d"))
-				return cm
-
-			return getDbMissing("MOD13Q1") + getChronoMod13q1()
-
-		def getAllMyd13q1() -> list:
-			"""Return list of string dates of all missing MYD13Q1 files"""
-
-			def getChronoMyd13q1() -> list:
-				"""Return list of string dates for MYD09Q1 files between last database entry and current time"""
-				latest = getLatestDate("MYD13Q1")
-				if latest is None:
-					latest = datetime.date(datetime.strptime("2002.185","%Y.%j"))
-				today = datetime.date(datetime.today())
-				cm = []
-				while latest < today:
-					oldYear = latest.strftime("%Y")
-					latest = latest + timedelta(days = 16)
-					if latest.strftime("%Y") != oldYear:
-						latest = latest.replace(day=9)
-					log.debug(f"Found missing file in valid date range: MYD13Q1 for {latest.strftime('%Y-%m-%d')}")
-					cm.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('MYD13Q1',latest.strftime("%Y-%m-%d"))
-				return cm
-
-			return getDbMissing("MYD13Q1") + getChronoMyd13q1()
-
-		def getAllMod13q4n() -> list:
-			"""Return list of string dates of all missing MYD13Q1 files"""
-
-			def getChronoMod13q4n() -> list:
-				"""Return list of string dates for MYD09Q1 files between last database entry and current time"""
-				latest = getLatestDate("MOD13Q4N")
-				if latest is None:
-					latest = datetime.date(datetime.strptime("2002.185","%Y.%j"))
-				today = datetime.date(datetime.today())
-				cm = []
-				while latest < today:
-					oldYear = latest.strftime("%Y")
-					latest = latest + timedelta(days = 1)
-					if latest.strftime("%Y") != oldYear:
-						latest = latest.replace(day=1)
-					log.debug(f"Found missing file in valid date range: MOD13Q4N for {latest.strftime('%Y-%m-%d')}")
-					cm.append(latest.strftime("%Y-%m-%d"))
-					updateDatabase('MOD13Q4N',latest.strftime("%Y-%m-%d"))
-				return cm
-
-			return getDbMissing("MOD13Q4N") + getChronoMod13q4n()
+			if newRows:
+				connection.execute(db.text("INSERT INTO product_status (product, date, downloaded, processed, completed) VALUES (:product, :date, 0, 0, 0);"),newRows)
 
-		with self.engine.begin() as connection:
-			connection.execute("UPDATE product_status SET completed = 1 WHERE processed = 1 AND statGen = 1;")
-			connection.execute("UPDATE product_status SET completed = 0 WHERE processed = 0 OR statGen = 0;")
-
-		self.merra = getAllMerra2()
-		self.chirps = getAllChirps()
-		self.chirps_prelim = getAllChirpsPrelim()
-		self.swi = getAllSwi()
-		self.mod09q1 = getAllMod09q1()
-		self.myd09q1 = getAllMyd09q1()
-		self.mod13q1 = getAllMod13q1()
-		self.myd13q1 = getAllMyd13q1()
-		self.mod13q4n = getAllMod13q4n()
 		self.timestamp = datetime.now()
 		self.filtered = False
 
 	def filterUnavailable(self) -> None:
 		filterMachine = Downloader()
-		self.chirps = [f for f in self.chirps if filterMachine.isAvailable('chirps',f)]
-		self.chirps_prelim = [f for f in self.chirps_prelim if filterMachine.isAvailable('chirps-prelim',f)]
-		self.merra = [f for f in self.merra if filterMachine.isAvailable('merra-2',f)]
-		self.swi = [f for f in self.swi if filterMachine.isAvailable('swi',f)]
-		self.mod09q1 = [f for f in self.mod09q1 if filterMachine.isAvailable("MOD09Q1",f)]
-		self.myd09q1 = [f for f in self.myd09q1 if filterMachine.isAvailable("MYD09Q1",f)]
-		self.mod13q1 = [f for f in self.mod13q1 if filterMachine.isAvailable("MOD13Q1",f)]
-		self.myd13q1 = [f for f in self.myd13q1 if filterMachine.isAvailable("MYD13Q1",f)]
-		self.mod13q4n = [f for f in self.mod13q4n if filterMachine.isAvailable("MOD13Q4N",f)]
+		# all products are checked at once, a few requests at a time per host
+		candidates = list(self)
+		available = checkMany(filterMachine.isAvailable,candidates)
+		keep = set(c for c, a in zip(candidates,available) if a)
+		for prod, (attr, *_) in self.schedule.items():
+			setattr(self,attr,[d for d in getattr(self,attr) if (prod,d) in keep])
 		self.filtered = True
 
 # find which imagery doesn't have all statistics generated
@@ -577,24 +404,18 @@ class MissingStatistics:
 		each missing combo for that file.
 
 	"""
-	# mysql credentials
-	try:
-		mysql_user = os.environ['glam_mysql_user']
-		mysql_pass = os.environ['glam_mysql_pass']
-		mysql_db = 'modis_dev'
-
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
-		metadata = db.MetaData()
-		masks = db.Table('masks', metadata, autoload=True, autoload_with=engine)
-		regions = db.Table('regions', metadata, autoload=True, autoload_with=engine)
-		products = db.Table('products', metadata, autoload=True, autoload_with=engine)
-		stats = db.Table('stats', metadata, autoload=True, autoload_with=engine)
-		product_status = db.Table('product_status',metadata,autoload=True,autoload_with=engine)
-
-	except KeyError:
-		log.warning("Database credentials not found. MissingStatistics objects cannot be instantialized. Use 'glamconfigure' on command line to set archive credentials.")
-
-	def __init__(self, products = octvi.supported_products+ancillary_products):
+	# shared database connection; engine is created and tables reflected on first use
+	engine = LazyEngine()
+	metadata = LazyMetadata()
+	masks = LazyTable('masks')
+	regions = LazyTable('regions')
+	products = LazyTable('products')
+	stats = LazyTable('stats')
+	product_status = LazyTable('product_status')
+
+	def __init__(self, products = None):
+		if products is None:
+			products = octvi.supported_products+ancillary_products
 		self.generated = False
 		self.genTime = None
 		if not (isinstance(products,list) or isinstance(products,tuple)):
@@ -893,33 +714,22 @@ class Downloader:
 	listMissing(directory:str) -> list:
 		given directory with some imagery in it (all of the same product), returns list of missing imagery available on S3
 	"""
-	# data archive credentials
-	credentials = False
-	try:
-		merraUsername = os.environ['merrausername']
-		merraPassword = os.environ['merrapassword']
-		swiUsername = os.environ['swiusername']
-		swiPassword = os.environ['swipassword']
-		credentials = True
-	except KeyError:
-		log.warning("Data archive credentials not set. The following functionality will be unavailable:\n\tDownloader.isAvailable()\n\tDownloader.pullFromSource()\nUse 'glamconfigure' on command line to set archive credentials.")
-
-	# mysql credentials
-	noCred = None
-	try:
-		mysql_user = os.environ['glam_mysql_user']
-		mysql_pass = os.environ['glam_mysql_pass']
-		mysql_db = 'modis_dev'
-
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
-		metadata = db.MetaData()
-		masks = db.Table('masks', metadata, autoload=True, autoload_with=engine)
-		regions = db.Table('regions', metadata, autoload=True, autoload_with=engine)
-		products = db.Table('products', metadata, autoload=True, autoload_with=engine)
-		stats = db.Table('stats', metadata, autoload=True, autoload_with=engine)
-		product_status = db.Table('product_status',metadata,autoload=True,autoload_with=engine)
-	except KeyError:
-		noCred = True
+	# data archive credentials; read from the environment on access
+	credentials = CredentialsSet("merrausername","merrapassword","swiusername","swipassword")
+	merraUsername = Credential("merrausername")
+	merraPassword = Credential("merrapassword")
+	swiUsername = Credential("swiusername")
+	swiPassword = Credential("swipassword")
+
+	# shared database connection; engine is created and tables reflected on first use
+	noCred = CredentialsMissing()
+	engine = LazyEngine()
+	metadata = LazyMetadata()
+	masks = LazyTable('masks')
+	regions = LazyTable('regions')
+	products = LazyTable('products')
+	stats = LazyTable('stats')
+	product_status = LazyTable('product_status')
 
 
 	def __repr__(self):
@@ -933,54 +743,22 @@ class Downloader:
 
 		def checkMerra(date:str) -> bool:
 			for i in range(5): # we are collecting the requested date along with 4 previous days
-				mDate = datetime.strptime(date,"%Y-%m-%d") - timedelta(days=i)
-				mYear = mDate.strftime("%Y")
-				mMonth = mDate.strftime("%m").zfill(2)
-				mDay = mDate.strftime("%d").zfill(2)
-				pageUrl = f"https://goldsmr4.gesdisc.eosdis.nasa.gov/data/MERRA2/M2SDNXSLV.5.12.4/{mYear}/{mMonth}/"
-				try:
-					pageObject = urlopen(pageUrl)
-					pageText = str(pageObject.read())
-					ex = re.compile(f'MERRA2\S*{mYear}{mMonth}{mDay}.nc4') # regular expression that matches file name of desired date file
-					mFileName = re.search(ex,pageText).group() # matches desired file name from web page
-				except HTTPError: # if any file in the range is missing, don't generate the mosaic at all
+				mDate = (datetime.strptime(date,"%Y-%m-%d") - timedelta(days=i)).strftime("%Y-%m-%d")
+				listing = merra2Listing(mDate) # each month's page is fetched once per run
+				if not listing: # if any file in the range is missing, don't generate the mosaic at all
 					return False
-				except AttributeError:
-					log.warning(f"Failed to find Merra-2 URL for {mDate.strftime('%Y-%m-%d')}. We seem to have caught the merra-2 team in the middle of uploading their data... check {pageUrl} to be sure.")
+				if mDate not in listing:
+					log.warning(f"Failed to find Merra-2 URL for {mDate}. We seem to have caught the merra-2 team in the middle of uploading their data.")
 					return False
 			return True
 
 		def checkChirps(date:str) -> bool:
-			## get url to be downloaded
-			cDate = datetime.strptime(date,"%Y-%m-%d")
-			cYear = cDate.strftime("%Y")
-			cMonth = cDate.strftime("%m").zfill(2)
-			cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
-			url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif.gz"
-			## try to open url
-			with requests.Session() as session:
-				# not sure if both these steps are strictly necessary. Try removing
-				# one and see if everything breaks!
-				r1 = session.request('get',url)
-				r = session.get(r1.url)
-			if r.status_code != 200:
-				return False
-			else:
-				return True
+			## look for file in directory listing, which is fetched once per run
+			return chirpsUrl("chirps",date) is not None
 
 		def checkChirpsPrelim(date:str) -> bool:
-			## get url to be downloaded
-			cDate = datetime.strptime(date,"%Y-%m-%d")
-			cYear = cDate.strftime("%Y")
-			cMonth = cDate.strftime("%m").zfill(2)
-			cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
-			url = f"ftp://ftp.chg.ucsb.edu/pub/org/chg/products/CHIRPS-2.0/prelim/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif"
-			## try to open url
-			try:
-				fh = urlopen(Request(url))
-				return True
-			except URLError:
-				return False
+			## look for file in directory listing, which is fetched once per run
+			return chirpsUrl("chirps-prelim",date) is not None
 
 		def checkSwi(date:str) -> bool:
 
@@ -991,14 +769,12 @@ class Downloader:
 			url = f"https://land.copernicus.vgt.vito.be/PDF/datapool/Vegetation/Soil_Water_Index/Daily_SWI_12.5km_Global_V3/{year}/{month}/{day}/SWI_{year}{month}{day}1200_GLOBE_ASCAT_V3.1.1/c_gls_SWI_{year}{month}{day}1200_GLOBE_ASCAT_V3.1.1.nc"
 			#print(url)
 
-			with requests.Session() as session:
-				session.auth = (self.swiUsername, self.swiPassword)
-				request = session.request('get',url)
-				if request.status_code == 200:
-					if request.headers['Content-Type'] == 'application/octet-stream':
-						return True
-				else:
-					return False
+			status, headers = probe(url,auth=(self.swiUsername, self.swiPassword))
+			if status == 200:
+				if headers.get('Content-Type') == 'application/octet-stream':
+					return True
+			else:
+				return False
 
 			#r1 = requests.get(url)
 			#request = requests.get(url,auth=(self.swiUsername,self.swiPassword))
@@ -1057,31 +833,31 @@ class Downloader:
 				#return False
 
 		def checkMod09q1(date:str) -> bool:
-			if len(octvi.url.getDates("MOD09Q1",date)) > 0:
+			if len(octviDates("MOD09Q1",date)) > 0:
 				return True
 			else:
 				return False
 
 		def checkMyd09q1(date:str) -> bool:
-			if len(octvi.url.getDates("MYD09Q1",date)) > 0:
+			if len(octviDates("MYD09Q1",date)) > 0:
 				return True
 			else:
 				return False
 
 		def checkMod13q1(date:str) -> bool:
-			if len(octvi.url.getDates("MOD13Q1",date)) > 0:
+			if len(octviDates("MOD13Q1",date)) > 0:
 				return True
 			else:
 				return False
 
 		def checkMyd13q1(date:str) -> bool:
-			if len(octvi.url.getDates("MYD13Q1",date)) > 0:
+			if len(octviDates("MYD13Q1",date)) > 0:
 				return True
 			else:
 				return False
 
 		def checkMod13q4n(date:str) -> bool:
-			if len(octvi.url.getDates("MOD13Q4N",date)) > 0:
+			if len(octviDates("MOD13Q4N",date)) > 0:
 				return True
 			else:
 				return False
@@ -1119,115 +895,6 @@ class Downloader:
 			path to output directory, where the cloud-optimized geoTiff will be stored
 		"""
 
-		def project_to_sinusoidal_inPlace(in_file:str) -> int:
-			"""
-			This function, given a path to a file, projects it to sinusoidal in place
-
-			...
-
-			Parameters
-			----------
-			in_file:str
-				string path to input file; file name must match "{product}.{date}*.tif"
-
-			Return values
-			-------------
-			0: function executed successfully
-			1: projection failed
-			2: gdal failed to read file
-			"""
-			product = os.path.basename(in_file).split(".")[0]
-			# Merra-2 and CHIRPS come as un-projected arrays, and must be defined to geographic before projecting to sinusoidal
-			if len(gdal.Open(in_file,0).GetProjection()) == 0:
-				srs = osr.SpatialReference() # create SpatialReference object
-				srs.ImportFromEPSG(4326) # standard geographic coordinate system EPSG number
-				ds = None
-				try:
-					ds = gdal.Open(in_file,gdal.GA_Update) # open file in update mode
-				except RuntimeError: # thrown if file path is bad
-					log.error(f"--projection failed: {in_file} does not exist")
-				if ds:
-					res = ds.SetProjection(srs.ExportToWkt()) # define projection to geographic
-					if res != 0:
-						log.error("--projection failed: {}".format(str(res)))
-						return 1
-					ds = None
-				else:
-					log.error("--could not open with GDAL")
-					return 2
-			# reproject to sinusoidal
-			## copy to intermediate file
-			intermediate_file = in_file.replace(".tif",".TEMP.tif")
-			with open(intermediate_file,'wb') as a:
-				with open(in_file,'rb') as b:
-					shutil.copyfileobj(b,a)
-			#print(in_file,intermediate_file)
-			sinus = 'PROJCS["Sinusoidal",GEOGCS["GCS_Undefined",DATUM["Undefined",SPHEROID["User_Defined_Spheroid",6371007.181,0.0]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],UNIT["Meter",1.0]]' # MODIS sinusoidal projection
-			if product:# == "swi":
-				intF= gdal.Open(intermediate_file,0)
-				in_srs = intF.GetProjection()
-				intF = None
-				gdal.Warp(in_file,intermediate_file,srcSRS = in_srs,dstSRS = sinus) #
-			else:
-				gdal.Warp(in_file,intermediate_file,dstSRS = sinus) # reproject back to original file name, this time in MODIS sinusoidal
-			os.remove(intermediate_file) # delete intermediate file
-			# CHECK EXTENTS AGAINST MODIS
-			needsClipped = False
-			ds = gdal.Open(in_file,0)
-			gt = ds.GetGeoTransform()
-			cell = gt[1]
-			x = ds.RasterXSize
-			y = ds.RasterYSize
-			north = gt[3]
-			west = gt[0]
-			east = west+(cell*x)
-			south = north-(cell*y)
-			maxNorth= 9962342# 9972315.0495 * 0.999
-			maxWest= -22735470# -22758229.000 * 0.999
-			maxSouth = -9143189# -9152341.5816 * 0.999
-			maxEast= 20958445# 20979424.893 * 0.999
-			if north > maxNorth:
-				north = maxNorth
-				needsClipped = True
-			if west < maxWest:
-				west = maxWest
-				needsClipped = True
-			if south < maxSouth:
-				south = maxSouth
-				needsClipped = True
-			if east > maxEast:
-				east = maxEast
-				needsClipped = True
-			if needsClipped:
-				# clip with GDAL_translate
-				clipFile = in_file.replace(".tif",".CLIPPING.tif")
-				with open(clipFile,'wb') as a:
-					with open(in_file,'rb') as b:
-						shutil.copyfileobj(b,a)
-				clip_args = ["gdal_translate", "-q", "-projwin",str(west),str(north),str(east),str(south),clipFile,in_file]
-				subprocess.call(clip_args)
-				os.remove(clipFile)
-			return 0
-
-		def cloud_optimize_inPlace(in_file:str) -> None:
-			"""Takes path to input and output file location. Reads tif at input location and writes cloud-optimized geotiff of same data to output location."""
-			## add overviews to file
-			cloudOpArgs = ["gdaladdo",in_file]
-			subprocess.call(cloudOpArgs)
-
-			## copy file
-			intermediate_file = in_file.replace(".tif",".TEMP.tif")
-			with open(intermediate_file,'wb') as a:
-				with open(in_file,'rb') as b:
-					shutil.copyfileobj(b,a)
-
-			## add tiling to file
-			cloudOpArgs = ["gdal_translate",intermediate_file,in_file,'-q','-co', "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', "COMPRESS=LZW", "-co", "PREDICTOR=2"]
-			subprocess.call(cloudOpArgs)
-
-			## remove intermediate
-			os.remove(intermediate_file)
-
 		def downloadMerra2(date:str,out_dir:str) -> tuple:
 			"""
 			Given date of merra product, downloads file to output directory
@@ -1235,152 +902,39 @@ class Downloader:
 			Downloaded files are COGs in sinusoidal projection
 			"""
 
-			## define how to mosaic list of file paths
-			def mosaic_merra2(path_list:list,metric:str) -> str:
-				"""
-				Takes a list of file paths, and mosaics results to a file ('merra-2.{date}.{metric}.tif') in output directory
-				Returns file path to mosaic
-				"""
-				def create_array_from_dataset(path):
-					"""Converts data set to NumPy array"""
-					sds = gdal.Open(path,0)
-					band = sds.GetRasterBand(1)
-					outArray=BandReadAsArray(band)
-					del sds
-					return outArray
-				def save_array_to_file(in_array,out_path):
-					"""Takes numPy array, out file path, and model file (for size, geo_transform, and projection) to create geoTiff output"""
-					driver = gdal.GetDriverByName('GTiff')
-					dataset = driver.Create(out_path,576,361,1,gdal.GDT_Float32,['COMPRESS=LZW'])
-					dataset.GetRasterBand(1).WriteArray(in_array)
-					dataset.SetGeoTransform((-180.3125, 0.625, 0.0, 90.25, 0.0, -0.5))
-					dataset.GetRasterBand(1).SetNoDataValue(1E15)
-					dataset.FlushCache() # Write to disk
-					del dataset
-					return 0
-
-				out = os.path.join(out_dir,f"merra-2.{date}.tif")
-
-				metric_arrays = []
-				for f in path_list:
-					metric_arrays.append(create_array_from_dataset(f))
-				metric_cube = np.dstack(metric_arrays)
-				if metric == "min":
-					oa = np.amin(metric_cube,axis=2)
-					on = out.replace(".tif",".min.tif")
-				elif metric == "max":
-					oa = np.amax(metric_cube,axis=2)
-					on = out.replace(".tif",".max.tif")
-				elif metric == "mean":
-					oa = np.mean(metric_cube,axis=2)
-					on = out.replace(".tif",".mean.tif")
-				else:
-					w=f"WARNING: {k} does not match known stat (min, max, mean)\nSource: Merra-2, {out}"
-					log.warning(w)
-				save_array_to_file(oa,on)
-				return on
-
-			## generate list of urls (we have to mosaic merra)
-			m2Urls = []
-			for i in range(5): # we are collecting the requested date along with 4 previous days
-				mDate = datetime.strptime(date,"%Y-%m-%d") - timedelta(days=i)
-				mYear = mDate.strftime("%Y")
-				mMonth = mDate.strftime("%m").zfill(2)
-				mDay = mDate.strftime("%d").zfill(2)
-				pageUrl = f"https://goldsmr4.gesdisc.eosdis.nasa.gov/data/MERRA2/M2SDNXSLV.5.12.4/{mYear}/{mMonth}/"
-				try:
-					pageObject = urlopen(pageUrl)
-					pageText = str(pageObject.read())
-					ex = re.compile(f'MERRA2\S*{mYear}{mMonth}{mDay}.nc4') # regular expression that matches file name of desired date file
-					mFileName = re.search(ex,pageText).group() # matches desired file name from web page
-					mUrl = pageUrl + mFileName
-					m2Urls.append(mUrl)
-				except HTTPError: # if any file in the range is missing, don't generate the mosaic at all
-					log.warning(f"No Merra-2 file exists for {date}")
-					return ()
-
-			## dictionary of empty lists of metric-specific file paths, waiting to be filled
-			merraFiles = {
-					'min':[],
-					'mean':[],
-					'max':[]
-				}
-
-			## loop over list of urls
-			log.debug(m2Urls)
-			for url in m2Urls:
-				urlDate = url.split(".")[-2]
-				## use requests module to download MERRA-2 file (.nc4)
-				with requests.Session() as session:
-					session.auth = (self.merraUsername, self.merraPassword)
-					r1 = session.request('get',url)
-					r = session.get(r1.url,auth=(self.merraUsername, self.merraPassword))
-				outNc4 = os.path.join(out_dir,f"merra-2.{urlDate}.NETCDF.TEMP.nc") # NetCDF file path
-				# write output .nc4 file
-				with open(outNc4,"wb") as fd: # write data in chunks
-					for chunk in r.iter_content(chunk_size = 1024*1024):
-						fd.write(chunk)
-
-				##CHECKSUM
-				observedSize = int(os.stat(outNc4).st_size) # size of downloaded file in bytes
-				expectedSize = int(r.headers['Content-Length']) # size of promised file in bytes, extracted from server-delivered headers
-
-				## checksum failure; return empty tuple
-				if observedSize != expectedSize: # checksum failure
-					w=f"WARNING:\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-					log.warning(w)
-					return () # no files for you today, but we'll try again tomorrow!
-
-
-				# as of now it's a .nc4 file, we need TIFFs of just the 3 subdatasets we're interested in (T2MMEAN, T2MIN, T2MAX)
-
-				## extract subdataset names
-				dataset= gdal.Open(outNc4,0)
-				sdMin = dataset.GetSubDatasets()[3][0] # full name of T2MMIN subdataset
-				sdMax = dataset.GetSubDatasets()[1][0] # full name of T2MMAX subdataset
-				sdMean = dataset.GetSubDatasets()[2][0] # full name of T2MMEAN subdataset
+			## define how to write a composite array to file
+			def save_array_to_file(in_array,out_path):
+				"""Takes numPy array, out file path, and model file (for size, geo_transform, and projection) to create geoTiff output"""
+				driver = gdal.GetDriverByName('GTiff')
+				dataset = driver.Create(out_path,576,361,1,gdal.GDT_Float32,['COMPRESS=LZW'])
+				dataset.GetRasterBand(1).WriteArray(in_array)
+				dataset.SetGeoTransform((-180.3125, 0.625, 0.0, 90.25, 0.0, -0.5))
+				dataset.GetRasterBand(1).SetNoDataValue(1E15)
+				dataset.FlushCache() # Write to disk
 				del dataset
+				return 0
 
-				## copy subdatasets to new files
-				minOut = os.path.join(out_dir,f"M2_MIN.{urlDate}.TEMP.tif")
-				maxOut = os.path.join(out_dir,f"M2_MAX.{urlDate}.TEMP.tif")
-				meanOut = os.path.join(out_dir,f"M2_MEAN.{urlDate}.TEMP.tif")
-				subprocess.call(["gdal_translate","-q",sdMin,minOut]) # calling the command line to produce the tiff
-				subprocess.call(["gdal_translate","-q",sdMax,maxOut]) # calling the command line to produce the tiff
-				subprocess.call(["gdal_translate","-q",sdMean,meanOut]) # calling the command line to produce the tiff
-
-				## delete netCDF file
-				os.remove(outNc4)
-
-				## append subdataset file paths to corresponding lists in dictionary
-				merraFiles['min'].append(minOut)
-				merraFiles['mean'].append(meanOut)
-				merraFiles['max'].append(maxOut)
-
-			# merraFiles now stores a list of files for each metric type
-			# for each metric, we mosaic all the files by that metric
-			# e.g. minimum of the "mins", maximum of all "maxes", mean of all "means"
+			## composite the requested date along with 4 previous days
+			# minimum of the "mins", maximum of all "maxes", mean of all "means" are
+			# accumulated as each day arrives; days extracted for an earlier
+			# composite are read from the local cache, so usually only the newest
+			# day is downloaded
+			try:
+				composite = merra2.compositeDays(merra2.compositeDates(date),out_dir,(self.merraUsername, self.merraPassword),metrics=("min","mean","max"))
+			except UnavailableError as e: # if any file in the range is missing, don't generate the mosaic at all
+				log.warning(e)
+				return () # no files for you today, but we'll try again tomorrow!
 
-			## loop over metric in ("min","mean","max")
+			## loop over requested metrics
 			merraOut = []
-			log.debug(merraFiles)
-			for metric in merraFiles.keys():
-
-				## get list of files to be mosaicked
-				mosaic_fileList = merraFiles[metric]
-
-				## mosaic into out product
-				mosaicPath = mosaic_merra2(mosaic_fileList, metric)
+			for metric in composite.metrics:
 
-				## delete individual files
-				for f in mosaic_fileList:
-					os.remove(f)
+				## write mosaic to file ('merra-2.{date}.{metric}.tif') in output directory
+				mosaicPath = os.path.join(out_dir,f"merra-2.{date}.{metric}.tif")
+				save_array_to_file(composite.result(metric),mosaicPath)
 
-				## project mosaic to sinusoidal
-				project_to_sinusoidal_inPlace(mosaicPath)
-
-				## cloud-optimize mosaic
-				cloud_optimize_inPlace(mosaicPath)
+				## project mosaic to sinusoidal and cloud-optimize
+				regrid.sinusoidalCog(mosaicPath)
 
 				## add mosaic to list
 				merraOut.append(mosaicPath)
@@ -1398,7 +952,6 @@ class Downloader:
 			try:
 				## define file locations
 				file_unzipped = os.path.join(out_dir,f"chirps.{date}.tif") # output location for final file
-				file_zipped=file_unzipped+".gz" # initial location for zipped version of file
 
 				## get url to be downloaded
 				cDate = datetime.strptime(date,"%Y-%m-%d")
@@ -1408,52 +961,27 @@ class Downloader:
 				# falls in (1-10, 11-20, 21-end). Chirps urls use these integers instead of day
 				cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
 				url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif.gz"
-
-				# download the gnuzip file
-				with requests.Session() as session:
-					# not sure if both these steps are strictly necessary. Try removing
-					# one and see if everything breaks!
-					r1 = session.request('get',url)
-					r = session.get(r1.url)
-				# nonexistent imagery gives a 404 response
-				if r.status_code != 200:
+				if chirpsUrl("chirps",date) is None: # not in directory listing
 					log.warning(f"Url {url} not found")
 					return ()
-				# write zipped .gz file to disk
-				with open(file_zipped,"wb") as fd: # write data in chunks
-					for chunk in r.iter_content(chunk_size = 1024*1024):
-						fd.write(chunk)
-
-				##CHECKSUM
-				observedSize = int(os.stat(file_zipped).st_size) # size of downloaded file in bytes
-				expectedSize = int(r.headers['Content-Length']) # size of promised file in bytes, extracted from server-delivered headers
-
-				## checksum failure; return empty tuple
-				if observedSize != expectedSize: # checksum failure
-					w=f"WARNING:\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-					log.warning(w)
+
+				## download the gnuzip file, unzipping into memory and checking size as it streams;
+				## a copy in the source cache is used instead, if there is one
+				try:
+					chunks, expectedSize = fetch.stream(url)
+					file_mem = decode.writeVsimem(chunks,os.path.basename(file_unzipped),expectedSize,gunzip=True)
+				except UnavailableError as e: # e.g. nonexistent imagery gives a 404 response
+					log.warning(e)
 					return () # no files for you today, but we'll try again tomorrow!
 
-				## use gzip to unzip file to final location
-				tf = file_unzipped.replace(".tif",".UNMASKED.tif")
-				with gzip.open(file_zipped) as fz:
-					with open(tf,"w+b") as fu:
-						shutil.copyfileobj(fz,fu)
-				os.remove(file_zipped) # delete zipped version
-
-				## apply nodata mask to file
-				chirps_noData_args = ["gdal_translate","-q","-a_nodata", "-9999",tf,file_unzipped] # apply NoData mask
-				subprocess.call(chirps_noData_args)
-				os.remove(tf) # delete unmasked file
-
-				## project file to sinusoidal
-				prj = project_to_sinusoidal_inPlace(file_unzipped)
-				if prj != 0:
+				## project file to sinusoidal and cloud-optimize; nodata is applied as it is read
+				try:
+					regrid.sinusoidalCog(file_mem,file_unzipped,src_nodata=-9999)
+				except RuntimeError:
 					log.warning(f"Failed to project {file_unzipped}")
 					return ()
-
-				## cloud-optimize file
-				cloud_optimize_inPlace(file_unzipped)
+				finally:
+					decode.unlink(file_mem)
 
 				## return file path string in tuple
 				return tuple([file_unzipped])
@@ -1470,48 +998,36 @@ class Downloader:
 			"""
 			try:
 				file_out = os.path.join(out_dir,f"chirps-prelim.{date}.tif")
-				tf = file_out.replace(".tif",".UNMASKED.tif")
 
 				## get url to be downloaded
 				cDate = datetime.strptime(date,"%Y-%m-%d")
 				cYear = cDate.strftime("%Y")
 				cMonth = cDate.strftime("%m").zfill(2)
 				cDay = str(int(np.ceil(int(cDate.strftime("%d"))/10)))
-				url = f"ftp://ftp.chg.ucsb.edu/pub/org/chg/products/CHIRPS-2.0/prelim/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif"
-
-				## download file at url
-				try:
-					with open(tf,"w+b") as fd:
-						fs = urlopen(Request(url))
-						shutil.copyfileobj(fs,fd)
-				except URLError:
+				## CHIRPS data has been moved off of FTP server onto HTTPS
+				# url = f"ftp://ftp.chg.ucsb.edu/pub/org/chg/products/CHIRPS-2.0/prelim/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif"
+				url = f"https://data.chc.ucsb.edu/products/CHIRPS-2.0/prelim/global_dekad/tifs/chirps-v2.0.{cYear}.{cMonth}.{cDay}.tif"
+				if chirpsUrl("chirps-prelim",date) is None: # not in directory listing
 					log.warning(f"No Chirps file exists for {date}")
-					os.remove(tf)
 					return ()
 
-				## checksum
-				observedSize = int(os.stat(tf).st_size) # size of downloaded file (bytes)
-				expectedSize = int(urlopen(Request(url)).info().get("Content-length")) # size anticipated from header (bytes)
-
-				## checksum fails, log warning and return empty list
-				if observedSize != expectedSize:
-					w=f"WARNING:\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-					log.warning(w)
-					os.remove(tf)
+				## download file at url into memory, checking size as it streams;
+				## a copy in the source cache is used instead, if there is one
+				try:
+					chunks, expectedSize = fetch.stream(url)
+					file_mem = decode.writeVsimem(chunks,os.path.basename(file_out),expectedSize)
+				except UnavailableError as e: # e.g. nonexistent files give a 404 response
+					log.warning(e)
 					return ()
 
-				## apply nodata mask to file
-				chirps_noData_args = ["gdal_translate","-q","-a_nodata", "-9999",tf,file_out] # apply NoData mask
-				subprocess.call(chirps_noData_args)
-				os.remove(tf) # delete unmasked file
-
-				## project file to sinusoidal
-				prj = project_to_sinusoidal_inPlace(file_out)
-				if prj != 0:
+				## project file to sinusoidal and cloud-optimize; nodata is applied as it is read
+				try:
+					regrid.sinusoidalCog(file_mem,file_out,src_nodata=-9999)
+				except RuntimeError:
+					log.warning(f"Failed to project {file_out}")
 					return ()
-
-				## cloud-optimize file
-				cloud_optimize_inPlace(file_out)
+				finally:
+					decode.unlink(file_mem)
 
 				## return tuple of file path
 				return tuple([file_out])
@@ -1543,16 +1059,12 @@ class Downloader:
 			file_nc = out.replace("tif","nc") # temporary NetCDF file; later to be converted to tiff
 			#print(url)
 
-			## use requests module to download MERRA-2 file (.nc4)
-			with requests.Session() as session:
-				session.auth = (self.swiUsername, self.swiPassword)
-				r1 = session.request('get',url)
-				r = session.get(r1.url,auth=(self.swiUsername, self.swiPassword))
-				headers = r.headers
-			# write output .nc file
-			with open(file_nc,"wb") as fd: # write data in chunks
-				for chunk in r.iter_content(chunk_size = 1024*1024):
-					fd.write(chunk)
+			## download SWI file (.nc), resuming if the connection drops; copernicus demands credentials twice!
+			try:
+				fetch.download(url,file_nc,auth=(self.swiUsername, self.swiPassword))
+			except UnavailableError as e:
+				log.warning(e)
+				return ()
 			#try:
 				#with open(file_nc,"w+b") as fz:
 					#fh = urlopen(Request(url))
@@ -1562,16 +1074,6 @@ class Downloader:
 				#os.remove(file_nc)
 				#return ()
 
-			## checksum
-			observedSize = int(os.stat(file_nc).st_size) # size of downloaded file (bytes)
-			expectedSize = int(headers['Content-Length']) # size anticipated from header (bytes)
-
-			if int(observedSize) != int(expectedSize):
-				w=f"\nExpected file size:\t{expectedSize} bytes\nObserved file size:\t{observedSize} bytes"
-				log.warning(w)
-				os.remove(file_nc)
-				return ()
-
 			#try:
 				### log into copernicus
 				#log.debug("log in to Copernicus...")
@@ -1653,25 +1155,19 @@ class Downloader:
 				#log.warning(w)
 				#return ()
 
-			## extract desired band as GeoTiff
-			dataset= gdal.Open(file_nc,0)
-			# search all subdatasets for 10-day swi
-			for sd in dataset.GetSubDatasets():
-				if sd[0].split(":")[-1] == "SWI_010":
-					subdataset=sd[0]
-			del dataset
-			# translate subdataset to its own tiff and delete full netCDF
-			swiArgs = ["gdal_translate","-q",subdataset,out] # arguments for gdal to transform subdataset into independent Tiff
-			subprocess.call(swiArgs) # calling the command line to produce the tiff
-			os.remove(file_nc)
-
-			## project file to sinusoidal
-			prj = project_to_sinusoidal_inPlace(out)
-			if prj != 0:
+			## open 10-day swi in place, then project it to sinusoidal and cloud-optimize;
+			## the NetCDF library needs a real file, so only the .nc touches disk
+			try:
+				subdataset = decode.netcdfSubdataset(file_nc,"SWI_010")
+				regrid.sinusoidalCog(subdataset,out)
+			except UnavailableError as e:
+				log.warning(e)
 				return ()
-
-			## cloud-optimize file
-			cloud_optimize_inPlace(out)
+			except RuntimeError:
+				log.warning(f"Failed to project {out}")
+				return ()
+			finally:
+				os.remove(file_nc)
 
 			## return tuple of file path string
 			return tuple([out])
@@ -1788,7 +1284,7 @@ class Downloader:
 				results.append(outFile)
 				try:
 					s3_client.download_file(s3_bucket,s3_key,outFile)
-				except ClientError:
+				except botoExceptions.ClientError:
 					log.error("File not available on S3")
 					return ()
 				except Exception:
@@ -1800,7 +1296,7 @@ class Downloader:
 			results.append(outFile)
 			try:
 				s3_client.download_file(s3_bucket,s3_key,outFile)
-			except ClientError:
+			except botoExceptions.ClientError:
 				log.error("File not available on S3")
 				return ()
 			except Exception:
@@ -1813,7 +1309,7 @@ class Downloader:
 			results.append(outFile)
 			try:
 				s3_client.download_file(s3_bucket,s3_key,outFile)
-			except ClientError:
+			except botoExceptions.ClientError:
 				log.error("File not available on S3")
 				return ()
 			except Exception:
@@ -1827,7 +1323,7 @@ class Downloader:
 			results.append(outFile)
 			try:
 				s3_client.download_file(s3_bucket,s3_key,outFile)
-			except ClientError:
+			except botoExceptions.ClientError:
 				log.error("File not available on S3")
 				return ()
 			except Exception:
@@ -1897,22 +1393,14 @@ class Downloader:
 			for ancillary files, and "PRODUCT.YYYY.JJJ.tif" for NDVI
 			files.
 		"""
-		dir_files = glob.glob(os.path.join(directory,"*.tif"))
 		dir_products = []
 		dir_dates = []
-		for f in dir_files:
-			parts = os.path.basename(f).split(".")
-			product = parts[0]
-			try:
-				if product in octvi.supported_products:
-					date = datetime.strptime(f"{parts[1]}.{parts[2]}","%Y.%j").strftime("%Y-%m-%d")
-				else:
-					date = datetime.strptime(parts[1],"%Y-%m-%d").strftime("%Y-%m-%d") # check for correct formatting
-			except:
-				log.error(f"Date format in {f} not recognized.")
+		for record in catalog.records(directory): # names are parsed once, and kept in the archive catalog
+			if record.date is None:
+				log.error(f"Date format in {record.path} not recognized.")
 				continue
-			dir_products.append(product)
-			dir_dates.append(date)
+			dir_products.append(record.product)
+			dir_dates.append(record.date)
 		# check that there's exactly one product in the directory
 		dir_products = set(dir_products)
 		if len(dir_products) == 0:
@@ -1975,7 +1463,7 @@ class Image:
 	-------
 	getStatus() -> dict
 		Returns dictionary of product status: {'downloade':bool,'processed':bool,'statGen':bool}
-	setStatus(stage,status) -> None
+	setStatus(stage,status,{buffer}) -> None
 		Writes new status of image to database
 	isProcessed() -> bool
 		Returns whether the file has been uploaded to the database and S3 bucket, according to the product_status table
@@ -1989,24 +1477,15 @@ class Image:
 		Calculates and uploads all statistics for the given data file to the database
 	"""
 
-	# mysql credentials
-	noCred = None
-	try:
-		mysql_user = os.environ['glam_mysql_user']
-		mysql_pass = os.environ['glam_mysql_pass']
-		mysql_db = 'modis_dev'
-
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
-		Session = sessionmaker(bind=engine)
-		metadata = db.MetaData()
-		masks = db.Table('masks', metadata, autoload=True, autoload_with=engine)
-		regions = db.Table('regions', metadata, autoload=True, autoload_with=engine)
-		products = db.Table('products', metadata, autoload=True, autoload_with=engine)
-		stats = db.Table('stats', metadata, autoload=True, autoload_with=engine)
-		product_status = db.Table('product_status',metadata,autoload=True,autoload_with=engine)
-	except KeyError:
-		log.warning("Database credentials not found. Image objects cannot be instantialized. Use 'glamconfigure' on command line to set archive credentials.")
-		noCred = True
+	# shared database connection; engine is created and tables reflected on first use
+	noCred = CredentialsMissing()
+	engine = LazyEngine()
+	metadata = LazyMetadata()
+	masks = LazyTable('masks')
+	regions = LazyTable('regions')
+	products = LazyTable('products')
+	stats = LazyTable('stats')
+	product_status = LazyTable('product_status')
 
 
 	def __init__(self,file_path:str,virtual=False):
@@ -2082,14 +1561,29 @@ class Image:
 			return(self.getStatus())
 		return o
 
-	def setStatus(self, stage:str, status:bool) -> None:
+	def setStatus(self, stage:str, status:bool, buffer:StatusBuffer = None) -> None:
+		"""
+		Sets one status flag in the product_status table, and updates
+		'completed' for this product and date only
+
+		...
+
+		Parameters
+		----------
+		stage:str
+			One of 'downloaded', 'processed', or 'statGen'
+		status:bool
+			New value of the flag
+		buffer:StatusBuffer
+			Default None; if set, the change is queued in the buffer and
+			written when the buffer is flushed, rather than immediately
+		"""
 		assert stage in ['downloaded','processed','statGen']
-		#cmd = db.update(self.product_status).where(self.product_status.c.product==self.product).where(self.product_status.c.date==self.date).values(stage=status)
-		cmd = f"UPDATE product_status SET {stage} = {status} WHERE product = '{self.product}' AND date = '{self.date}';"
+		if buffer is not None:
+			buffer.set(self.product,self.date,stage,status)
+			return None
 		with self.engine.begin() as connection:
-			connection.execute(cmd)
-			connection.execute("UPDATE product_status SET completed = 1 WHERE processed = 1 AND statGen = 1;")
-			connection.execute("UPDATE product_status SET completed = 0 WHERE processed = 0 OR statGen = 0;")
+			connection.execute(db.text(statusUpdateSql([stage])),{stage:bool(status),"product":self.product,"date":self.date})
 
 	def isProcessed(self) -> bool:
 		"""Returns whether the file has been uploaded to the database and S3 bucket, according to the product_status table"""
@@ -2176,7 +1670,7 @@ class Image:
 			k = bucket.split("/")[1]+"/"+os.path.basename(upload_file)
 			try:
 				response = s3_client.upload_file(Filename=upload_file,Bucket=b,Key=k)
-			except ClientError as e:
+			except botoExceptions.ClientError as e:
 				log.exception(f"Failed to upload {upload_file} to s3 bucket")
 				return False
 			return True
@@ -2184,7 +1678,7 @@ class Image:
 
 		## on success, update database to match
 		if u and (self.type == 'image'):
-			updateSql = f"UPDATE product_status SET processed = True WHERE product = '{self.product}' AND date = '{self.date}';"
+			updateSql = f"UPDATE product_status SET processed = True, {completedSql({'processed':'1'})} WHERE product = '{self.product}' AND date = '{self.date}';"
 			with self.engine.begin() as connection:
 				try:
 					x = connection.execute(updateSql)
@@ -2365,7 +1859,7 @@ class Image:
 					return False
 
 			def getValidWindow(dataset,bandhandle,nodata_value) -> "Tuple of (xmin,ymin,xmax,ymax)":
-				arr = BandReadAsArray(bandhandle)
+				arr = gdalnumeric.BandReadAsArray(bandhandle)
 				rows = np.any(arr, axis=1)
 				cols = np.any(arr, axis=0)
 				ymin, ymax = np.where(rows)[0][[0, -1]]
@@ -2662,7 +2156,7 @@ class Image:
 		## update product_status if all stats uploaded
 		if admin_level == "ALL" and crop_level == "ALL":
 			with self.engine.begin() as connection:
-				updateSql = f"UPDATE product_status SET statGen = True WHERE product = '{self.product}' AND date = '{self.date}';"
+				updateSql = f"UPDATE product_status SET statGen = True, {completedSql({'statGen':'1'})} WHERE product = '{self.product}' AND date = '{self.date}';"
 				x = connection.execute(updateSql)
 				if x.rowcount == 0:
 					connection.execute(f"INSERT INTO product_status (product, date, downloaded, processed, completed, statGen) VALUES ('{self.product}','{self.date}',True,False,False,True);")
@@ -2698,20 +2192,11 @@ class Mask:
 	ingest() -> bool
 		Uploads the file at self.path to the aws s3 bucket, and inserts the corresponding base file name into the database
 	"""
-	# mysql credentials
-	noCred = None
-	try:
-		mysql_user = os.environ['glam_mysql_user']
-		mysql_pass = os.environ['glam_mysql_pass']
-		mysql_db = 'modis_dev'
-
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
-		Session = sessionmaker(bind=engine)
-		metadata = db.MetaData()
-		masks = db.Table('masks', metadata, autoload=True, autoload_with=engine)
-	except KeyError:
-		log.warning("Database credentials not found. Image objects cannot be instantialized. Use 'glamconfigure' on command line to set archive credentials.")
-		noCred = True
+	# shared database connection; engine is created and tables reflected on first use
+	noCred = CredentialsMissing()
+	engine = LazyEngine()
+	metadata = LazyMetadata()
+	masks = LazyTable('masks')
 
 
 	def __init__(self,file_path:str):
@@ -2789,7 +2274,7 @@ class Mask:
 			k = bucket.split("/")[1]+"/"+os.path.basename(upload_file)
 			try:
 				response = s3_client.upload_file(Filename=upload_file,Bucket=b,Key=k)
-			except ClientError as e:
+			except botoExceptions.ClientError as e:
 				log.exception(f"Failed to upload {upload_file} to s3 bucket")
 				return False
 			return True
@@ -2827,20 +2312,11 @@ class Region:
 	ingest() -> bool
 		Uploads the file at self.path to the aws s3 bucket, and inserts the corresponding base file name into the database
 	"""
-	# mysql credentials
-	noCred = None
-	try:
-		mysql_user = os.environ['glam_mysql_user']
-		mysql_pass = os.environ['glam_mysql_pass']
-		mysql_db = 'modis_dev'
-
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
-		Session = sessionmaker(bind=engine)
-		metadata = db.MetaData()
-		masks = db.Table('masks', metadata, autoload=True, autoload_with=engine)
-	except KeyError:
-		log.warning("Database credentials not found. Image objects cannot be instantialized. Use 'glamconfigure' on command line to set archive credentials.")
-		noCred = True
+	# shared database connection; engine is created and tables reflected on first use
+	noCred = CredentialsMissing()
+	engine = LazyEngine()
+	metadata = LazyMetadata()
+	masks = LazyTable('masks')
 
 
 	def __init__(self,file_path:str):
@@ -2918,7 +2394,7 @@ class Region:
 			k = bucket.split("/")[1]+"/"+os.path.basename(upload_file)
 			try:
 				response = s3_client.upload_file(Filename=upload_file,Bucket=b,Key=k)
-			except ClientError as e:
+			except botoExceptions.ClientError as e:
 				log.exception(f"Failed to upload {upload_file} to s3 bucket")
 				return False
 			return True
@@ -2972,7 +2448,7 @@ class AncillaryImage(Image):
 	-------
 	getStatus() -> dict
 		Returns dictionary of product status: {'downloade':bool,'processed':bool,'statGen':bool}
-	setStatus(stage,status) -> None
+	setStatus(stage,status,{buffer}) -> None
 		Writes new status of image to database
 	isProcessed() -> bool
 		Returns whether the file has b
@@ -3036,7 +2512,7 @@ class ModisImage(Image):
 	-------
 	getStatus() -> dict
 		Returns dictionary of product status: {'downloade':bool,'processed':bool,'statGen':bool}
-	setStatus(stage,status) -> None
+	setStatus(stage,status,{buffer}) -> None
 		Writes new status of image to database
 	isProcessed() -> bool
 		Returns whether the file has been uploaded to the database and S3 bucket, according to the product_status table
@@ -3149,7 +2625,7 @@ class ModisImage(Image):
 			k = bucket.split("/")[1]+"/"+os.path.basename(upload_file)
 			try:
 				response = s3_client.upload_file(Filename=upload_file,Bucket=b,Key=k)
-			except ClientError as e:
+			except botoExceptions.ClientError as e:
 				log.exception(f"Failed to upload {upload_file} to s3 bucket")
 				return False
 			return True
@@ -3157,7 +2633,7 @@ class ModisImage(Image):
 
 		## on success, update database to match
 		if u and (self.type == 'image'):
-			updateSql = f"UPDATE product_status SET processed = True WHERE product = '{self.product}' AND date = '{self.date}';"
+			updateSql = f"UPDATE product_status SET processed = True, {completedSql({'processed':'1'})} WHERE product = '{self.product}' AND date = '{self.date}';"
 			with self.engine.begin() as connection:
 				try:
 					x = connection.execute(updateSql)
@@ -3455,7 +2931,7 @@ class ModisImage(Image):
 		## update product_status if all stats uploaded
 		if admin_level == "ALL" and crop_level == "ALL":
 			with self.engine.begin() as connection:
-				updateSql = f"UPDATE product_status SET statGen = True WHERE product = '{self.product}' AND date = '{self.date}';"
+				updateSql = f"UPDATE product_status SET statGen = True, {completedSql({'statGen':'1'})} WHERE product = '{self.product}' AND date = '{self.date}';"
 				x = connection.execute(updateSql)
 				if x.rowcount == 0:
 					connection.execute(f"INSERT INTO product_status (product, date, downloaded, processed, completed, statGen) VALUES ('{self.product}','{self.date}',True,False,False,True);")
@@ -3590,6 +3066,7 @@ def purge(product, date, auth_key, non_prelim = False) -> bool:
 		log.error(f"Set 'non_prelim' to 'True' to delete non-preliminary product {product}")
 
 	# mysql credentials
+	loadCredentials()
 	try:
 		mysql_user = os.environ['glam_mysql_user']
 		mysql_pass = os.environ['glam_mysql_pass']
@@ -3599,7 +3076,7 @@ def purge(product, date, auth_key, non_prelim = False) -> bool:
 
 	else:
 		# setup
-		engine = db.create_engine(f'mysql+pymysql://{mysql_user}:{mysql_pass}@{endpoint}/{mysql_db}')
+		engine = getEngine()
 
 		# pull file to disk to get information
 		downloader = Downloader()
@@ -3678,6 +3155,7 @@ def updateGlamData():
 	downloader = Downloader() # downloader object
 	missingFiles = ToDoList() # collect missing dates for each file type
 	missingFiles.filterUnavailable() # pare down to only available files
+	statusBuffer = StatusBuffer() # status changes are written once per file
 	## iterate over ToDoList object
 	for f in missingFiles:
 		#product = f[0]
@@ -3700,15 +3178,15 @@ def updateGlamData():
 				#if image.product == 'chirps':
 				#	log.debug("-purging corresponding chirps-prelim product")
 				#	purge('chirps-prelim',image.date,None)
-				image.setStatus('downloaded',True)
+				image.setStatus('downloaded',True,buffer=statusBuffer)
 				log.debug(f"-collection: {image.collection}")
 				ingest = image.ingest()
 				if ingest:
-					image.setStatus('processed',True)
+					image.setStatus('processed',True,buffer=statusBuffer)
 					log.debug("--ingested")
 				stats = image.uploadStats()
 				if stats:
-					image.setStatus('statGen',True)
+					image.setStatus('statGen',True,buffer=statusBuffer)
 					log.debug("--stats generated")
 				#os.remove(p) # once we fully move to aws, we'll download 1 file at a time and remove them when no longer needed
 				#log.debug("--file removed")
@@ -3718,6 +3196,8 @@ def updateGlamData():
 		except:
 			log.error("FAILED")
 			continue
+		finally:
+			statusBuffer.flush()
 
 # main function
 def main():
@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+
+"""
+This module keeps an index of the files listed in source archive directories
+
+Checking whether a MERRA-2 or CHIRPS file exists used to mean fetching
+the archive's directory page again for every date, and for MERRA-2 five
+times per date. Here each directory page is fetched once, parsed into a
+map of date to file name, and kept both in memory and in a small SQLite
+cache on disk. Results of octvi.url.getDates() are cached the same way.
+Cached entries are reused until they are older than the time-to-live.
+A page that cannot be fetched, after retries, counts as empty for this
+call only; it is not cached.
+
+The cache can be configured with the following environment variables:
+
+	GLAM_LISTING_CACHE   path to SQLite cache file (default
+	                     'glam_listings.sqlite', next to 'glam_keys.json';
+	                     set to an empty string to keep the index in memory only)
+	GLAM_LISTING_TTL     seconds before a listing is fetched again (default 3600)
+
+***
+
+Functions
+---------
+getListing
+merra2Listing
+merra2Url
+chirpsUrl
+octviDates
+clearListings
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import json, re, sqlite3, threading, time
+from datetime import datetime
+
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.availability import getSession, withRetries
+from glam_data_processing.exceptions import BadInputError
+
+octvi = lazyImport("octvi")
+requests = lazyImport("requests")
+
+## settings
+
+CACHE_PATH = os.environ.get("GLAM_LISTING_CACHE",os.path.join(os.path.dirname(os.path.dirname(__file__)),"glam_listings.sqlite"))
+TTL = float(os.environ.get("GLAM_LISTING_TTL",3600))
+
+## source archives
+
+MERRA2_DIR = "https://goldsmr4.gesdisc.eosdis.nasa.gov/data/MERRA2/M2SDNXSLV.5.12.4/{year}/{month}/"
+MERRA2_PATTERN = r'(MERRA2[^\s"\'<>/]*?\.(\d{4})(\d{2})(\d{2})\.nc4)'
+
+# chirps files are numbered by dekad (1, 2, or 3) rather than day of month
+CHIRPS_DIRS = {
+	"chirps":"https://data.chc.ucsb.edu/products/CHIRPS-2.0/global_dekad/tifs/",
+	"chirps-prelim":"https://data.chc.ucsb.edu/products/CHIRPS-2.0/prelim/global_dekad/tifs/"
+	}
+CHIRPS_PATTERNS = {
+	"chirps":r'(chirps-v2\.0\.(\d{4})\.(\d{2})\.([123])\.tif\.gz)',
+	"chirps-prelim":r'(chirps-v2\.0\.(\d{4})\.(\d{2})\.([123])\.tif)(?!\.)'
+	}
+
+## module state
+
+_memory = {} # key: (fetch time, entries)
+_keyLocks = {}
+_lock = threading.Lock()
+
+
+def _keyLock(key:str) -> threading.Lock:
+	"""Returns a lock held while one key is being fetched, so it is only fetched once"""
+	with _lock:
+		return _keyLocks.setdefault(key,threading.Lock())
+
+
+def _readCache(key:str):
+	"""Returns (fetch time, entries) for key from the disk cache, or None"""
+	if not CACHE_PATH:
+		return None
+	try:
+		with sqlite3.connect(CACHE_PATH) as con:
+			row = con.execute("SELECT fetched, entries FROM listings WHERE key = ?;",(key,)).fetchone()
+	except sqlite3.Error:
+		return None
+	if row is None:
+		return None
+	return row[0], json.loads(row[1])
+
+
+def _writeCache(key:str, fetched:float, entries) -> None:
+	"""Stores entries for key in the disk cache"""
+	if not CACHE_PATH:
+		return None
+	try:
+		with sqlite3.connect(CACHE_PATH) as con:
+			con.execute("CREATE TABLE IF NOT EXISTS listings (key TEXT PRIMARY KEY, fetched REAL, entries TEXT);")
+			con.execute("INSERT OR REPLACE INTO listings (key, fetched, entries) VALUES (?, ?, ?);",(key,fetched,json.dumps(entries,default=str)))
+	except sqlite3.Error:
+		log.warning(f"Failed to write listing cache at {CACHE_PATH}; keeping index in memory only")
+
+
+def _cached(key:str, fetch, ttl:float = None):
+	"""Returns the cached value for key, calling fetch() to refresh it if missing or stale"""
+	ttl = TTL if ttl is None else ttl
+	now = time.time()
+	with _keyLock(key):
+		hit = _memory.get(key) or _readCache(key)
+		if (hit is not None) and (now - hit[0] < ttl):
+			_memory[key] = hit
+			return hit[1]
+		log.debug(f"Fetching listing: {key}")
+		entries = fetch()
+		_memory[key] = (now,entries)
+		_writeCache(key,now,entries)
+		return entries
+
+
+def getListing(url:str, pattern:str, ttl:float = None) -> dict:
+	"""Returns {date: file name} for the files listed on a directory page
+
+	A page that does not exist (404) gives an empty listing. Network and
+	server errors are retried as in availability.withRetries(); if they
+	persist, or the server refuses the request, a warning is logged and
+	an empty listing is returned, but not cached.
+
+	***
+
+	Parameters
+	----------
+	url:str
+		URL of directory page
+	pattern:str
+		Regular expression matching one file name. Group 1 must be the
+		whole file name, and groups 2-4 the year, month, and day; a day
+		of 1, 2, or 3 is read as a chirps dekad
+	ttl:float
+		Default None; maximum age in seconds of a cached listing. If not
+		set, uses GLAM_LISTING_TTL
+	"""
+	def fetchPage():
+		r = getSession(url).get(url,timeout=60)
+		if r.status_code != 404:
+			r.raise_for_status()
+		return r
+	def fetch() -> dict:
+		r = withRetries(fetchPage)
+		if r.status_code == 404:
+			return {}
+		entries = {}
+		for name, year, month, day in re.findall(pattern,r.text):
+			if len(day) == 1: # dekad
+				day = {"1":"01","2":"11","3":"21"}[day]
+			entries[f"{year}-{month}-{day}"] = name
+		return entries
+	try:
+		return _cached(url,fetch,ttl)
+	except requests.exceptions.RequestException as e:
+		log.warning(f"Failed to fetch listing {url}; treating it as empty: {e}")
+		return {}
+
+
+def merra2Listing(date:str) -> dict:
+	"""Returns {date: file name} for the month of the MERRA-2 archive that includes date ("%Y-%m-%d")"""
+	dateObj = datetime.strptime(date,"%Y-%m-%d")
+	return getListing(MERRA2_DIR.format(year=dateObj.strftime("%Y"),month=dateObj.strftime("%m")),MERRA2_PATTERN)
+
+
+def merra2Url(date:str) -> str:
+	"""Returns the URL of the daily MERRA-2 file for date ("%Y-%m-%d"), or None if it is not listed"""
+	name = merra2Listing(date).get(date)
+	if name is None:
+		return None
+	dateObj = datetime.strptime(date,"%Y-%m-%d")
+	return MERRA2_DIR.format(year=dateObj.strftime("%Y"),month=dateObj.strftime("%m")) + name
+
+
+def chirpsUrl(product:str, date:str) -> str:
+	"""Returns the URL of the chirps or chirps-prelim file for the dekad that includes date ("%Y-%m-%d"), or None if it is not listed"""
+	try:
+		directory = CHIRPS_DIRS[product]
+	except KeyError:
+		raise BadInputError(f"Product '{product}' not recognized. Expected one of: {', '.join(CHIRPS_DIRS.keys())}")
+	dateObj = datetime.strptime(date,"%Y-%m-%d")
+	dekadStart = dateObj.strftime("%Y-%m-") + ("01" if dateObj.day <= 10 else "11" if dateObj.day <= 20 else "21")
+	name = getListing(directory,CHIRPS_PATTERNS[product]).get(dekadStart)
+	if name is None:
+		return None
+	return directory + name
+
+
+def octviDates(product:str, date:str) -> list:
+	"""Returns the cached result of octvi.url.getDates(product, date)"""
+	return _cached(f"octvi:{product}:{date}",lambda: list(octvi.url.getDates(product,date)))
+
+
+def clearListings() -> None:
+	"""Forgets all cached listings, in memory and on disk"""
+	with _lock:
+		_memory.clear()
+	if CACHE_PATH and os.path.exists(CACHE_PATH):
+		try:
+			with sqlite3.connect(CACHE_PATH) as con:
+				con.execute("DELETE FROM listings;")
+		except sqlite3.Error:
+			pass
@@ -0,0 +1,446 @@
+#! /usr/bin/env python
+
+"""
+This module downloads the daily MERRA-2 files that make up a GLAM composite
+
+Each GLAM merra-2 image summarizes the target date and the four days
+before it. The five daily NetCDF files are downloaded concurrently over a
+single authenticated session, with a limit on the number of simultaneous
+streams. Each file's size is checked against the server's Content-Length
+while it streams, dropped connections are resumed (see fetch.py), and a
+file that still fails stops the remaining downloads. Files
+are handed to the caller for extraction as soon as each one arrives.
+
+Since consecutive composites share four of their five days, the
+extracted T2MMIN, T2MMAX, and T2MMEAN arrays for each day are kept in a
+size-capped local cache, and only days missing from the cache are
+downloaded. When the cache is full, the days used least recently are
+removed first.
+
+Subdatasets are read straight into numpy, and the composite minimum,
+maximum, and mean are kept as running accumulators that each day is
+folded into as it arrives, so only one day is held in memory at a time
+however long the window.
+
+Defaults can be changed with the following environment variables:
+
+	GLAM_MERRA2_STREAMS    simultaneous downloads (default 3)
+	GLAM_MERRA2_CACHE      directory of cached days (default 'merra2_cache',
+	                       next to 'glam_keys.json'; set to an empty string
+	                       to turn the cache off)
+	GLAM_MERRA2_CACHE_MB   maximum size of the cache in megabytes (default 64)
+
+***
+
+Classes
+-------
+DayCache
+Composite
+
+Functions
+---------
+compositeDates
+openSession
+downloadDay
+downloadDays
+readDay
+compositeDays
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import glob, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from glam_data_processing import fetch
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.exceptions import BadInputError, UnavailableError
+from glam_data_processing.listings import merra2Url
+
+gdal = lazyImport("gdal", on_load=lambda m: m.UseExceptions())
+gdalnumeric = lazyImport("gdalnumeric")
+np = lazyImport("numpy")
+requests = lazyImport("requests")
+
+COMPOSITE_DAYS = 5 # the requested date along with 4 previous days
+STREAMS = int(os.environ.get("GLAM_MERRA2_STREAMS",3))
+
+CACHE_DIR = os.environ.get("GLAM_MERRA2_CACHE",os.path.join(os.path.dirname(os.path.dirname(__file__)),"merra2_cache"))
+CACHE_MB = float(os.environ.get("GLAM_MERRA2_CACHE_MB",64))
+
+# position of each variable in the daily file's list of subdatasets
+SUBDATASETS = {
+	"min":3, # T2MMIN
+	"max":1, # T2MMAX
+	"mean":2 # T2MMEAN
+	}
+
+
+def compositeDates(date:str) -> list:
+	"""Returns the string dates ("%Y-%m-%d") that make up the composite for date, latest first"""
+	dateObj = datetime.strptime(date,"%Y-%m-%d")
+	return [(dateObj - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(COMPOSITE_DAYS)]
+
+
+def openSession(auth:tuple, streams:int = None) -> "requests.Session":
+	"""Returns a new session for the MERRA-2 archive, with room in its pool for each stream
+
+	***
+
+	Parameters
+	----------
+	auth:tuple
+		(username, password) for the MERRA-2 archive
+	streams:int
+		Default None; number of simultaneous downloads. If not set, uses
+		GLAM_MERRA2_STREAMS
+	"""
+	streams = streams or STREAMS
+	session = requests.Session()
+	session.auth = auth
+	adapter = requests.adapters.HTTPAdapter(pool_connections=2,pool_maxsize=streams)
+	session.mount("https://",adapter)
+	return session
+
+
+def downloadDay(session:"requests.Session", url:str, out_path:str, cancelled:threading.Event = None) -> str:
+	"""Downloads one daily file to out_path, checking its size as it streams
+
+	Dropped connections are resumed; see fetch.download(). Raises
+	UnavailableError if the server does not return the file, if the size
+	does not match the Content-Length header, or if cancelled is set
+	before the download finishes. No partial file is left at out_path.
+
+	***
+
+	Parameters
+	----------
+	session:requests.Session
+		Authenticated session; see openSession()
+	url:str
+		URL of daily .nc4 file
+	out_path:str
+		Path to output file on disk
+	cancelled:threading.Event
+		Default None; if set while streaming, the download stops early
+	"""
+	return fetch.download(url,out_path,session=session,cancelled=cancelled).path
+
+
+def downloadDays(urls:dict, out_dir:str, auth:tuple, extract, streams:int = None) -> None:
+	"""Downloads daily files concurrently, calling extract(date, path) as each one arrives
+
+	Extraction runs in the calling thread while the remaining files are
+	still downloading. Each daily file is deleted once it has been
+	extracted. If any download or extraction fails, the remaining
+	downloads are stopped, all daily files are removed, and the error is
+	raised.
+
+	***
+
+	Parameters
+	----------
+	urls:dict
+		{date: url} of daily files to download
+	out_dir:str
+		Directory in which to store daily files while they are extracted
+	auth:tuple
+		(username, password) for the MERRA-2 archive
+	extract:function
+		Called with a string date and the path to that date's file
+	streams:int
+		Default None; number of simultaneous downloads. If not set, uses
+		GLAM_MERRA2_STREAMS
+	"""
+	streams = streams or STREAMS
+	cancelled = threading.Event()
+	paths = {d:os.path.join(out_dir,f"merra-2.{d.replace('-','')}.NETCDF.TEMP.nc") for d in urls.keys()}
+	try:
+		with openSession(auth,streams) as session, ThreadPoolExecutor(max_workers=streams) as executor:
+			futures = {executor.submit(downloadDay,session,url,paths[d],cancelled):d for d, url in urls.items()}
+			try:
+				for future in as_completed(futures):
+					d = futures[future]
+					extract(d,future.result())
+					os.remove(paths[d])
+			except BaseException:
+				cancelled.set()
+				for future in futures:
+					future.cancel()
+				raise
+	finally:
+		for path in paths.values():
+			if os.path.exists(path):
+				os.remove(path)
+
+
+def readDay(path:str) -> dict:
+	"""Returns {metric: array} of the T2MMIN, T2MMAX, and T2MMEAN subdatasets of a daily file
+
+	***
+
+	Parameters
+	----------
+	path:str
+		Path to daily .nc4 file
+	"""
+	dataset = gdal.Open(path,0)
+	subdatasets = dataset.GetSubDatasets()
+	del dataset
+	arrays = {}
+	for metric, index in SUBDATASETS.items():
+		sds = gdal.Open(subdatasets[index][0],0)
+		arrays[metric] = gdalnumeric.BandReadAsArray(sds.GetRasterBand(1))
+		del sds
+	return arrays
+
+
+class Composite:
+	"""
+	Running minimum, maximum, and mean of a series of daily arrays
+
+	Each day is folded into one accumulator per metric when it is added,
+	so memory use does not grow with the number of days. Minimum and
+	maximum match reducing a stack of all the days with np.amin and
+	np.amax exactly; the mean is summed at double precision, so it
+	matches np.mean to within float32 rounding.
+
+	...
+
+	Methods
+	-------
+	add(arrays:dict) -> None:
+		folds one day's {metric: array} into the accumulators
+	result(metric:str) -> numpy.ndarray:
+		returns the composite of all days added so far for metric
+	"""
+
+	def __init__(self, metrics = ("min","max","mean")):
+		for metric in metrics:
+			if metric not in SUBDATASETS:
+				raise BadInputError(f"Metric '{metric}' not recognized. Expected one of: {', '.join(SUBDATASETS.keys())}")
+		self.metrics = tuple(metrics)
+		self.count = 0
+		self._acc = {}
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f"<Instance of Composite, metrics:{', '.join(self.metrics)}, {self.count} days>"
+
+	def add(self, arrays:dict) -> None:
+		with self._lock:
+			for metric in self.metrics:
+				a = arrays[metric]
+				acc = self._acc.get(metric)
+				if acc is None:
+					self._acc[metric] = a.astype(np.float64 if metric == "mean" else a.dtype,copy=True)
+				elif metric == "min":
+					np.minimum(acc,a,out=acc)
+				elif metric == "max":
+					np.maximum(acc,a,out=acc)
+				else:
+					np.add(acc,a,out=acc)
+			self.count += 1
+
+	def result(self, metric:str) -> "numpy.ndarray":
+		if self.count == 0:
+			raise BadInputError("No days have been added to composite")
+		acc = self._acc[metric]
+		if metric == "mean":
+			return (acc / self.count).astype(np.float32)
+		return acc
+
+
+class DayCache:
+	"""
+	A size-capped store of extracted daily MERRA-2 arrays, keyed by date
+
+	Each day is one uncompressed .npz file holding a 'min', 'max', and
+	'mean' array, along with the name of the source file they were read
+	from. A day is only returned if it came from the source file asked
+	for, so a day the archive has reprocessed (MERRA2_400 becoming
+	MERRA2_401, say) is downloaded again. Reading a day marks it as
+	recently used; writing one
+	removes the least recently used days until the cache fits in its
+	size cap. Files are written under a temporary name and renamed into
+	place, so processes sharing a cache never read a partial file.
+
+	...
+
+	Methods
+	-------
+	get(date:str,source:str=None) -> dict:
+		returns {metric: array} for date, or None if not cached or, when
+		source is given, cached from a different source file
+	put(date:str,arrays:dict,source:str=None) -> None:
+		stores arrays for date, read from the source file named, and
+		evicts old days as needed
+	evict() -> int:
+		removes least recently used days until under the size cap;
+		returns number of days removed
+	clear() -> None:
+		removes all cached days
+	"""
+
+	def __init__(self, directory:str = None, max_mb:float = None):
+		self.directory = CACHE_DIR if directory is None else directory
+		self.max_bytes = (CACHE_MB if max_mb is None else max_mb) * 1024 * 1024
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f"<Instance of DayCache, directory:{self.directory}, {len(self)} days>"
+
+	def __len__(self):
+		return len(self._files())
+
+	def __contains__(self, date:str):
+		return bool(self.directory) and os.path.exists(self._path(date))
+
+	def _path(self, date:str) -> str:
+		return os.path.join(self.directory,f"merra-2.{date.replace('-','')}.npz")
+
+	def _files(self) -> list:
+		if not self.directory:
+			return []
+		return glob.glob(os.path.join(self.directory,"merra-2.*.npz"))
+
+	def get(self, date:str, source:str = None) -> dict:
+		if not self.directory:
+			return None
+		path = self._path(date)
+		try:
+			with np.load(path) as f:
+				arrays = {metric:f[metric] for metric in SUBDATASETS.keys()}
+				cachedSource = f["source"].item() if "source" in f.files else None
+		except FileNotFoundError:
+			return None
+		except Exception as e: # damaged file; drop it and download again
+			log.warning(f"Discarding unreadable MERRA-2 cache file {path}: {e}")
+			self._remove(path)
+			return None
+		if (source is not None) and (cachedSource != source): # reprocessed since it was cached
+			log.info(f"Discarding MERRA-2 cache file {path} from {cachedSource}; the archive now has {source}")
+			self._remove(path)
+			return None
+		try:
+			os.utime(path) # mark as recently used
+		except FileNotFoundError:
+			pass
+		return arrays
+
+	def _remove(self, path:str) -> None:
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+	def put(self, date:str, arrays:dict, source:str = None) -> None:
+		if not self.directory:
+			return None
+		os.makedirs(self.directory,exist_ok=True)
+		path = self._path(date)
+		tempPath = f"{path}.{os.getpid()}.{threading.get_ident()}.TEMP"
+		entry = {metric:arrays[metric] for metric in SUBDATASETS.keys()}
+		if source is not None:
+			entry["source"] = np.array(source)
+		try:
+			with open(tempPath,"wb") as f:
+				np.savez(f,**entry)
+			os.replace(tempPath,path)
+		except OSError as e:
+			log.warning(f"Failed to write MERRA-2 cache file {path}: {e}")
+			if os.path.exists(tempPath):
+				os.remove(tempPath)
+			return None
+		self.evict()
+
+	def evict(self) -> int:
+		with self._lock:
+			files = []
+			for path in self._files():
+				try:
+					st = os.stat(path)
+				except FileNotFoundError:
+					continue
+				files.append((st.st_mtime,st.st_size,path))
+			files.sort(reverse=True) # most recently used first
+			total = 0
+			removed = 0
+			for mtime, size, path in files:
+				total += size
+				if total > self.max_bytes:
+					try:
+						os.remove(path)
+						removed += 1
+					except FileNotFoundError:
+						pass
+			if removed:
+				log.debug(f"Evicted {removed} days from MERRA-2 cache")
+			return removed
+
+	def clear(self) -> None:
+		for path in self._files():
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+
+
+def compositeDays(dates:list, out_dir:str, auth:tuple, metrics = ("min","max","mean"), cache:DayCache = None, streams:int = None) -> Composite:
+	"""Returns a Composite of the given days, downloading only the days that are not cached
+
+	Cached days are read and folded in one at a time; the rest are folded
+	in as each download finishes. Raises UnavailableError if any day
+	missing from the cache is not listed in the archive or fails to
+	download.
+
+	***
+
+	Parameters
+	----------
+	dates:list
+		String dates ("%Y-%m-%d"); e.g. compositeDates(date)
+	out_dir:str
+		Directory in which to store daily files while they are extracted
+	auth:tuple
+		(username, password) for the MERRA-2 archive
+	metrics:tuple
+		Any of "min", "max", and "mean"
+	cache:DayCache
+		Default None; if not set, uses a DayCache with default settings
+	streams:int
+		See downloadDays()
+	"""
+	cache = DayCache() if cache is None else cache
+	composite = Composite(metrics)
+
+	# look up every day before reading any, so an incomplete window fails fast;
+	# the file name listed now tells whether a cached day is still current
+	sources = {}
+	for d in dates:
+		url = merra2Url(d) # looked up in the directory listing
+		if url is None:
+			raise UnavailableError(f"No Merra-2 file exists for {d}")
+		sources[d] = url
+
+	urls = {}
+	for d in dates:
+		arrays = cache.get(d,os.path.basename(sources[d]))
+		if arrays is None: # not cached, evicted, or reprocessed since
+			urls[d] = sources[d]
+			continue
+		composite.add(arrays)
+	log.debug(f"Merra-2 days cached: {composite.count}; to download: {list(urls.keys())}")
+
+	def extract(d:str, path:str) -> None:
+		arrays = readDay(path)
+		cache.put(d,arrays,os.path.basename(urls[d]))
+		composite.add(arrays)
+
+	if urls:
+		downloadDays(urls,out_dir,auth,extract,streams)
+	return composite
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+
+"""
+This module runs items through a series of stages, with the stages overlapping
+
+updateData used to take each file through download, ingest, statistics,
+and anomaly baselines before starting on the next, so the network sat
+idle while statistics ran and the CPU sat idle during downloads. Here
+each stage has its own worker threads, and items are passed from one
+stage to the next through bounded queues: while one file is in the
+statistics stage, the next can already be downloading. The queues keep
+only a few finished downloads waiting on disk at any time.
+
+A stage can also cap how many items sharing a key (e.g. a product) it
+works on at once, so that, for example, only one NDVI mosaic is built at
+a time however many download workers there are. Time spent on each item
+in each stage is logged, and totals are logged when the run finishes.
+
+***
+
+Classes
+-------
+Stage
+Pipeline
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import queue, threading, time
+
+_DONE = object() # marks the end of a queue
+
+
+class Stage:
+	"""
+	One step of a Pipeline
+
+	...
+
+	Attributes
+	----------
+	name:str
+		Name used in logs; e.g. "download"
+	func:function
+		Called with each item; returns the item to hand to the next stage,
+		or None to drop it. An exception drops the item and is passed to
+		the pipeline's on_error
+	workers:int
+		Number of threads working on this stage
+	key:function
+		Default None; called with an item to get the key that limits apply to
+	limits:dict
+		Default None; {key: maximum items with that key in this stage at once}
+	"""
+	def __init__(self, name:str, func, workers:int = 1, key = None, limits:dict = None):
+		self.name = name
+		self.func = func
+		self.workers = max(1,int(workers))
+		self.key = key
+		self.limits = limits or {}
+		self._semaphores = {k:threading.BoundedSemaphore(n) for k, n in self.limits.items()}
+
+	def __repr__(self):
+		return f"<Stage {self.name}, {self.workers} workers>"
+
+	def __call__(self, item):
+		semaphore = None
+		if self.key is not None:
+			semaphore = self._semaphores.get(self.key(item))
+		if semaphore is None:
+			return self.func(item)
+		with semaphore:
+			return self.func(item)
+
+
+class Pipeline:
+	"""
+	Runs items through Stages in order, with every stage working at once
+
+	...
+
+	Parameters
+	----------
+	stages:list
+		Stage objects, in the order items pass through them
+	queue_size:int
+		Default None; most items waiting between two stages. If not set,
+		uses the number of workers in the later stage
+	on_error:function
+		Default None; called as on_error(stage name, item, exception) when
+		a stage raises. If not set, the exception is logged
+	label:function
+		Default str; called with an item to name it in logs
+
+	Methods
+	-------
+	run(items) -> list:
+		Sends each item through every stage, and returns what comes out
+		of the last one, in the order it finished
+	"""
+	def __init__(self, stages:list, queue_size:int = None, on_error = None, label = str):
+		self.stages = stages
+		self.queue_size = queue_size
+		self.on_error = on_error
+		self.label = label
+		self.timings = {stage.name:[0,0.0] for stage in stages} # name: [items, seconds]
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f"<Pipeline of {', '.join(s.name for s in self.stages)}>"
+
+	def _error(self, stage:Stage, item, e:Exception) -> None:
+		if self.on_error is None:
+			log.exception(f"{stage.name} failed for {self.label(item)}")
+			return None
+		try:
+			self.on_error(stage.name,item,e)
+		except Exception:
+			log.exception(f"Error handler failed for {self.label(item)}")
+
+	def _work(self, stage:Stage, inbox:queue.Queue, outbox:queue.Queue, remaining:list, consumers:int) -> None:
+		"""Worker thread: takes items from inbox until it is done, and passes results on"""
+		while True:
+			item = inbox.get()
+			if item is _DONE:
+				break
+			start = time.time()
+			try:
+				result = stage(item)
+			except Exception as e:
+				result = None
+				self._error(stage,item,e)
+			elapsed = time.time() - start
+			with self._lock:
+				self.timings[stage.name][0] += 1
+				self.timings[stage.name][1] += elapsed
+			log.info(f"{stage.name} {self.label(item)}: {elapsed:.1f} s")
+			if result is not None:
+				outbox.put(result)
+		# the last worker of a stage to finish tells the next stage's workers
+		with self._lock:
+			remaining[0] -= 1
+			last = remaining[0] == 0
+		if last:
+			for i in range(consumers):
+				outbox.put(_DONE)
+
+	def run(self, items) -> list:
+		"""Sends each item through every stage; returns the items that came out of the last stage
+
+		***
+
+		Parameters
+		----------
+		items:iterable
+			Items to process; read lazily, as the first stage has room
+		"""
+		boxes = [queue.Queue(maxsize=(self.queue_size or stage.workers)) for stage in self.stages]
+		results = queue.Queue()
+		boxes.append(results)
+		consumers = [stage.workers for stage in self.stages[1:]] + [1]
+		threads = []
+		for i, stage in enumerate(self.stages):
+			remaining = [stage.workers]
+			for w in range(stage.workers):
+				t = threading.Thread(target=self._work,args=(stage,boxes[i],boxes[i+1],remaining,consumers[i]),name=f"{stage.name}-{w}",daemon=True)
+				t.start()
+				threads.append(t)
+		start = time.time()
+		try:
+			for item in items:
+				boxes[0].put(item)
+		finally:
+			for w in range(self.stages[0].workers):
+				boxes[0].put(_DONE)
+			for t in threads:
+				t.join()
+		out = []
+		while True:
+			item = results.get()
+			if item is _DONE:
+				break
+			out.append(item)
+		log.info(f"Pipeline finished in {time.time() - start:.1f} s")
+		for name, (n, seconds) in self.timings.items():
+			log.info(f"  {name}: {n} items, {seconds:.1f} s total, {seconds / max(n,1):.1f} s each")
+		return out
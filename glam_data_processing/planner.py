@@ -0,0 +1,207 @@
+#! /usr/bin/env python
+
+"""
+This module sizes windows and worker pools to fit a memory budget
+
+Windowed engines (anomaly baselines, zonal statistics) used to take a
+fixed window size: 256 pixels in add_file_to_anomaly_baseline.py, and
+the input's block size times a scale factor elsewhere. The memory a run
+needs grows with the window area, the bytes each pixel holds while it is
+worked on (ten or twenty years of a stack, its copies and outputs), and
+the number of workers, so the same settings could run out of memory on
+one job and leave most of the machine idle on another. Here each engine
+states how many bytes a pixel of a window costs, and planWindows()
+returns the largest window, and the most workers (up to what was asked
+for), whose peak memory stays under the budget:
+
+	workers * GLAM_WORKER_MB  +  2 * workers * window area * bytes per pixel
+
+Each worker holds one window while the parent holds up to one more per
+worker (results waiting to be written, or tasks queued ahead). Windows
+are whole multiples of the input's block size, so reads line up with
+blocks, and are kept small enough that every worker has several.
+
+The budget is the first of these that is set:
+
+	GLAM_MEMORY_MB        memory budget of a run, in MiB
+	cgroup memory limit   (of a container or batch job) times GLAM_MEMORY_FRACTION
+	physical memory       times GLAM_MEMORY_FRACTION
+
+Other defaults can be changed with the following environment variables:
+
+	GLAM_MEMORY_FRACTION  share of the memory limit a run may use (default 0.75)
+	GLAM_WORKER_MB        memory of a worker process before any window (default 200)
+	GLAM_MAX_BLOCK        largest window width and height, in pixels (default 1024)
+
+***
+
+Classes
+-------
+Plan
+
+Functions
+---------
+memoryLimit
+cpuLimit
+memoryBudget
+nativeBlock
+baselinePixelBytes
+planWindows
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+from collections import namedtuple
+
+from glam_data_processing._lazy import lazyImport
+
+np = lazyImport("numpy")
+
+## settings
+
+MEMORY_MB = os.environ.get("GLAM_MEMORY_MB")
+MEMORY_FRACTION = float(os.environ.get("GLAM_MEMORY_FRACTION",0.75))
+WORKER_MB = int(os.environ.get("GLAM_WORKER_MB",200))
+MAX_BLOCK = int(os.environ.get("GLAM_MAX_BLOCK",1024))
+
+Plan = namedtuple("Plan",["blocksize","workers","in_flight"])
+Plan.__doc__ = """Window width and height in pixels, number of worker processes, and most windows to have in flight at once"""
+
+
+def _readNumber(path:str) -> int:
+	"""Returns the first number in a cgroup file, or None if it is missing or unlimited ('max')"""
+	try:
+		with open(path) as f:
+			value = f.read().split()[0]
+	except (OSError, IndexError):
+		return None
+	return None if value == "max" else int(value)
+
+
+def memoryLimit() -> int:
+	"""Returns the memory available to this process in bytes: the cgroup limit if there is one, else physical memory"""
+	limits = []
+	for path in ("/sys/fs/cgroup/memory.max","/sys/fs/cgroup/memory/memory.limit_in_bytes"): # cgroup v2, v1
+		limit = _readNumber(path)
+		if limit is not None:
+			limits.append(limit)
+	try:
+		limits.append(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+	except (ValueError, OSError, AttributeError): # not available on this platform
+		pass
+	# an unlimited cgroup v1 reports a huge number, which physical memory undercuts
+	return min(limits) if limits else None
+
+
+def cpuLimit() -> int:
+	"""Returns the number of CPUs this process may use: its affinity, capped by any cgroup CPU quota"""
+	try:
+		cpus = len(os.sched_getaffinity(0))
+	except AttributeError: # not available on this platform
+		cpus = os.cpu_count() or 1
+	try:
+		with open("/sys/fs/cgroup/cpu.max") as f: # cgroup v2
+			quota, period = f.read().split()[:2]
+		quota = None if quota == "max" else int(quota)
+		period = int(period)
+	except (OSError, ValueError):
+		quota, period = _readNumber("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _readNumber("/sys/fs/cgroup/cpu/cpu.cfs_period_us") # cgroup v1
+	if quota and period and (quota > 0):
+		cpus = min(cpus,max(1,quota // period))
+	return cpus
+
+
+def memoryBudget(budget_mb:int = None) -> int:
+	"""Returns the memory budget of a run in bytes; see the module docstring for where it comes from
+
+	***
+
+	Parameters
+	----------
+	budget_mb:int
+		Default None; budget in MiB, overriding GLAM_MEMORY_MB and the
+		detected limit
+	"""
+	if budget_mb is None:
+		budget_mb = MEMORY_MB
+	if budget_mb is not None:
+		return int(float(budget_mb) * 2**20)
+	limit = memoryLimit()
+	if limit is None:
+		log.warning("Failed to find the memory limit; assuming 4 GiB")
+		limit = 4 * 2**30
+	return int(limit * MEMORY_FRACTION)
+
+
+def nativeBlock(profile:dict, default:int = 256) -> int:
+	"""Returns the block width of a tiled raster from its rasterio profile, or default if it is not tiled (striped blocks span the whole width)"""
+	if profile.get("tiled") and profile.get("blockxsize"):
+		return int(profile["blockxsize"])
+	return default
+
+
+def baselinePixelBytes(years:int, dtype:str, n_outputs:int) -> int:
+	"""Returns the peak bytes a pixel of a baseline window holds: its stack of years, the copies the kernels make, and its outputs"""
+	itemsize = np.dtype(dtype).itemsize
+	# stack, sentinel planes, and valid mask; sums, counts, and sorted planes; outputs
+	return years * (2 * itemsize + 1) + (years // 2 + 3) * max(itemsize,4) + n_outputs * itemsize
+
+
+def planWindows(width:int, height:int, pixel_bytes:int, n_workers:int, native_block:int = 256, blocksize:int = None, budget_mb:int = None) -> Plan:
+	"""Returns a Plan of window size and worker count whose peak memory fits the budget
+
+	Workers are never more than n_workers or the CPUs available. If even
+	one worker on one native block does not fit, that is returned
+	anyway, with a warning.
+
+	***
+
+	Parameters
+	----------
+	width:int
+		Raster width in pixels
+	height:int
+		Raster height in pixels
+	pixel_bytes:int
+		Peak bytes a worker holds per pixel of a window; e.g.
+		baselinePixelBytes()
+	n_workers:int
+		Most worker processes to use
+	native_block:int
+		Default 256; windows are whole multiples of this. See nativeBlock()
+	blocksize:int
+		Default None; if set, the window size is fixed at this, and only
+		the number of workers is fitted to the budget
+	budget_mb:int
+		Default None; memory budget in MiB. See memoryBudget()
+	"""
+	budget = memoryBudget(budget_mb)
+	native_block = max(1,int(native_block))
+	def peak(workers, block):
+		return workers * WORKER_MB * 2**20 + 2 * workers * block * block * pixel_bytes
+	def windowCount(block):
+		return -(-width // block) * -(-height // block)
+
+	workers = max(1,min(int(n_workers),cpuLimit()))
+	smallest = native_block if blocksize is None else int(blocksize)
+	while (workers > 1) and (peak(workers,smallest) > budget):
+		workers -= 1
+	if peak(workers,smallest) > budget:
+		log.warning(f"One worker on {smallest}-pixel windows needs about {peak(workers,smallest) // 2**20} MiB, over the budget of {budget // 2**20} MiB")
+
+	if blocksize is not None:
+		block = int(blocksize)
+	else:
+		# grow the window while it fits, stays within MAX_BLOCK, and leaves every worker a few windows
+		block = native_block
+		while True:
+			larger = block * 2
+			if (larger > max(MAX_BLOCK,native_block)) or (peak(workers,larger) > budget) or (windowCount(larger) < 4 * workers):
+				break
+			block = larger
+	plan = Plan(blocksize=block,workers=workers,in_flight=2*workers)
+	log.debug(f"Planned {plan} for {width} x {height} pixels of {pixel_bytes} bytes, within {budget // 2**20} MiB")
+	return plan
@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+
+"""
+This module reprojects fixed-grid ancillary products with a cached index
+
+CHIRPS, Merra-2, and SWI files always arrive on the same lat/lon grids,
+so the nearest-neighbour reprojection to MODIS sinusoidal maps the same
+source pixel to each output pixel every time. The first file on a grid
+is used to build that map once: a raster whose values are its own pixel
+numbers is run through the same GDAL warp as the data
+(cog.openSinusoidal()), and the result is saved as a memory-mapped array
+of source pixel numbers. Later files on the same grid are reprojected by
+gathering source pixels through the map, block by block on a thread
+pool, with no call to the GDAL warper.
+
+When a map is built, the gathered result is compared with gdal.Warp for
+the same file, and the map is thrown away unless every pixel is
+identical. Inputs that don't fit (more than one band, or too many
+pixels to number with int32) fall back to cog.sinusoidalCog().
+
+The cache can be configured with the following environment variables:
+
+	GLAM_REGRID_CACHE   directory of saved maps (default 'regrid_cache',
+	                    next to 'glam_keys.json'; set to an empty string
+	                    to always use gdal.Warp)
+	GLAM_REGRID_ROWS    rows gathered per block (default 512)
+
+***
+
+Functions
+---------
+gridKey
+getIndex
+gather
+sinusoidalCog
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import hashlib, json, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from glam_data_processing import cog
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.exceptions import BadInputError
+
+gdal = lazyImport("gdal", on_load=lambda m: m.UseExceptions())
+np = lazyImport("numpy")
+
+## settings
+
+CACHE_DIR = os.environ.get("GLAM_REGRID_CACHE",os.path.join(os.path.dirname(os.path.dirname(__file__)),"regrid_cache"))
+BLOCK_ROWS = int(os.environ.get("GLAM_REGRID_ROWS",512))
+
+# bump when the warp in cog.openSinusoidal() changes, so old maps are not reused
+INDEX_VERSION = 1
+
+## module state
+
+_indexes = {} # key: (index array, output metadata)
+_keyLocks = {}
+_lock = threading.Lock()
+
+
+def _keyLock(key:str) -> threading.Lock:
+	"""Returns a lock held while one map is being built, so it is only built once"""
+	with _lock:
+		return _keyLocks.setdefault(key,threading.Lock())
+
+
+def gridKey(src:"gdal.Dataset", srs:str) -> str:
+	"""Returns a name identifying a source grid together with the target grid
+
+	***
+
+	Parameters
+	----------
+	src:gdal.Dataset
+		Open source dataset
+	srs:str
+		Projection of the source
+	"""
+	definition = [INDEX_VERSION,src.RasterXSize,src.RasterYSize,list(src.GetGeoTransform()),srs,cog.SINUSOIDAL,cog.MAX_NORTH,cog.MAX_WEST,cog.MAX_SOUTH,cog.MAX_EAST]
+	return hashlib.sha1(json.dumps(definition).encode()).hexdigest()
+
+
+def _buildIndex(src:"gdal.Dataset", srs:str) -> tuple:
+	"""Warps a raster of pixel numbers with the grid of src; returns (index array, output metadata)"""
+	x, y = src.RasterXSize, src.RasterYSize
+	numbers = cog.vsimemPath("pixels.tif")
+	try:
+		ds = gdal.GetDriverByName("GTiff").Create(numbers,x,y,1,gdal.GDT_Int32)
+		ds.SetGeoTransform(src.GetGeoTransform())
+		ds.SetProjection(src.GetProjection())
+		for r0 in range(0,y,BLOCK_ROWS):
+			rows = min(BLOCK_ROWS,y-r0)
+			ds.GetRasterBand(1).WriteArray(np.arange(r0*x,(r0+rows)*x,dtype=np.int32).reshape(rows,x),0,r0)
+		del ds
+		with cog.openSinusoidal(numbers,src_srs=srs,dst_nodata=-1) as warped:
+			index = warped.GetRasterBand(1).ReadAsArray().astype(np.int32,copy=False)
+			meta = {
+				"x":warped.RasterXSize,
+				"y":warped.RasterYSize,
+				"geotransform":list(warped.GetGeoTransform()),
+				"projection":warped.GetProjection()
+				}
+	finally:
+		gdal.Unlink(numbers)
+	return index, meta
+
+
+def _saveIndex(key:str, index:"numpy.ndarray", meta:dict) -> None:
+	"""Writes a map to the cache directory under temporary names, then moves it into place"""
+	os.makedirs(CACHE_DIR,exist_ok=True)
+	path = os.path.join(CACHE_DIR,key)
+	tag = f"{os.getpid()}.{threading.get_ident()}.TEMP"
+	try:
+		np.save(f"{path}.{tag}.npy",index)
+		with open(f"{path}.{tag}.json","w") as f:
+			json.dump(meta,f)
+		os.replace(f"{path}.{tag}.npy",f"{path}.npy")
+		os.replace(f"{path}.{tag}.json",f"{path}.json") # written last; marks the map complete
+	except OSError as e:
+		log.warning(f"Failed to save reprojection index {path}: {e}")
+	finally:
+		for f in (f"{path}.{tag}.npy",f"{path}.{tag}.json"):
+			if os.path.exists(f):
+				os.remove(f)
+
+
+def _loadIndex(key:str) -> tuple:
+	"""Returns (memory-mapped index, output metadata) from the cache directory, or None"""
+	path = os.path.join(CACHE_DIR,key)
+	try:
+		with open(f"{path}.json") as f:
+			meta = json.load(f)
+		index = np.load(f"{path}.npy",mmap_mode="r")
+	except (OSError, ValueError):
+		return None
+	if index.shape != (meta["y"],meta["x"]):
+		return None
+	return index, meta
+
+
+def getIndex(src:"gdal.Dataset", srs:str) -> tuple:
+	"""Returns (index array, output metadata, built) for the grid of src, building the map if needed
+
+	In the index array, each output pixel holds the number (row * width
+	+ column) of the source pixel it takes its value from, or -1 if it
+	lies outside the source. The metadata give the output's 'x' and 'y'
+	size, 'geotransform', and 'projection'. 'built' is True if the map
+	was built by this call, in which case it has not been saved yet.
+
+	***
+
+	Parameters
+	----------
+	src:gdal.Dataset
+		Open source dataset
+	srs:str
+		Projection of the source
+	"""
+	key = gridKey(src,srs)
+	with _keyLock(key):
+		hit = _indexes.get(key) or _loadIndex(key)
+		if hit is not None:
+			_indexes[key] = hit
+			return hit[0], hit[1], False
+		log.info(f"Building reprojection index for {src.RasterXSize}x{src.RasterYSize} grid")
+		index, meta = _buildIndex(src,srs)
+		return index, meta, True
+
+
+def _keepIndex(src:"gdal.Dataset", srs:str, index:"numpy.ndarray", meta:dict) -> None:
+	"""Saves a verified map, and keeps it in memory for this process"""
+	key = gridKey(src,srs)
+	with _keyLock(key):
+		_indexes[key] = (index,meta)
+		_saveIndex(key,index,meta)
+
+
+def gather(values:"numpy.ndarray", index:"numpy.ndarray", fill = 0, block_rows:int = None, workers:int = None) -> "numpy.ndarray":
+	"""Returns an array shaped like index, holding values.flat[index], and fill where index is negative
+
+	The work is split into blocks of rows, gathered on a thread pool.
+
+	***
+
+	Parameters
+	----------
+	values:numpy.ndarray
+		Source pixel values
+	index:numpy.ndarray
+		Source pixel numbers for each output pixel; see getIndex()
+	fill:float
+		Default 0; value of output pixels outside the source
+	block_rows:int
+		Default None; rows per block. If not set, uses GLAM_REGRID_ROWS
+	workers:int
+		Default None; number of threads. If not set, uses the number of CPUs
+	"""
+	block_rows = block_rows or BLOCK_ROWS
+	flat = values.reshape(-1)
+	out = np.empty(index.shape,dtype=values.dtype)
+
+	def block(r0:int) -> None:
+		idx = np.asarray(index[r0:r0+block_rows])
+		outside = idx < 0
+		np.take(flat,np.where(outside,0,idx),out=out[r0:r0+block_rows])
+		out[r0:r0+block_rows][outside] = fill
+
+	with ThreadPoolExecutor(max_workers=(workers or os.cpu_count())) as executor:
+		list(executor.map(block,range(0,index.shape[0],block_rows)))
+	return out
+
+
+def sinusoidalCog(in_file:str, out_file:str = None, src_srs:str = None, src_nodata = None, compress:str = "LZW", predictor:bool = True) -> str:
+	"""Reprojects a fixed-grid raster to MODIS sinusoidal with a cached index, and writes a COG
+
+	Takes the same arguments as cog.sinusoidalCog(), and gives the same
+	output pixel for pixel. Returns the output path.
+	"""
+	if (out_file is None) and (in_file.startswith("/vsi") or (":" in os.path.basename(in_file))):
+		raise BadInputError(f"An output path is required for dataset '{in_file}'")
+
+	src = gdal.Open(in_file,0)
+	if (not CACHE_DIR) or (src.RasterCount != 1) or (src.RasterXSize * src.RasterYSize >= 2**31):
+		del src
+		return cog.sinusoidalCog(in_file,out_file,src_srs=src_srs,src_nodata=src_nodata,compress=compress,predictor=predictor)
+	srs = src_srs or src.GetProjection() or "EPSG:4326"
+	band = src.GetRasterBand(1)
+	nodata = band.GetNoDataValue() if src_nodata is None else src_nodata
+	dataType = band.DataType
+	scale, offset = band.GetScale(), band.GetOffset() # e.g. SWI, opened as a NetCDF subdataset
+	values = band.ReadAsArray()
+	index, meta, built = getIndex(src,srs)
+
+	gathered = gather(values,index,fill=(0 if nodata is None else nodata))
+	if built:
+		## check against gdal.Warp before trusting the new map
+		with cog.openSinusoidal(in_file,src_srs=srs,src_nodata=src_nodata) as warped:
+			expected = warped.GetRasterBand(1).ReadAsArray()
+		identical = (expected.shape == gathered.shape) and np.array_equal(expected,gathered,equal_nan=np.issubdtype(gathered.dtype,np.floating))
+		if not identical:
+			log.warning(f"Reprojection index for {in_file} does not match gdal.Warp; not saving it")
+			del src
+			return cog.sinusoidalCog(in_file,out_file,src_srs=src_srs,src_nodata=src_nodata,compress=compress,predictor=predictor)
+		_keepIndex(src,srs,index,meta)
+	del src
+
+	def write(path:str) -> None:
+		mem = gdal.GetDriverByName("MEM").Create("",meta["x"],meta["y"],1,dataType)
+		mem.SetGeoTransform(meta["geotransform"])
+		mem.SetProjection(meta["projection"])
+		memBand = mem.GetRasterBand(1)
+		if nodata is not None:
+			memBand.SetNoDataValue(nodata)
+		if scale is not None:
+			memBand.SetScale(scale)
+		if offset is not None:
+			memBand.SetOffset(offset)
+		memBand.WriteArray(gathered)
+		cog.writeCog(mem,path,compress=compress,predictor=predictor)
+		del memBand, mem
+
+	return cog.writeInPlace(write,in_file,out_file)
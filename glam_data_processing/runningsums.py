@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+
+"""
+This module updates mean anomaly baselines from stored running sums
+
+A 5- or 10-year mean baseline used to be rebuilt by reading every year's
+raster for its date, even when only one year had changed. Here each
+baseline has a sidecar raster next to it, holding the sum (band 1)
+and count (band 2) of valid values over the years it covers. The paths
+and modification times of those years are kept in the sidecar's
+metadata. When a new year arrives, the new year is added to the sums and
+the year that dropped out is taken away, so each window reads the
+sidecar plus two or three input rasters instead of ten. A new year is
+read once and shared by every horizon.
+
+The sums are exact integers, so the means match a full recompute bit for
+bit. A sidecar is only trusted while every year it still covers has the
+same path and modification time as when it was summed; otherwise, or if
+there is no sidecar yet, the sums are rebuilt from scratch. Float inputs
+(Merra-2) are summed in float32, as a full recompute does, and taking a
+year away would not give the same bits, so their sums are always
+rebuilt. Medians cannot be kept this way, and are left to a full update.
+
+***
+
+Functions
+---------
+sidecarPath
+readSources
+planUpdate
+updateMeans
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import json
+
+from glam_data_processing import kernels, stacks
+from glam_data_processing._lazy import lazyImport
+from glam_data_processing.exceptions import UnavailableError
+
+np = lazyImport("numpy")
+rasterio = lazyImport("rasterio")
+
+SOURCES_TAG = "GLAM_RUNNING_SOURCES"
+
+
+def sidecarPath(directory:str, stem:str, horizon) -> str:
+	"""Returns path to the running-sum sidecar of one baseline; e.g. '<directory>/chirps.01-01.running_5year.tif'
+
+	horizon is a number of years, or "full" for the whole record.
+	"""
+	name = "full" if horizon == "full" else f"{horizon}year"
+	return os.path.join(directory,f"{stem}.running_{name}.tif")
+
+
+def readSources(path:str) -> dict:
+	"""Returns {year: [input path, modification time]} summed into a sidecar, or None if there is no usable sidecar"""
+	if not os.path.exists(path):
+		return None
+	try:
+		with rasterio.open(path) as sidecar:
+			tag = sidecar.tags().get(SOURCES_TAG)
+	except Exception:
+		log.warning(f"Failed to read running sums from {path}; rebuilding them")
+		return None
+	if tag is None:
+		return None
+	return {int(year):source for year, source in json.loads(tag).items()}
+
+
+def planUpdate(stored:dict, current:dict) -> tuple:
+	"""Returns (years to add, years to remove) to bring stored sums up to date, or None if they must be rebuilt
+
+	***
+
+	Parameters
+	----------
+	stored:dict
+		{year: [path, modification time]} already summed; see readSources()
+	current:dict
+		{year: [path, modification time]} the sums should cover
+	"""
+	if stored is None:
+		return None
+	# years kept must be unchanged since they were summed
+	for year in set(stored) & set(current):
+		if list(stored[year]) != list(current[year]):
+			return None
+	add = sorted(set(current) - set(stored))
+	remove = sorted(set(stored) - set(current))
+	# years taken away must still be on disk, unchanged
+	for year in remove:
+		path, mtime = stored[year]
+		try:
+			if os.path.getmtime(path) != mtime:
+				return None
+		except OSError:
+			return None
+	if len(add) + len(remove) >= len(current): # as cheap to start over
+		return None
+	return add, remove
+
+
+def _mp_worker(args:tuple) -> tuple:
+	"""Worker function for use with multiprocessing
+
+	Returns a tuple of targetwindow and {horizon: (sums, counts, mean)}
+
+	***
+
+	Parameters
+	----------
+	args:tuple
+		targetwindow:rasterio window
+		jobs:dict
+			{horizon: (sidecar path or None, paths to add, paths to remove)}
+		dtype:str
+	"""
+	targetwindow, jobs, dtype = args
+	shape = (int(targetwindow.height),int(targetwindow.width))
+	blocks = {} # each input is read once, however many horizons use it
+	def read(path):
+		if path not in blocks:
+			blocks[path] = stacks.openDataset(path).read(1, window=targetwindow)
+		return blocks[path]
+	outputstore = {}
+	for horizon, (sidecar, add, remove) in jobs.items():
+		if sidecar is None:
+			sums = np.zeros(shape,dtype=kernels.sumDtype(dtype))
+			counts = np.zeros(shape,dtype=np.int32)
+		else:
+			sidecarhandle = stacks.openDataset(sidecar)
+			sums = sidecarhandle.read(1, window=targetwindow).astype(kernels.sumDtype(dtype))
+			counts = sidecarhandle.read(2, window=targetwindow).astype(np.int32)
+		for path in add:
+			kernels.addYear(sums,counts,read(path))
+		for path in remove:
+			kernels.addYear(sums,counts,read(path),sign=-1)
+		outputstore[horizon] = (sums, counts, kernels.meanFromSums(sums,counts,dtype))
+	return(targetwindow, outputstore)
+
+
+def updateMeans(directory:str, stem:str, sources:list, output_paths:dict, profile:dict, windows:list, mapper = map) -> dict:
+	"""Writes mean baselines from running sums, updating the sums; returns output_paths
+
+	Raises UnavailableError if there are fewer sources than a horizon
+	needs.
+
+	***
+
+	Parameters
+	----------
+	directory:str
+		Directory of sidecar files
+	stem:str
+		Start of sidecar file names; e.g. 'chirps.01-01'
+	sources:list
+		(year, path) of each input, latest first
+	output_paths:dict
+		{horizon: path of mean baseline to write}; each horizon is a
+		number of years, or "full" for every source
+	profile:dict
+		rasterio profile of the mean baselines
+	windows:list
+		rasterio windows covering the rasters
+	mapper:function
+		Default map; used as mapper(function, arguments) to spread windows
+		over workers; e.g. the imap of a multiprocessing.Pool
+	"""
+	os.makedirs(directory,exist_ok=True)
+	jobs = {}
+	current = {}
+	for horizon in output_paths:
+		years = len(sources) if horizon == "full" else horizon
+		if len(sources) < years:
+			raise UnavailableError(f"Only {len(sources)} input image paths found; {years} needed")
+		current[horizon] = {year:[path,os.path.getmtime(path)] for year, path in sources[:years]}
+		sidecar = sidecarPath(directory,stem,horizon)
+		stored = readSources(sidecar)
+		plan = planUpdate(stored,current[horizon])
+		if not np.issubdtype(np.dtype(profile['dtype']),np.integer): # float sums are not exact
+			plan = None
+		if plan is None:
+			log.info(f"Rebuilding running sums in {os.path.basename(sidecar)}")
+			jobs[horizon] = (None, [path for path, mtime in current[horizon].values()], [])
+		else:
+			add, remove = plan
+			log.info(f"Updating running sums in {os.path.basename(sidecar)}: adding {add}, removing {remove}")
+			jobs[horizon] = (sidecar, [current[horizon][y][0] for y in add], [stored[y][0] for y in remove])
+
+	sidecarProfile = dict(profile,dtype=kernels.sumDtype(profile['dtype']).name,count=2,nodata=None)
+	sidecarProfile.setdefault("BIGTIFF","IF_SAFER")
+	temps = {horizon:sidecarPath(directory,stem,horizon) + ".TEMP" for horizon in output_paths}
+	meanHandles = {}
+	sidecarHandles = {}
+	try:
+		for horizon in output_paths:
+			os.makedirs(os.path.dirname(output_paths[horizon]),exist_ok=True) # folders for new horizons may not exist yet
+			meanHandles[horizon] = rasterio.open(output_paths[horizon], 'w', **profile)
+			sidecarHandles[horizon] = rasterio.open(temps[horizon], 'w', **sidecarProfile)
+		for win, values in mapper(_mp_worker, [(w, jobs, profile['dtype']) for w in windows]):
+			for horizon, (sums, counts, mean) in values.items():
+				meanHandles[horizon].write(mean, window=win, indexes=1)
+				sidecarHandles[horizon].write(np.stack([sums,counts]), window=win)
+		for horizon, handle in sidecarHandles.items():
+			handle.update_tags(**{SOURCES_TAG:json.dumps(current[horizon])})
+	except BaseException:
+		for handle in list(meanHandles.values()) + list(sidecarHandles.values()):
+			handle.close()
+		for temp in temps.values():
+			if os.path.exists(temp):
+				os.remove(temp)
+		raise
+	for handle in list(meanHandles.values()) + list(sidecarHandles.values()):
+		handle.close()
+	for horizon, temp in temps.items():
+		os.replace(temp,sidecarPath(directory,stem,horizon))
+	return output_paths
@@ -0,0 +1,246 @@
+#! /usr/bin/env python
+
+"""
+This module keeps raw source downloads on disk, so a failed run does not download them again
+
+When updateData fails partway through a file (at the stats or anomaly
+stage, say), its temp directory is deleted and the next run used to
+download the raw source file again. Here each raw file (.nc4, .nc, .gz,
+.tif) that passes through fetch.py can be kept in a cache directory.
+Files are stored once per content, under their SHA-256 digest, and looked
+up by URL. An entry is only reused while the server still reports the
+same ETag or Last-Modified header for the URL, or, if it gives neither,
+the same size. When the cache grows past its size cap, the files used
+least recently are removed first.
+
+Every write goes to a temporary name and is moved into place, so the
+directory can sit on shared storage (e.g. GPFS) and be used by several
+hosts at once.
+
+The cache can be configured with the following environment variables:
+
+	GLAM_SOURCE_CACHE      directory of cached source files (default unset,
+	                       which turns the cache off)
+	GLAM_SOURCE_CACHE_MB   maximum size of the cache in megabytes (default 20480)
+
+***
+
+Classes
+-------
+SourceCache
+
+Functions
+---------
+defaultCache
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import hashlib, json, shutil, socket, tempfile, threading
+
+## settings
+
+CACHE_DIR = os.environ.get("GLAM_SOURCE_CACHE","")
+CACHE_MB = float(os.environ.get("GLAM_SOURCE_CACHE_MB",20480))
+
+
+class SourceCache:
+	"""Raw source files on disk, stored once per content and looked up by URL
+
+	Files are kept in 'blobs/', named by SHA-256 digest. For each URL, a
+	small JSON record in 'index/' gives the digest, size, and validator
+	(ETag or Last-Modified) of the version last downloaded.
+
+	***
+
+	Parameters
+	----------
+	directory:str
+		Default None; where cached files are kept. If not set, uses
+		GLAM_SOURCE_CACHE
+	max_mb:float
+		Default None; maximum total size of cached files in megabytes. If
+		not set, uses GLAM_SOURCE_CACHE_MB
+	"""
+	def __init__(self, directory:str = None, max_mb:float = None):
+		self.directory = CACHE_DIR if directory is None else directory
+		self.max_mb = CACHE_MB if max_mb is None else max_mb
+
+	def __contains__(self, url:str) -> bool:
+		return self.lookup(url) is not None
+
+	def __len__(self) -> int:
+		return len(self._blobs())
+
+	def _indexPath(self, url:str) -> str:
+		return os.path.join(self.directory,"index",hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+	def _blobPath(self, digest:str) -> str:
+		return os.path.join(self.directory,"blobs",digest)
+
+	def tempPath(self) -> str:
+		"""Creates an empty temporary file inside the cache, and returns its path; the name is unique across hosts"""
+		os.makedirs(os.path.join(self.directory,"blobs"),exist_ok=True)
+		fd, path = tempfile.mkstemp(prefix=f".{socket.gethostname()}.",suffix=".TEMP",dir=os.path.join(self.directory,"blobs"))
+		os.close(fd)
+		return path
+
+	def _blobs(self) -> list:
+		"""Returns (last used, size, path) for every cached file"""
+		files = []
+		try:
+			names = os.listdir(os.path.join(self.directory,"blobs"))
+		except FileNotFoundError:
+			return files
+		for name in names:
+			if name.startswith("."): # being written
+				continue
+			path = os.path.join(self.directory,"blobs",name)
+			try:
+				st = os.stat(path)
+			except FileNotFoundError: # removed by another host
+				continue
+			files.append((st.st_mtime,st.st_size,path))
+		return files
+
+	def lookup(self, url:str) -> dict:
+		"""Returns the record for url ('url', 'digest', 'size', 'validator', 'path'), or None if nothing is cached for it"""
+		try:
+			with open(self._indexPath(url)) as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if entry.get("url") != url:
+			return None
+		entry["path"] = self._blobPath(entry["digest"])
+		try:
+			if os.path.getsize(entry["path"]) != entry["size"]:
+				return None
+		except OSError: # evicted
+			return None
+		return entry
+
+	def get(self, url:str, validator:str = None, size:int = None) -> dict:
+		"""Returns the record for url if it matches what the server reports now, otherwise None
+
+		The cached file must have the given validator (when both it and
+		the record have one) and the given size (when known). With nothing
+		to check against, the record is not trusted. A match marks the file
+		as recently used.
+
+		***
+
+		Parameters
+		----------
+		url:str
+			URL of source file
+		validator:str
+			Default None; ETag or Last-Modified header the server gives now
+		size:int
+			Default None; Content-Length the server gives now
+		"""
+		entry = self.lookup(url)
+		if entry is None:
+			return None
+		checked = False
+		if (validator is not None) and (entry.get("validator") is not None):
+			if validator != entry["validator"]:
+				return None
+			checked = True
+		if size is not None:
+			if int(size) != entry["size"]:
+				return None
+			checked = True
+		if not checked:
+			return None
+		try:
+			os.utime(entry["path"]) # mark as recently used
+		except OSError:
+			return None
+		return entry
+
+	def add(self, url:str, temp_path:str, digest:str, validator:str = None) -> str:
+		"""Moves a file made with tempPath() into the cache, records it for url, and returns its cached path"""
+		path = self._blobPath(digest)
+		size = os.path.getsize(temp_path)
+		if os.path.exists(path):
+			os.remove(temp_path) # same content already cached
+			os.utime(path)
+		else:
+			os.replace(temp_path,path)
+		self._record(url,digest,size,validator)
+		self.evict()
+		return path
+
+	def _record(self, url:str, digest:str, size:int, validator:str = None) -> None:
+		"""Writes the index record for url"""
+		os.makedirs(os.path.join(self.directory,"index"),exist_ok=True)
+		indexPath = self._indexPath(url)
+		tempIndex = f"{indexPath}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.TEMP"
+		with open(tempIndex,"w") as f:
+			json.dump({"url":url,"digest":digest,"size":size,"validator":validator},f)
+		os.replace(tempIndex,indexPath)
+
+	def put(self, url:str, in_path:str, digest:str, validator:str = None) -> str:
+		"""Copies a downloaded file into the cache, records it for url, and returns its cached path
+
+		Failures to write are logged, and the file is simply not cached.
+
+		***
+
+		Parameters
+		----------
+		url:str
+			URL the file was downloaded from
+		in_path:str
+			Path to downloaded file; it is copied, not moved
+		digest:str
+			SHA-256 hex digest of the file
+		validator:str
+			Default None; ETag or Last-Modified header sent with the file
+		"""
+		temp = None
+		try:
+			path = self._blobPath(digest)
+			if os.path.exists(path): # same content already cached under another URL
+				os.utime(path)
+				self._record(url,digest,os.path.getsize(in_path),validator)
+				return path
+			temp = self.tempPath()
+			shutil.copyfile(in_path,temp)
+			return self.add(url,temp,digest,validator)
+		except OSError as e:
+			log.warning(f"Failed to cache {url} in {self.directory}: {e}")
+			return None
+		finally:
+			if (temp is not None) and os.path.exists(temp):
+				os.remove(temp)
+
+	def evict(self) -> None:
+		"""Removes the files used least recently until the cache fits in max_mb"""
+		files = sorted(self._blobs())
+		total = sum(f[1] for f in files)
+		limit = self.max_mb * 1024 * 1024
+		for mtime, size, path in files:
+			if total <= limit:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError: # already removed by another host
+				pass
+			total -= size
+
+	def clear(self) -> None:
+		"""Removes every cached file and record"""
+		for sub in ("blobs","index"):
+			shutil.rmtree(os.path.join(self.directory,sub),ignore_errors=True)
+
+
+def defaultCache() -> SourceCache:
+	"""Returns a SourceCache for GLAM_SOURCE_CACHE, or None if the cache is turned off"""
+	if not CACHE_DIR:
+		return None
+	return SourceCache()
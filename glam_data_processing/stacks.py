@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+
+"""
+This module reads windows of an archive's years into one stack
+
+Baseline workers used to open, read, and close every input GeoTIFF for
+every window, one after another; over a global MODIS baseline that is
+millions of opens, each of them parsing the TIFF headers again. Here
+each worker process keeps its datasets open between windows, in a small
+cache keyed by path and modification time (so a file rewritten in place
+is opened again). A pool can open every input up front by passing
+initWorker() as its initializer. The years of a window are read at the
+same time on a few threads, straight into their slices of one
+preallocated array; GDAL releases the GIL while it reads.
+
+The reader can be configured with the following environment variables:
+
+	GLAM_STACK_THREADS   threads reading years at once, per process (default 4)
+	GLAM_STACK_HANDLES   most datasets kept open per process (default 256)
+
+***
+
+Functions
+---------
+initWorker
+openDataset
+readStack
+closeAll
+"""
+
+# set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from glam_data_processing._lazy import lazyImport
+
+np = lazyImport("numpy")
+rasterio = lazyImport("rasterio")
+
+## settings
+
+THREADS = int(os.environ.get("GLAM_STACK_THREADS",4))
+MAX_HANDLES = int(os.environ.get("GLAM_STACK_HANDLES",256))
+
+## module state; one of each per process
+
+_handles = OrderedDict() # (path, mtime): open dataset, least recently used first
+_lock = threading.Lock()
+_readPool = None
+_pid = os.getpid()
+
+
+def _checkFork() -> None:
+	"""Forgets datasets and threads inherited from a parent process, which cannot be used after a fork"""
+	global _handles, _lock, _readPool, _pid
+	if _pid != os.getpid():
+		_handles = OrderedDict()
+		_lock = threading.Lock()
+		_readPool = None
+		_pid = os.getpid()
+
+
+def initWorker(input_paths:list = ()) -> None:
+	"""Pool initializer; opens each input once, so that every window this worker handles can reuse it
+
+	***
+
+	Parameters
+	----------
+	input_paths:list
+		Default (); paths of the rasters the worker will read
+	"""
+	for path in input_paths:
+		openDataset(path)
+
+
+def openDataset(path:str) -> "rasterio.DatasetReader":
+	"""Returns an open dataset for path, opening it only if it is not already open in this process"""
+	_checkFork()
+	key = (path, os.path.getmtime(path))
+	with _lock:
+		dataset = _handles.get(key)
+		if dataset is not None:
+			_handles.move_to_end(key)
+			return dataset
+	dataset = rasterio.open(path, 'r')
+	with _lock:
+		if key in _handles: # opened by another thread meanwhile
+			dataset.close()
+			return _handles[key]
+		_handles[key] = dataset
+		# close what is least recently used, including older versions of rewritten files
+		while len(_handles) > MAX_HANDLES:
+			_handles.popitem(last=False)[1].close()
+	return dataset
+
+
+def _pool() -> ThreadPoolExecutor:
+	global _readPool
+	_checkFork()
+	with _lock:
+		if _readPool is None:
+			_readPool = ThreadPoolExecutor(max_workers=max(1,THREADS),thread_name_prefix="stack")
+		return _readPool
+
+
+def readStack(targetwindow, input_paths:list, threads:int = None) -> "np.ndarray":
+	"""Reads band 1 of one window of each input into a (years, rows, columns) array, in the order given
+
+	***
+
+	Parameters
+	----------
+	targetwindow:rasterio window
+	input_paths:list
+		Ordered list of filepaths; all must share dtype and dimensions
+	threads:int
+		Default None; if 1, reads one year at a time on the calling
+		thread. Otherwise uses the process's pool of GLAM_STACK_THREADS
+	"""
+	first = openDataset(input_paths[0])
+	stack = np.empty((len(input_paths), int(targetwindow.height), int(targetwindow.width)), dtype=first.dtypes[0])
+	def read(i):
+		openDataset(input_paths[i]).read(1, window=targetwindow, out=stack[i])
+	if (threads == 1) or (len(input_paths) == 1):
+		for i in range(len(input_paths)):
+			read(i)
+	else:
+		# list() waits for every read, and raises the first error
+		list(_pool().map(read,range(len(input_paths))))
+	return stack
+
+
+def closeAll() -> None:
+	"""Closes every dataset this process has open"""
+	with _lock:
+		while _handles:
+			_handles.popitem(last=False)[1].close()
@@ -13,6 +13,7 @@ log = logging.getLogger(__name__)
 
 # import other required modules
 from .util import getWindows, getValidRange
+from .planner import planWindows
 import rasterio#, dask, xarray
 import numpy as np
 #from dask.distributed import Client
@@ -130,7 +131,7 @@ def _update_ZS(stored_dict,this_dict) -> dict:
 	return out_dict
 
 
-def zonalStats(product_path:str, mask_path:str, admin_path:str, n_cores: int = 1, block_scale_factor: int = 8, default_block_size: int = 256, time:bool = False) -> dict:
+def zonalStats(product_path:str, mask_path:str, admin_path:str, n_cores: int = 1, block_scale_factor: int = None, default_block_size: int = 256, time:bool = False, memory_mb: int = None) -> dict:
 	"""A function for calculating zonal statistics on a raster image
 
 	Returns a dictionary of the form:
@@ -145,36 +146,44 @@ def zonalStats(product_path:str, mask_path:str, admin_path:str, n_cores: int = 1
 	admin_path:str
 		Path to admin dataset on disk
 	n_cores:int
-		Number of cores to use for parallel processing. Default is 1
+		Number of cores to use for parallel processing. Default is 1. Fewer
+		are used if they would not fit in memory
 	block_scale_factor:int
 		Relative size of processing windows compared to product_path native block
-		size. Default is 8, calculated to be optimal for all n_cores (1-50) on
-		GEOG cluster node 18
+		size. Default is None, in which case the largest windows that fit in
+		memory are used; see planner.py
 	default_block_size:int
 		If product_path is not tiled, this argument is used as the block size. In
 		that case, windows will be of size (default_block size * block_scale_factor)
 		on each side.
 	time:bool
 		Whether to log the time taken to return. Default false
+	memory_mb:int
+		Memory budget in MiB. Default is None; see planner.memoryBudget()
 	"""
 	# start timer
 	start_time = datetime.now()
 	# coerce numeric arguments to correct type
 	n_cores = int(n_cores)
-	block_scale_factor = int(block_scale_factor)
 	# get metadata
 	with rasterio.open(product_path,'r') as meta_handle:
 		meta_profile = meta_handle.profile
 		## block size
 		if meta_profile['tiled']:
-			blocksize =meta_profile['blockxsize'] * block_scale_factor
+			native_block = meta_profile['blockxsize']
 		else:
 			log.warning(f"Input file {product_path} is not tiled!")
-			blocksize = default_block_size * block_scale_factor
+			native_block = default_block_size
 		## raster dimensions
 		hnum = meta_handle.width
 		vnum = meta_handle.height
 
+	# size windows and number of cores to fit in memory; each pixel holds product, mask, and admin
+	# values (up to 8 bytes each), an int64 copy of valid product values, and a few boolean masks
+	pixel_bytes = np.dtype(meta_profile['dtype']).itemsize + 8 + 8 + 8 + 4
+	plan = planWindows(hnum, vnum, pixel_bytes, n_cores, native_block=native_block, blocksize=(None if block_scale_factor is None else native_block * int(block_scale_factor)), budget_mb=memory_mb)
+	blocksize, n_cores = plan.blocksize, plan.workers
+
 	# get windows
 	windows = getWindows(hnum, vnum, blocksize)
 
@@ -253,7 +262,7 @@ def _mp_worker_PCT(args:tuple) -> np.array:
 	return np.histogram(raster_data, bins=n_bins, range=(histogram_min, histogram_max))[0]
 
 
-def percentiles(raster_path:str, percentiles:list = [10,90], binwidth:int = 10, n_cores:int = 1, block_scale_factor:int = 8, default_block_size: int = 256, time:bool = False) -> list:
+def percentiles(raster_path:str, percentiles:list = [10,90], binwidth:int = 10, n_cores:int = 1, block_scale_factor:int = None, default_block_size: int = 256, time:bool = False, memory_mb:int = None) -> list:
 	"""Function that approximates percentiles of a raster, leveraging multiple cores
 
 	***
@@ -272,13 +281,15 @@ def percentiles(raster_path:str, percentiles:list = [10,90], binwidth:int = 10,
 		How many processers to use. Default 1
 	block_scale_factor:int
 		Amount by which to scale native blocksize of raster file for the purposes
-		of windowed reads. Default 8
+		of windowed reads. Default None; the largest windows that fit in memory
 	default_block_size:int
 		If product_path is not tiled, this argument is used as the block size. In
 		that case, windows will be of size (default_block size * block_scale_factor)
 		on each side.
 	time:bool
 		Whether to log the time taken to return. Default false
+	memory_mb:int
+		Memory budget in MiB. Default None; see planner.memoryBudget()
 
 	Returns
 	-------
@@ -291,7 +302,6 @@ def percentiles(raster_path:str, percentiles:list = [10,90], binwidth:int = 10,
 	# validate inputs
 	binwidth = int(binwidth)
 	n_cores = int(n_cores)
-	block_scale_factor = int(block_scale_factor)
 	default_block_size = int(default_block_size)
 	for p in percentiles:
 		try:
@@ -306,16 +316,20 @@ def percentiles(raster_path:str, percentiles:list = [10,90], binwidth:int = 10,
 		meta_profile = meta_handle.profile
 		## block size
 		if meta_profile['tiled']:
-			blocksize =meta_profile['blockxsize'] * int(block_scale_factor)
+			native_block = meta_profile['blockxsize']
 		else:
-			log.warning(f"Input file {product_path} is not tiled!")
-			blocksize = default_block_size * int(block_scale_factor)
+			log.warning(f"Input file {raster_path} is not tiled!")
+			native_block = default_block_size
 		## raster dimensions
 		hnum = meta_handle.width
 		vnum = meta_handle.height
 		## data type
 		dtype = meta_profile['dtype']
 
+	# size windows and number of cores to fit in memory; each pixel is read, then copied by np.histogram()
+	plan = planWindows(hnum, vnum, np.dtype(dtype).itemsize + 16, n_cores, native_block=native_block, blocksize=(None if block_scale_factor is None else native_block * int(block_scale_factor)), budget_mb=memory_mb)
+	blocksize, n_cores = plan.blocksize, plan.workers
+
 	# get windows and valid range
 	windows = getWindows(hnum,vnum, blocksize)
 	histogram_min, histogram_max = getValidRange(dtype)
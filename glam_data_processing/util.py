@@ -11,7 +11,7 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 #logging.basicConfig(level="DEBUG")
 log = logging.getLogger(__name__)
 
-import shutil, subprocess
+from .cog import cloudOptimize
 from .exceptions import BadInputError
 from rasterio.windows import Window
 import numpy as np
@@ -85,25 +85,7 @@ def getMetadata(image_path:str) -> dict:
 
 def cloud_optimize_inPlace(in_file:str) -> None:
 	"""Takes path to input and output file location. Reads tif at input location and writes cloud-optimized geotiff of same data to output location."""
-	## add overviews to file
-	cloudOpArgs = ["gdaladdo",in_file,"-quiet"]
-	subprocess.call(cloudOpArgs)
-
-	## copy file
-	intermediate_file = in_file.replace(".tif",".TEMP.tif")
-	with open(intermediate_file,'wb') as a:
-		with open(in_file,'rb') as b:
-			shutil.copyfileobj(b,a)
-
-	## add tiling to file
-	cloudOpArgs = ["gdal_translate",intermediate_file,in_file,'-q','-co', "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', "COMPRESS=LZW", "-co", "PREDICTOR=2"]
-	if getMetadata(in_file)['product'] in NDVI_PRODUCTS:
-		cloudOpArgs.append("-co")
-		cloudOpArgs.append("BIGTIFF=YES")
-	subprocess.call(cloudOpArgs)
-
-	## remove intermediate
-	os.remove(intermediate_file)
+	cloudOptimize(in_file,bigtiff=(getMetadata(in_file)['product'] in NDVI_PRODUCTS))
 
 
 def getWindows(width, height, blocksize) -> list:
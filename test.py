@@ -1,5 +1,6 @@
-from unittest import TestCase
-import os, glob, logging
+from unittest import TestCase, skipUnless
+import os, glob, importlib.util, logging, re, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 class TestImport(TestCase):
 	def test_import(self):
@@ -10,9 +11,996 @@ class TestImport(TestCase):
 			succ = False
 		self.assertTrue(succ)
 
+class TestImportTime(TestCase):
+	# seconds allowed for importing the package's entry points
+	budget = float(os.environ.get("GLAM_IMPORT_BUDGET",1.0))
+	heavy = ["gdal","osgeo","pandas","terracotta","boto3","octvi","sqlalchemy","requests","numpy"]
+
+	def _timeImport(self,module):
+		script = (
+			"import sys, time\n"
+			"start = time.perf_counter()\n"
+			f"import {module}\n"
+			"print(time.perf_counter() - start)\n"
+			f"print(','.join(m for m in {self.heavy!r} if m in sys.modules))\n"
+			)
+		out = subprocess.run([sys.executable,"-c",script],cwd=os.path.dirname(os.path.abspath(__file__)),capture_output=True,text=True,check=True).stdout.splitlines()
+		return float(out[-2]), [m for m in out[-1].split(",") if m]
+
+	def test_import_legacy(self):
+		elapsed, loaded = self._timeImport("glam_data_processing.legacy")
+		self.assertEqual(loaded,[])
+		self.assertLess(elapsed,self.budget)
+
+	def test_import_command_line(self):
+		elapsed, loaded = self._timeImport("glam_data_processing.command_line")
+		self.assertEqual(loaded,[])
+		self.assertLess(elapsed,self.budget)
+
+class FixtureHandler(BaseHTTPRequestHandler):
+	"""Serves a 1MB file under '/available/' and 404 for everything else
+
+	The first request for any path under '/flaky/' is dropped without a
+	response, '/redirect/x' redirects to '/available/x', HEAD is refused
+	for paths under '/nohead/', files under '/short/' are cut off halfway,
+	'/listing/' is a directory page, paths under '/error/' always fail with
+	500, and files under '/resumable/' honour Range requests and are cut
+	off halfway the first time. The
+	server records how many requests it was handling at once, and how many
+	body bytes it sent.
+	"""
+	body = b"\0" * 1000000
+	resumable = bytes(i % 251 for i in range(1000000))
+	listing = b'<a href="MERRA2_400.statD_2d_slv_Nx.20200101.nc4">MERRA2_400.statD_2d_slv_Nx.20200101.nc4</a>\n<a href="MERRA2_400.statD_2d_slv_Nx.20200102.nc4">MERRA2_400.statD_2d_slv_Nx.20200102.nc4</a>\n<a href="chirps-v2.0.2020.01.3.tif.gz">chirps-v2.0.2020.01.3.tif.gz</a>'
+
+	def _respond(self, send_body):
+		server = self.server
+		with server.lock:
+			server.active += 1
+			server.peak = max(server.peak,server.active)
+			server.requests.append(self.path)
+			firstTry = server.requests.count(self.path) == 1
+		try:
+			time.sleep(0.02)
+			if self.path.startswith("/flaky/") and firstTry:
+				self.close_connection = True
+				return
+			if self.path.startswith("/redirect/"):
+				self.send_response(302)
+				self.send_header("Location",self.path.replace("/redirect/","/available/"))
+				self.send_header("Content-Length","0")
+				self.end_headers()
+				return
+			if self.path.startswith("/error/"):
+				self.send_response(500)
+				self.send_header("Content-Length","0")
+				self.end_headers()
+				return
+			if self.path.startswith("/listing/"):
+				self.send_response(200)
+				self.send_header("Content-Type","text/html")
+				self.send_header("Content-Length",str(len(self.listing)))
+				self.end_headers()
+				if send_body:
+					self.wfile.write(self.listing)
+				return
+			if self.path.startswith("/resumable/"):
+				body = self.resumable
+				start = 0
+				match = re.match(r"bytes=(\d+)-$",self.headers.get("Range",""))
+				if match and (self.headers.get("If-Range") == '"v1"'):
+					start = int(match.group(1))
+					self.send_response(206)
+					self.send_header("Content-Range",f"bytes {start}-{len(body)-1}/{len(body)}")
+				else:
+					self.send_response(200)
+				self.send_header("ETag",'"v1"')
+				self.send_header("Content-Length",str(len(body)-start))
+				self.end_headers()
+				if send_body:
+					body = body[start:]
+					if firstTry and (start == 0):
+						body = body[:len(body)//2]
+						self.close_connection = True
+					self.wfile.write(body)
+					with server.lock:
+						server.sent += len(body)
+				return
+			if self.path.startswith("/nohead/") and not send_body:
+				self.send_response(405)
+				self.send_header("Content-Length","0")
+				self.end_headers()
+				return
+			if not any(self.path.startswith(f) for f in ("/available/","/flaky/","/nohead/","/short/")):
+				self.send_response(404)
+				self.send_header("Content-Length","0")
+				self.end_headers()
+				return
+			body = self.body
+			if self.headers.get("Range") == "bytes=0-0":
+				body = body[:1]
+				self.send_response(206)
+			else:
+				self.send_response(200)
+			self.send_header("Content-Type","application/octet-stream")
+			self.send_header("Content-Length",str(len(body)))
+			self.end_headers()
+			if send_body:
+				if self.path.startswith("/short/"):
+					body = body[:len(body)//2]
+					self.close_connection = True
+				self.wfile.write(body)
+				with server.lock:
+					server.sent += len(body)
+		finally:
+			with server.lock:
+				server.active -= 1
+
+	def do_GET(self):
+		self._respond(True)
+
+	def do_HEAD(self):
+		self._respond(False)
+
+	def log_message(self, *args):
+		pass
+
+class FixtureServerTestCase(TestCase):
+	"""Runs a FixtureHandler server on a free local port for each test"""
+	def setUp(self):
+		self.server = ThreadingHTTPServer(("127.0.0.1",0),FixtureHandler)
+		self.server.lock = threading.Lock()
+		self.server.active = 0
+		self.server.peak = 0
+		self.server.requests = []
+		self.server.sent = 0
+		threading.Thread(target=self.server.serve_forever,daemon=True).start()
+		self.base = f"http://127.0.0.1:{self.server.server_port}"
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+class TestAvailability(FixtureServerTestCase):
+	def check(self, folder, name):
+		from glam_data_processing.availability import getSession
+		url = f"{self.base}/{folder}/{name}"
+		return getSession(url).get(url).status_code == 200
+
+	def test_checkMany_matches_serial(self):
+		from glam_data_processing.availability import checkMany
+		items = [("available" if i % 3 else "missing",f"file{i}") for i in range(30)]
+		serial = [self.check(*i) for i in items]
+		concurrent = checkMany(self.check,items,host=lambda folder, name: "fixture",connections=4)
+		self.assertEqual(concurrent,serial)
+
+	def test_checkMany_host_limit(self):
+		from glam_data_processing.availability import checkMany
+		items = [("available",f"file{i}") for i in range(20)]
+		checkMany(self.check,items,host=lambda folder, name: "fixture",connections=3)
+		self.assertLessEqual(self.server.peak,3)
+		self.assertGreater(self.server.peak,1)
+
+	def test_checkMany_retries(self):
+		from glam_data_processing.availability import checkMany
+		items = [("flaky",f"file{i}") for i in range(4)]
+		results = checkMany(self.check,items,host=lambda folder, name: "fixture",retries=2,backoff=0.01)
+		self.assertEqual(results,[True]*4)
+
+	def test_probe(self):
+		from glam_data_processing.availability import probe
+		self.assertEqual(probe(f"{self.base}/available/a.nc")[0],200)
+		self.assertEqual(probe(f"{self.base}/missing/a.nc")[0],404)
+		self.assertEqual(probe(f"{self.base}/redirect/a.nc")[0],200)
+		status, headers = probe(f"{self.base}/nohead/a.nc")
+		self.assertEqual(status,200)
+		self.assertEqual(headers["Content-Type"],"application/octet-stream")
+		self.assertLessEqual(self.server.sent,1)
+		# nothing listening: unavailable, not an error
+		import socket
+		with socket.socket() as s:
+			s.bind(("127.0.0.1",0))
+			closedPort = s.getsockname()[1]
+		with self.assertLogs("glam_data_processing.availability","WARNING"):
+			self.assertEqual(probe(f"http://127.0.0.1:{closedPort}/available/a.nc",retries=1,backoff=0.01),(None,{}))
+
+	def test_getListing(self):
+		from glam_data_processing import listings
+		original = listings.CACHE_PATH
+		self.addCleanup(setattr,listings,"CACHE_PATH",original)
+		with tempfile.TemporaryDirectory() as tempDir:
+			listings.CACHE_PATH = os.path.join(tempDir,"listings.sqlite")
+			listings.clearListings()
+			url = f"{self.base}/listing/"
+			expected = {"2020-01-01":"MERRA2_400.statD_2d_slv_Nx.20200101.nc4","2020-01-02":"MERRA2_400.statD_2d_slv_Nx.20200102.nc4"}
+			self.assertEqual(listings.getListing(url,listings.MERRA2_PATTERN),expected)
+			self.assertEqual(listings.getListing(url,listings.MERRA2_PATTERN),expected)
+			self.assertEqual(self.server.requests.count("/listing/"),1)
+			# a new process reads the listing from disk
+			listings._memory.clear()
+			self.assertEqual(listings.getListing(url,listings.MERRA2_PATTERN),expected)
+			self.assertEqual(self.server.requests.count("/listing/"),1)
+			# ...until it expires
+			self.assertEqual(listings.getListing(url,listings.MERRA2_PATTERN,ttl=0),expected)
+			self.assertEqual(self.server.requests.count("/listing/"),2)
+			self.assertEqual(listings.getListing(f"{self.base}/listing/chirps/",listings.CHIRPS_PATTERNS["chirps"]),{"2020-01-21":"chirps-v2.0.2020.01.3.tif.gz"})
+			self.assertEqual(listings.getListing(f"{self.base}/missing/",listings.MERRA2_PATTERN),{})
+			listings.clearListings()
+
+	def test_getListing_failure(self):
+		from glam_data_processing import availability, listings
+		original = (listings.CACHE_PATH,availability.DEFAULT_BACKOFF)
+		self.addCleanup(setattr,listings,"CACHE_PATH",original[0])
+		self.addCleanup(setattr,availability,"DEFAULT_BACKOFF",original[1])
+		availability.DEFAULT_BACKOFF = 0.01
+		with tempfile.TemporaryDirectory() as tempDir:
+			listings.CACHE_PATH = os.path.join(tempDir,"listings.sqlite")
+			listings.clearListings()
+			# a server error is retried, then reported as an empty listing...
+			with self.assertLogs("glam_data_processing.listings","WARNING"):
+				self.assertEqual(listings.getListing(f"{self.base}/error/",listings.MERRA2_PATTERN),{})
+			self.assertEqual(self.server.requests.count("/error/"),1+availability.DEFAULT_RETRIES)
+			# ...which is not cached
+			with self.assertLogs("glam_data_processing.listings","WARNING"):
+				listings.getListing(f"{self.base}/error/",listings.MERRA2_PATTERN)
+			self.assertEqual(self.server.requests.count("/error/"),2*(1+availability.DEFAULT_RETRIES))
+			listings.clearListings()
+
+	def test_filterAvailable(self):
+		from glam_data_processing.availability import filterAvailable
+		dates = ["2020-01-01","2020-01-02","2020-01-03"]
+		check = lambda product, date: date != "2020-01-02"
+		self.assertEqual(filterAvailable(check,"chirps",dates),["2020-01-01","2020-01-03"])
+
 import glam_data_processing as glam
 
+class TestMerra2Download(FixtureServerTestCase):
+	dates = ["2020-01-05","2020-01-04","2020-01-03","2020-01-02","2020-01-01"]
+
+	def test_compositeDates(self):
+		from glam_data_processing.merra2 import compositeDates
+		self.assertEqual(compositeDates("2020-01-05"),self.dates)
+		self.assertEqual(compositeDates("2020-03-01")[1:3],["2020-02-29","2020-02-28"])
+
+	def test_downloadDays(self):
+		from glam_data_processing.merra2 import downloadDays
+		urls = {d:f"{self.base}/available/{d}.nc4" for d in self.dates}
+		extracted = {}
+		def extract(date, path):
+			extracted[date] = os.path.getsize(path)
+		with tempfile.TemporaryDirectory() as tempDir:
+			downloadDays(urls,tempDir,("user","pass"),extract,streams=2)
+			self.assertEqual(os.listdir(tempDir),[])
+		self.assertEqual(extracted,{d:len(FixtureHandler.body) for d in self.dates})
+		self.assertLessEqual(self.server.peak,2)
+		self.assertGreater(self.server.peak,1)
+
+	def test_downloadDays_failure(self):
+		from glam_data_processing.exceptions import UnavailableError
+		from glam_data_processing.merra2 import downloadDays
+		urls = {d:f"{self.base}/available/{d}.nc4" for d in self.dates}
+		from glam_data_processing import fetch
+		self.addCleanup(setattr,fetch,"BACKOFF",fetch.BACKOFF)
+		fetch.BACKOFF = 0
+		for folder in ("short","missing"):
+			urls[self.dates[2]] = f"{self.base}/{folder}/{self.dates[2]}.nc4"
+			with tempfile.TemporaryDirectory() as tempDir:
+				with self.assertRaises(UnavailableError):
+					downloadDays(urls,tempDir,("user","pass"),lambda date, path: None,streams=2)
+				self.assertEqual(os.listdir(tempDir),[])
+
+class TestFetch(FixtureServerTestCase):
+	def test_download_resumes(self):
+		import hashlib
+		from glam_data_processing import fetch
+		expected = FixtureHandler.resumable
+		with tempfile.TemporaryDirectory() as tempDir:
+			out = os.path.join(tempDir,"file.nc")
+			result = fetch.download(f"{self.base}/resumable/file.nc",out,retries=1,backoff=0,digest=hashlib.sha256(expected).hexdigest())
+			self.assertEqual(result,fetch.Download(out,len(expected),hashlib.sha256(expected).hexdigest(),'"v1"'))
+			with open(out,"rb") as f:
+				self.assertEqual(f.read(),expected)
+			self.assertEqual(os.listdir(tempDir),["file.nc"])
+		# the dropped first half was not sent again, apart from the chunk cut off with it
+		self.assertLess(self.server.sent,len(expected) + fetch.CHUNK_SIZE)
+
+	def test_download_resumes_across_runs(self):
+		from glam_data_processing import fetch
+		expected = FixtureHandler.resumable
+		with tempfile.TemporaryDirectory() as tempDir:
+			out = os.path.join(tempDir,"file.nc")
+			with open(out + ".part","wb") as f:
+				f.write(expected[:300000])
+			with open(out + ".part.validator","w") as f:
+				f.write('"v1"')
+			fetch.download(f"{self.base}/resumable/file.nc",out,retries=0)
+			with open(out,"rb") as f:
+				self.assertEqual(f.read(),expected)
+			self.assertEqual(os.listdir(tempDir),["file.nc"])
+		self.assertEqual(self.server.sent,len(expected) - 300000)
+
+	def test_download_failure(self):
+		from glam_data_processing import fetch
+		from glam_data_processing.exceptions import UnavailableError
+		with tempfile.TemporaryDirectory() as tempDir:
+			out = os.path.join(tempDir,"file.nc")
+			for url, kwargs in ((f"{self.base}/short/file.nc",{}),(f"{self.base}/missing/file.nc",{}),(f"{self.base}/available/file.nc",{"digest":"0"*64}),(f"{self.base}/available/file.nc",{"expected_size":10})):
+				with self.assertRaises(UnavailableError):
+					fetch.download(url,out,retries=1,backoff=0,**kwargs)
+				self.assertEqual(os.listdir(tempDir),[])
+
+	def test_download_cached(self):
+		from glam_data_processing import fetch
+		from glam_data_processing.sourcecache import SourceCache
+		with tempfile.TemporaryDirectory() as tempDir:
+			cache = SourceCache(os.path.join(tempDir,"cache"),max_mb=10)
+			outs = [os.path.join(tempDir,f"file{i}.nc") for i in range(3)]
+			first = fetch.download(f"{self.base}/available/file.nc",outs[0],cache=cache)
+			sent = self.server.sent
+			second = fetch.download(f"{self.base}/available/file.nc",outs[1],cache=cache)
+			self.assertEqual(self.server.sent,sent) # only headers were asked for
+			self.assertEqual(first._replace(path=outs[1]),second)
+			# streamed bodies are cached as they pass
+			chunks, size = fetch.stream(f"{self.base}/resumable/file.tif",cache=cache)
+			self.assertEqual(b"".join(chunks),FixtureHandler.resumable)
+			self.assertEqual(size,len(FixtureHandler.resumable))
+			sent = self.server.sent
+			chunks, size = fetch.stream(f"{self.base}/resumable/file.tif",cache=cache)
+			self.assertEqual(b"".join(chunks),FixtureHandler.resumable)
+			self.assertEqual(self.server.sent,sent)
+			self.assertEqual(len(cache),2)
+
+class TestSourceCache(TestCase):
+	def test_SourceCache(self):
+		import hashlib
+		from glam_data_processing.sourcecache import SourceCache
+		with tempfile.TemporaryDirectory() as tempDir:
+			cache = SourceCache(os.path.join(tempDir,"cache"),max_mb=2.5)
+			payloads = {f"https://example.com/{i}.nc":bytes([i]) * 1000000 for i in range(3)}
+			for i, (url, data) in enumerate(payloads.items()):
+				path = os.path.join(tempDir,f"{i}.nc")
+				with open(path,"wb") as f:
+					f.write(data)
+				cache.put(url,path,hashlib.sha256(data).hexdigest(),f'"{i}"')
+				os.utime(cache.lookup(url)["path"],(i,i)) # ages in order of download
+				if i == 1:
+					self.assertIsNotNone(cache.get("https://example.com/0.nc",'"0"')) # marks 0.nc as recently used
+			# 1.nc was used least recently, so it went to make room for 2.nc
+			self.assertEqual([url in cache for url in payloads],[True,False,True])
+			# a changed version on the server is not reused
+			self.assertIsNone(cache.get("https://example.com/2.nc",'"changed"'))
+			self.assertIsNone(cache.get("https://example.com/2.nc",None,5))
+			self.assertIsNone(cache.get("https://example.com/2.nc"))
+			entry = cache.get("https://example.com/2.nc",None,1000000)
+			with open(entry["path"],"rb") as f:
+				self.assertEqual(f.read(),payloads["https://example.com/2.nc"])
+			# identical content is stored once
+			cache.put("https://mirror.example.com/2.nc",os.path.join(tempDir,"2.nc"),hashlib.sha256(payloads["https://example.com/2.nc"]).hexdigest())
+			self.assertEqual(len(cache),2)
+			cache.clear()
+			self.assertEqual(len(cache),0)
+
+class TestPipeline(TestCase):
+	def test_Pipeline(self):
+		from glam_data_processing.pipeline import Pipeline, Stage
+		lock = threading.Lock()
+		active = {"double":0,"ndvi":0}
+		peak = {"double":0,"ndvi":0}
+		def tracked(name, func):
+			def wrapper(item):
+				key = "ndvi" if item % 3 == 0 else None
+				with lock:
+					active[name] += 1
+					peak[name] = max(peak[name],active[name])
+					if key:
+						active["ndvi"] += 1
+						peak["ndvi"] = max(peak["ndvi"],active["ndvi"])
+				try:
+					time.sleep(0.02)
+					return func(item)
+				finally:
+					with lock:
+						active[name] -= 1
+						if key:
+							active["ndvi"] -= 1
+			return wrapper
+		def half(item):
+			if item == 14:
+				raise ValueError("fourteen")
+			return None if item == 16 else item // 2
+		errors = []
+		stages = [
+			Stage("double",tracked("double",lambda i: i * 2),workers=4,key=lambda i: "ndvi" if i % 3 == 0 else i,limits={"ndvi":1}),
+			Stage("half",half,workers=2)
+			]
+		out = Pipeline(stages,on_error=lambda stage, item, e: errors.append((stage,item))).run(range(12))
+		# 14 fails in the second stage and 16 is dropped there
+		self.assertEqual(sorted(out),[i for i in range(12) if i not in (7,8)])
+		self.assertEqual(errors,[("half",14)])
+		self.assertGreater(peak["double"],1)
+		self.assertEqual(peak["ndvi"],1)
+
+def chronoDates(prod, latest, today):
+	"""The dates ToDoList.refresh() used to find after 'latest', one product at a time"""
+	from datetime import timedelta
+	yearly = {"MOD09Q1":(8,1),"MYD09Q1":(8,1),"MOD13Q1":(16,1),"MYD13Q1":(16,9),"MOD13Q4N":(1,1)}
+	out = []
+	while latest < today:
+		if prod in ("chirps","chirps-prelim"):
+			if latest.day > 12:
+				latest = (latest+timedelta(days=15)).replace(day=1)
+			else:
+				latest = latest+timedelta(days=10)
+		elif prod == "merra-2":
+			latest = latest+timedelta(days=1)
+		elif prod == "swi":
+			latest = latest+timedelta(days=5)
+		else:
+			step, restart = yearly[prod]
+			oldYear = latest.year
+			latest = latest+timedelta(days=step)
+			if latest.year != oldYear:
+				latest = latest.replace(day=restart)
+		out.append(latest.strftime("%Y-%m-%d"))
+	return out
+
+class TestSchedule(TestCase):
+	def setUp(self):
+		from glam_data_processing.legacy import ToDoList, _candidateDates
+		self.ToDoList = ToDoList
+		self.candidateDates = _candidateDates
+
+	def test_candidateDates(self):
+		from datetime import date, timedelta
+		# the last weeks of a year, the turn of the year, and dates on and off each calendar
+		starts = [date(2019,12,1)+timedelta(days=i) for i in range(0,45)]
+		starts += [date(2020,2,23),date(2020,2,29),date(2020,6,9),date(2020,6,25),date(2020,12,18),date(2020,12,26),date(2020,12,31)]
+		for prod, (attr, cadence, step, yearDay, defaultStart) in self.ToDoList.schedule.items():
+			for start in starts:
+				for days in (0,1,9,17,40,400,800):
+					today = start+timedelta(days=days)
+					self.assertEqual(self.candidateDates(start,today,cadence,step,yearDay),chronoDates(prod,start,today),msg=f"{prod} from {start} to {today}")
+		# MODIS composites restart each year: on January 1, or January 9 for MYD13Q1
+		self.assertEqual(self.candidateDates(date(2019,12,19),date(2020,1,20),"yearly",16,1),["2020-01-01","2020-01-17","2020-02-02"])
+		self.assertEqual(self.candidateDates(date(2019,12,19),date(2020,1,20),"yearly",16,9),["2020-01-09","2020-01-25"])
+		self.assertEqual(self.candidateDates(date(2020,1,21),date(2020,3,1),"dekad"),["2020-02-01","2020-02-11","2020-02-21","2020-03-01"])
+		self.assertEqual(self.candidateDates(date(2020,1,1),date(2020,1,1),"fixed",5),[])
+
+	def test_refresh(self):
+		from datetime import date, datetime, timedelta
+		today = datetime.date(datetime.today())
+		latest = {"merra-2":today-timedelta(days=3),"swi":today-timedelta(days=12),"chirps":today-timedelta(days=45),"MOD13Q1":today-timedelta(days=100),"MYD13Q1":today-timedelta(days=400)}
+		incomplete = {"merra-2":[date(2020,1,1),date(2020,1,2)],"MOD13Q1":[date(2020,2,2)]}
+		rows = []
+		for prod, d in latest.items():
+			rows += [(prod,d,m) for m in incomplete.get(prod,[])] or [(prod,d,None)]
+		rows.append(("unknown",today,None))
+		inserted = []
+		statements = []
+		class Connection:
+			def execute(self, statement, params=None):
+				statements.append(str(statement))
+				if str(statement).startswith("SELECT"):
+					return type("Result",(),{"fetchall":lambda self: rows})()
+				if str(statement).startswith("INSERT"):
+					inserted.extend(params)
+		class Engine:
+			def begin(self):
+				from contextlib import nullcontext
+				return nullcontext(Connection())
+		todo = self.ToDoList.__new__(self.ToDoList)
+		todo.engine = Engine()
+		with self.assertLogs("glam_data_processing.legacy","WARNING"):
+			todo.refresh()
+		expected = []
+		for prod, (attr, cadence, step, yearDay, defaultStart) in self.ToDoList.schedule.items():
+			start = latest.get(prod)
+			if start is None and defaultStart is not None:
+				start = datetime.date(datetime.strptime(defaultStart,"%Y.%j"))
+			new = [] if start is None else chronoDates(prod,start,today)
+			self.assertEqual(getattr(todo,attr),[m.strftime("%Y-%m-%d") for m in incomplete.get(prod,[])]+new,msg=prod)
+			expected += [{"product":prod,"date":d} for d in new]
+		self.assertEqual(inserted,expected)
+		# one read and one bulk insert; no sweep over the whole table
+		self.assertEqual([s.split()[0] for s in statements],["SELECT","INSERT"])
+		self.assertEqual(set(p for p, d in todo),set(p for p in self.ToDoList.schedule if getattr(todo,self.ToDoList.schedule[p][0])))
+
+def isolateCatalog(test):
+	"""Points the archive catalog at a temporary file until test's cleanups run, and returns its directory
+
+	Anything that lists product rasters goes through the catalog, whose
+	default file sits next to the package; test rasters must not end up
+	there.
+	"""
+	from glam_data_processing import catalog
+	temp = tempfile.TemporaryDirectory()
+	test.addCleanup(temp.cleanup)
+	test.addCleanup(setattr,catalog,"CATALOG_PATH",catalog.CATALOG_PATH)
+	catalog.CATALOG_PATH = os.path.join(temp.name,"catalog.sqlite")
+	return temp.name
+
+class TestAnomalyBaseline(TestCase):
+	def test_importable(self):
+		# importable without the raster stack, so updateData can call it in-process
+		script = (
+			"import sys\n"
+			"from glam_data_processing.add_file_to_anomaly_baseline import addFileToBaselines\n"
+			"print(','.join(m for m in ('rasterio','numpy','octvi') if m in sys.modules))\n"
+			)
+		out = subprocess.run([sys.executable,"-c",script],cwd=os.path.dirname(os.path.abspath(__file__)),capture_output=True,text=True,check=True).stdout.splitlines()
+		self.assertEqual(out[-1],"")
+
+	def test_getSwiBaselineDoy(self):
+		from types import SimpleNamespace
+		from glam_data_processing.add_file_to_anomaly_baseline import getSwiBaselineDoy
+		self.assertEqual(getSwiBaselineDoy(SimpleNamespace(doy="001")),1)
+		self.assertEqual(getSwiBaselineDoy(SimpleNamespace(doy="013")),11)
+		self.assertEqual(getSwiBaselineDoy(SimpleNamespace(doy="364")),1)
+
+	def test_boundedMap(self):
+		from concurrent.futures import ThreadPoolExecutor
+		from multiprocessing.pool import ThreadPool
+		from glam_data_processing.add_file_to_anomaly_baseline import _boundedMap
+		lock = threading.Lock()
+		counts = {"submitted":0,"yielded":0,"peak":0}
+		def args():
+			for i in range(40):
+				with lock:
+					counts["submitted"] += 1
+					counts["peak"] = max(counts["peak"],counts["submitted"] - counts["yielded"])
+				yield i
+		def square(i):
+			time.sleep(0.002)
+			return i * i
+		for executor in (ThreadPoolExecutor(max_workers=8), ThreadPool(8)):
+			counts.update(submitted=0,yielded=0,peak=0)
+			try:
+				out = []
+				for value in _boundedMap(executor,square,args(),3):
+					with lock:
+						counts["yielded"] += 1
+					out.append(value)
+			finally:
+				if isinstance(executor,ThreadPool):
+					executor.terminate()
+				else:
+					executor.shutdown()
+			self.assertEqual(out,[i * i for i in range(40)])
+			# however many workers the executor has, only three calls are outstanding
+			self.assertLessEqual(counts["peak"],3)
+
+	@skipUnless(importlib.util.find_spec("rasterio"),"rasterio not installed")
+	def test_groupArchive(self):
+		from glam_data_processing import baselines
+		isolateCatalog(self)
+		original = baselines.PRODUCT_DIR
+		self.addCleanup(setattr,baselines,"PRODUCT_DIR",original)
+		with tempfile.TemporaryDirectory() as tempDir:
+			baselines.PRODUCT_DIR = tempDir
+			os.makedirs(os.path.join(tempDir,"chirps"))
+			names = [f"chirps.{y}-{md}.tif" for y in (2010,2011,2012) for md in ("01-01","01-11")] + ["chirps.2012-12-31.tif","chirps.bad.tif","notes.tif"]
+			for name in names:
+				open(os.path.join(tempDir,"chirps",name),"w").close()
+			groups = baselines._groupArchive("chirps")
+			self.assertEqual(sorted(groups),["01-01","01-11"]) # leap day 366 skipped, malformed names ignored
+			self.assertEqual([os.path.basename(f) for f in groups["01-11"]],["chirps.2012-01-11.tif","chirps.2011-01-11.tif","chirps.2010-01-11.tif"])
+
+def maskedMean(stack, dtype="int16"):
+	"""The mean baseline as the original workers compute it, with np.ma"""
+	import numpy as np
+	mean = np.ma.average(stack, axis=0, weights=((stack >= -1000) * (stack <= 10000)))
+	mean[mean.mask==True] = -3000
+	return mean.astype(dtype)
+
+def maskedMedian(stack, dtype="int16"):
+	"""The median baseline as the original workers compute it, with np.ma"""
+	import numpy as np
+	median = np.ma.median(np.ma.masked_outside(stack, -1000, 10000), axis=0)
+	median[median.mask==True] = -3000
+	return median.astype(dtype)
+
+def baselineStack(years, shape=(37,53), seed=0):
+	"""Random int16 years with nodata, out-of-range values, and some pixels never valid"""
+	import numpy as np
+	rng = np.random.default_rng(seed)
+	stack = rng.integers(-1500,10500,(years,)+shape).astype(np.int16)
+	stack[rng.random(stack.shape) < 0.2] = -3000
+	stack[:,0,:5] = -3000
+	return stack
+
+class TestKernels(TestCase):
+	def test_matches_masked(self):
+		import numpy as np
+		from glam_data_processing import kernels
+		for dtype in ("int16","float32","uint8"):
+			for years in (1,2,5,10,11):
+				stack = baselineStack(years).astype(dtype)
+				if dtype == "float32": # values between integers, so halves and rounding are exercised
+					stack[stack > -3000] += 0.37
+				self.assertTrue(np.array_equal(kernels.meanOf(stack,dtype),maskedMean(stack,dtype)),f"mean of {years} {dtype}")
+				self.assertTrue(np.array_equal(kernels.medianOf(stack,dtype),maskedMedian(stack,dtype)),f"median of {years} {dtype}")
+
+	def test_horizons(self):
+		import numpy as np
+		from glam_data_processing import kernels
+		for dtype in ("int16","float32"):
+			stack = baselineStack(23,seed=1).astype(dtype)
+			if dtype == "float32":
+				stack[stack > -3000] += 0.37
+			horizons = [1,2,5,10,11,23]
+			means = kernels.horizonMeans(stack,horizons,dtype)
+			medians = kernels.horizonMedians(stack,horizons,dtype)
+			self.assertEqual(sorted(means),horizons)
+			self.assertEqual(sorted(medians),horizons)
+			for horizon in horizons:
+				self.assertTrue(np.array_equal(means[horizon],maskedMean(stack[:horizon],dtype)),f"{horizon}-year mean of {dtype}")
+				self.assertTrue(np.array_equal(medians[horizon],maskedMedian(stack[:horizon],dtype)),f"{horizon}-year median of {dtype}")
+
+	def test_benchmark(self):
+		from glam_data_processing import kernels
+		# benchmark() checks that the kernels agree with the masked reductions; timings are not compared, as they vary by machine
+		timings = kernels.benchmark(years=10,size=128,repeats=3)
+		self.assertEqual(set(timings),{"np.ma.average","meanOf","np.ma.median","medianOf"})
+
+class TestRunningSums(TestCase):
+	def test_rolling_means(self):
+		import numpy as np
+		from glam_data_processing import kernels
+		stack = baselineStack(15)
+		for horizon in (5,10):
+			sums, counts = kernels.sumCount(stack[:horizon])
+			self.assertTrue(np.array_equal(kernels.meanFromSums(sums,counts,"int16"),maskedMean(stack[:horizon])))
+			# roll forward one year at a time: add the new year, take away the oldest
+			for start in range(1,len(stack)-horizon+1):
+				kernels.addYear(sums,counts,stack[start+horizon-1])
+				kernels.addYear(sums,counts,stack[start-1],sign=-1)
+				self.assertTrue(np.array_equal(kernels.meanFromSums(sums,counts,"int16"),maskedMean(stack[start:start+horizon])))
+
+	def test_planUpdate(self):
+		from glam_data_processing.runningsums import planUpdate
+		with tempfile.TemporaryDirectory() as tempDir:
+			sources = {}
+			for year in range(2008,2020):
+				path = os.path.join(tempDir,f"{year}.tif")
+				open(path,"w").close()
+				sources[year] = [path,os.path.getmtime(path)]
+			stored = {y:sources[y] for y in range(2009,2014)}
+			current = {y:sources[y] for y in range(2010,2015)}
+			self.assertEqual(planUpdate(stored,current),([2014],[2009]))
+			self.assertEqual(planUpdate(stored,dict(stored)),([],[]))
+			self.assertIsNone(planUpdate(None,current))
+			# nothing in common
+			self.assertIsNone(planUpdate(stored,{y:sources[y] for y in range(2015,2020)}))
+			# a kept year was reprocessed since it was summed
+			changed = dict(stored)
+			changed[2012] = [changed[2012][0],changed[2012][1] - 10]
+			self.assertIsNone(planUpdate(changed,current))
+			# the year to take away is gone
+			os.remove(sources[2009][0])
+			self.assertIsNone(planUpdate(stored,current))
+
+	@skipUnless(importlib.util.find_spec("rasterio"),"rasterio not installed")
+	def test_updateMeans(self):
+		import numpy as np
+		import rasterio
+		from rasterio.windows import Window
+		from glam_data_processing import runningsums
+		stack = baselineStack(12,shape=(300,200))
+		profile = {"driver":"GTiff","dtype":"int16","count":1,"width":200,"height":300,"tiled":True,"blockxsize":128,"blockysize":128}
+		windows = [Window(c,r,min(128,200-c),min(128,300-r)) for r in range(0,300,128) for c in range(0,200,128)]
+		with tempfile.TemporaryDirectory() as tempDir:
+			paths = []
+			for i, year in enumerate(range(2008,2020)):
+				paths.append(os.path.join(tempDir,f"{year}.tif"))
+				with rasterio.open(paths[-1],"w",**profile) as dst:
+					dst.write(stack[i],1)
+			outputs = {5:os.path.join(tempDir,"mean_5year.tif"),10:os.path.join(tempDir,"mean_10year.tif")}
+			for latest in (2018,2019): # built from scratch, then updated by one year
+				sources = [(y,paths[y-2008]) for y in range(latest,2007,-1)]
+				with self.assertLogs("glam_data_processing.runningsums","INFO") as logs:
+					runningsums.updateMeans(os.path.join(tempDir,"running"),"test.001",sources,outputs,profile,windows)
+				# the second call adds one year and takes one away, for each horizon
+				action = "Updating" if latest == 2019 else "Rebuilding"
+				self.assertEqual(sum(f"{action} running sums" in line for line in logs.output),len(outputs))
+				if latest == 2019:
+					self.assertTrue(any("adding [2019], removing [2014]" in line for line in logs.output))
+				for horizon, path in outputs.items():
+					with rasterio.open(path) as src:
+						expected = maskedMean(stack[latest-2008-horizon+1:latest-2008+1])
+						self.assertTrue(np.array_equal(src.read(1),expected))
+			self.assertEqual(sorted(runningsums.readSources(runningsums.sidecarPath(os.path.join(tempDir,"running"),"test.001",5))),list(range(2015,2020)))
+
+class TestCatalog(TestCase):
+	def setUp(self):
+		from glam_data_processing import catalog
+		self.catalog = catalog
+		self.tempDir = isolateCatalog(self)
+		self.addCleanup(setattr,catalog,"SETTLE_SECONDS",catalog.SETTLE_SECONDS)
+		catalog.SETTLE_SECONDS = 0
+
+	def test_parseName(self):
+		parseName = self.catalog.parseName
+		self.assertEqual(parseName("/a/MOD13Q1.2019.049.tif"),{"product":"MOD13Q1","collection":"006","year":2019,"doy":49,"date":"2019-02-18"})
+		self.assertEqual(parseName("chirps.2020-03-11.tif"),{"product":"chirps","collection":"0","year":2020,"doy":71,"date":"2020-03-11"})
+		self.assertEqual(parseName("merra-2.2020-01-02.min.tif")["collection"],"Minimum")
+		for bad in ("notes.tif","chirps.bad.tif","MOD13Q1.2019.400.tif","chirps.2020-02-30.tif"):
+			self.assertIsNone(parseName(bad))
+
+	def test_records(self):
+		catalog = self.catalog
+		archive = os.path.join(self.tempDir,"chirps")
+		os.makedirs(archive)
+		def touch(name, size=1):
+			with open(os.path.join(archive,name),"wb") as f:
+				f.write(b"x" * size)
+		for y in range(2010,2016):
+			touch(f"chirps.{y}-01-11.tif")
+			touch(f"chirps.{y}-01-21.tif")
+		touch("chirps.2015-01-11.TEMP.xml")
+		touch("intermediate.tif")
+		os.utime(archive,ns=(10**18,10**18))
+		self.assertEqual(len(catalog.records(archive)),13) # every .tif, parsed or not
+		dekad = catalog.records(archive,product="chirps",month_day="01-11",min_year=2012)
+		self.assertEqual([r.year for r in dekad],[2015,2014,2013,2012])
+		self.assertEqual(catalog.paths(archive,doy=11,max_year=2010),[os.path.join(archive,"chirps.2010-01-11.tif")])
+		self.assertEqual(len(catalog.records(archive,doy=[11,21,300],min_year=2014)),4) # any of several days of year
+		# a file rewritten in place is not looked at while the directory is unchanged
+		touch("chirps.2010-01-11.tif",5)
+		os.utime(archive,ns=(10**18,10**18))
+		self.assertEqual(catalog.records(archive,doy=11,max_year=2010)[0].size,1)
+		# adding or removing a file changes the directory, which is scanned again
+		touch("chirps.2016-01-11.tif")
+		os.remove(os.path.join(archive,"chirps.2011-01-11.tif"))
+		os.utime(archive,ns=(2 * 10**18,2 * 10**18))
+		self.assertEqual([r.year for r in catalog.records(archive,month_day="01-11")],[2016,2015,2014,2013,2012,2010])
+		self.assertEqual(catalog.records(archive,doy=11,max_year=2010)[0].size,5)
+		# kept on disk for the next run
+		import sqlite3
+		with sqlite3.connect(catalog.CATALOG_PATH) as con:
+			self.assertEqual(con.execute("SELECT COUNT(*) FROM files WHERE product = 'chirps';").fetchone()[0],12)
+
+class TestPlanner(TestCase):
+	def setUp(self):
+		from glam_data_processing import planner
+		self.planner = planner
+		original = (planner.WORKER_MB,planner.MAX_BLOCK,planner.cpuLimit)
+		planner.WORKER_MB, planner.MAX_BLOCK = 100, 1024
+		planner.cpuLimit = lambda: 64
+		self.addCleanup(lambda: setattr(planner,"cpuLimit",original[2]))
+		self.addCleanup(setattr,planner,"MAX_BLOCK",original[1])
+		self.addCleanup(setattr,planner,"WORKER_MB",original[0])
+
+	def test_planWindows(self):
+		planner = self.planner
+		pixel_bytes = planner.baselinePixelBytes(10,"int16",4)
+		self.assertGreater(planner.baselinePixelBytes(20,"int16",4),pixel_bytes)
+		# a global 250m MODIS raster with room to spare: largest window allowed, every worker asked for
+		plan = planner.planWindows(172800,67200,pixel_bytes,20,budget_mb=64000)
+		self.assertEqual(plan,planner.Plan(blocksize=1024,workers=20,in_flight=40))
+		# a tighter budget shrinks windows, then workers, and the plan fits it
+		for budget in (8000,3000,2200):
+			plan = planner.planWindows(172800,67200,pixel_bytes,20,budget_mb=budget)
+			self.assertEqual(plan.blocksize % 256,0)
+			peak = plan.workers * 100 * 2**20 + 2 * plan.workers * plan.blocksize**2 * pixel_bytes
+			self.assertLessEqual(peak,budget * 2**20)
+		plan = planner.planWindows(172800,67200,pixel_bytes,20,budget_mb=2200)
+		self.assertLess(plan.workers,20)
+		# windows in flight follow the fitted workers, not the pool asked for; a shared executor is held to this
+		self.assertEqual(plan.in_flight,2 * plan.workers)
+		# a small raster keeps several windows per worker
+		plan = planner.planWindows(1000,1000,pixel_bytes,4,budget_mb=64000)
+		self.assertGreaterEqual((-(-1000 // plan.blocksize)) ** 2,4 * plan.workers)
+		# a fixed window size only fits the workers; never more than the CPUs
+		self.assertEqual(planner.planWindows(172800,67200,pixel_bytes,20,blocksize=2048,budget_mb=64000).blocksize,2048)
+		planner.cpuLimit = lambda: 3
+		self.assertEqual(planner.planWindows(172800,67200,pixel_bytes,20,budget_mb=64000).workers,3)
+
+	def test_memoryBudget(self):
+		planner = self.planner
+		self.assertEqual(planner.memoryBudget(100),100 * 2**20)
+		self.assertGreater(planner.memoryBudget(),0)
+		self.assertGreaterEqual(planner.cpuLimit(),1)
+		self.assertEqual(planner.nativeBlock({"tiled":True,"blockxsize":512}),512)
+		self.assertEqual(planner.nativeBlock({"tiled":False,"blockxsize":172800}),256)
+
+class TestStacks(TestCase):
+	@skipUnless(importlib.util.find_spec("rasterio"),"rasterio not installed")
+	def test_readStack(self):
+		import numpy as np
+		import rasterio
+		from rasterio.windows import Window
+		from glam_data_processing import stacks
+		self.addCleanup(stacks.closeAll)
+		stack = baselineStack(6,shape=(300,200))
+		profile = {"driver":"GTiff","dtype":"int16","count":1,"width":200,"height":300,"tiled":True,"blockxsize":128,"blockysize":128}
+		with tempfile.TemporaryDirectory() as tempDir:
+			paths = [os.path.join(tempDir,f"{i}.tif") for i in range(len(stack))]
+			for path, year in zip(paths,stack):
+				with rasterio.open(path,"w",**profile) as dst:
+					dst.write(year,1)
+			stacks.initWorker(paths)
+			handle = stacks.openDataset(paths[0])
+			window = Window(128,256,72,44)
+			for threads in (None,1):
+				out = stacks.readStack(window,paths,threads=threads)
+				self.assertTrue(np.array_equal(out,stack[:,256:300,128:200]))
+			# datasets stay open between windows
+			self.assertIs(stacks.openDataset(paths[0]),handle)
+			# until the file is rewritten
+			with rasterio.open(paths[0],"w",**profile) as dst:
+				dst.write(stack[1],1)
+			os.utime(paths[0],(0,1))
+			self.assertIsNot(stacks.openDataset(paths[0]),handle)
+			self.assertTrue(np.array_equal(stacks.readStack(window,paths[:1])[0],stack[1,256:300,128:200]))
+			stacks.closeAll()
+
+class TestMerra2Cache(TestCase):
+	def test_DayCache(self):
+		import numpy as np
+		from glam_data_processing.merra2 import DayCache
+		day = {metric:np.full((361,576),i,dtype=np.float32) for i, metric in enumerate(("min","max","mean"))}
+		with tempfile.TemporaryDirectory() as tempDir:
+			dayBytes = 3 * 361 * 576 * 4
+			cache = DayCache(tempDir,max_mb=(2.5 * dayBytes) / (1024 * 1024)) # room for two days
+			self.assertIsNone(cache.get("2020-01-01"))
+			for d in ("2020-01-01","2020-01-02"):
+				cache.put(d,day)
+				time.sleep(0.01)
+			self.assertEqual(len(cache),2)
+			loaded = cache.get("2020-01-01") # now more recently used than 2020-01-02
+			for metric in day.keys():
+				self.assertTrue(np.array_equal(loaded[metric],day[metric]))
+			time.sleep(0.01)
+			cache.put("2020-01-03",day)
+			self.assertIn("2020-01-01",cache)
+			self.assertNotIn("2020-01-02",cache)
+			self.assertIn("2020-01-03",cache)
+			# a day from another source file (reprocessed since) is dropped rather than used
+			cache.put("2020-01-03",day,"MERRA2_400.statD_2d_slv_Nx.20200103.nc4")
+			self.assertIsNotNone(cache.get("2020-01-03","MERRA2_400.statD_2d_slv_Nx.20200103.nc4"))
+			self.assertIsNone(cache.get("2020-01-03","MERRA2_401.statD_2d_slv_Nx.20200103.nc4"))
+			self.assertNotIn("2020-01-03",cache)
+			# as is a day stored without its source, once the source is known
+			self.assertIsNone(cache.get("2020-01-01","MERRA2_400.statD_2d_slv_Nx.20200101.nc4"))
+			cache.put("2020-01-03",day)
+			# a damaged file is dropped rather than used
+			with open(cache._path("2020-01-03"),"wb") as f:
+				f.write(b"not an npz file")
+			self.assertIsNone(cache.get("2020-01-03"))
+			self.assertNotIn("2020-01-03",cache)
+			cache.clear()
+			self.assertEqual(len(cache),0)
+		self.assertIsNone(DayCache("").get("2020-01-01"))
+
+	def test_Composite(self):
+		import numpy as np
+		from glam_data_processing.merra2 import Composite
+		rng = np.random.default_rng(0)
+		days = [{metric:rng.normal(280,15,(361,576)).astype(np.float32) for metric in ("min","max","mean")} for i in range(5)]
+		composite = Composite()
+		for day in days:
+			composite.add(day)
+		self.assertEqual(composite.count,5)
+		self.assertTrue(np.array_equal(composite.result("min"),np.amin(np.dstack([d["min"] for d in days]),axis=2)))
+		self.assertTrue(np.array_equal(composite.result("max"),np.amax(np.dstack([d["max"] for d in days]),axis=2)))
+		expected = np.mean(np.dstack([d["mean"] for d in days]),axis=2)
+		self.assertEqual(composite.result("mean").dtype,np.float32)
+		self.assertTrue(np.allclose(composite.result("mean"),expected,rtol=0,atol=1e-4))
+		# inputs are left untouched
+		self.assertFalse(np.shares_memory(composite.result("min"),days[0]["min"]))
+
+class TestCog(TestCase):
+	def test_overviewLevels(self):
+		from glam_data_processing.cog import overviewLevels
+		self.assertEqual(overviewLevels(256,256),[])
+		self.assertEqual(overviewLevels(257,100),[2])
+		self.assertEqual(overviewLevels(576,361),[2,4])
+		self.assertEqual(overviewLevels(86400,43200),[2,4,8,16,32,64,128,256,512])
+
+	def test_cogProfile(self):
+		from glam_data_processing.cog import cogProfile
+		base = {"driver":"GTiff","dtype":"int16","width":1000,"height":800,"blockxsize":1000,"blockysize":1,"tiled":False}
+		profile = cogProfile(base,blocksize=256,bigtiff=True)
+		self.assertEqual((profile["blockxsize"],profile["blockysize"],profile["tiled"]),(256,256,True))
+		self.assertEqual((profile["predictor"],profile["BIGTIFF"]),(2,"YES"))
+		self.assertEqual(cogProfile(dict(base,dtype="float32"))["predictor"],3)
+		self.assertNotIn("predictor",cogProfile(base,predictor=False))
+		self.assertEqual(base["blockysize"],1) # not changed in place
+
+	@skipUnless(importlib.util.find_spec("gdal") or importlib.util.find_spec("osgeo"),"GDAL not installed")
+	def test_finalizeCogs(self):
+		import numpy as np
+		from glam_data_processing import cog
+		gdal = cog.gdal
+		with tempfile.TemporaryDirectory() as tempDir:
+			paths = {}
+			for i in range(4):
+				temp = os.path.join(tempDir,f"b{i}.TEMP.tif")
+				ds = gdal.GetDriverByName("GTiff").Create(temp,600,500,1,gdal.GDT_Int16,["TILED=YES","BLOCKXSIZE=256","BLOCKYSIZE=256","COMPRESS=LZW"])
+				ds.GetRasterBand(1).WriteArray(np.full((500,600),i,dtype=np.int16))
+				del ds
+				paths[temp] = os.path.join(tempDir,f"b{i}.tif")
+			self.assertEqual(cog.finalizeCogs(paths),tuple(paths.values()))
+			for i, final in enumerate(paths.values()):
+				ds = gdal.Open(final)
+				self.assertEqual(ds.GetRasterBand(1).GetOverviewCount(),2)
+				self.assertEqual(int(ds.ReadAsArray().max()),i)
+				del ds
+			self.assertEqual(glob.glob(os.path.join(tempDir,"*.TEMP.tif")),[])
+			# a missing input fails the whole batch, and nothing is moved
+			with open(os.path.join(tempDir,"c0.TEMP.tif"),"w") as f:
+				f.write("not a tiff")
+			with self.assertRaises(RuntimeError):
+				cog.finalizeCogs({os.path.join(tempDir,"c0.TEMP.tif"):os.path.join(tempDir,"c0.tif")})
+			self.assertFalse(os.path.exists(os.path.join(tempDir,"c0.tif")))
+
+class TestRegrid(TestCase):
+	def test_gather(self):
+		import numpy as np
+		from glam_data_processing.regrid import gather
+		values = np.arange(12,dtype=np.float32).reshape(3,4) * 1.5
+		index = np.array([[0,5,-1],[11,-1,3],[7,7,2]],dtype=np.int32)
+		expected = np.array([[0,7.5,-9999],[16.5,-9999,4.5],[10.5,10.5,3]],dtype=np.float32)
+		for rows in (1,2,512):
+			out = gather(values,index,fill=-9999,block_rows=rows,workers=2)
+			self.assertEqual(out.dtype,np.float32)
+			self.assertTrue(np.array_equal(out,expected))
+
+	@skipUnless(importlib.util.find_spec("gdal") or importlib.util.find_spec("osgeo"),"GDAL not installed")
+	def test_matches_warp(self):
+		import numpy as np
+		from glam_data_processing import cog, regrid
+		gdal = regrid.gdal
+		original = regrid.CACHE_DIR
+		self.addCleanup(setattr,regrid,"CACHE_DIR",original)
+		with tempfile.TemporaryDirectory() as tempDir:
+			regrid.CACHE_DIR = os.path.join(tempDir,"cache")
+			# a coarse global lat/lon grid like merra-2's, with no projection set
+			values = np.random.default_rng(0).normal(280,15,(361,576)).astype(np.float32)
+			for i in range(2): # the index is built on the first pass and reused on the second
+				src = os.path.join(tempDir,f"merra-2.2020-01-0{i+1}.min.tif")
+				ds = gdal.GetDriverByName("GTiff").Create(src,576,361,1,gdal.GDT_Float32)
+				ds.SetGeoTransform((-180.3125, 0.625, 0.0, 90.25, 0.0, -0.5))
+				ds.GetRasterBand(1).WriteArray(values + i)
+				ds.GetRasterBand(1).SetNoDataValue(1E15)
+				del ds
+				warpOut = cog.sinusoidalCog(src,src.replace(".tif",".warp.tif"))
+				indexOut = regrid.sinusoidalCog(src,src.replace(".tif",".index.tif"))
+				a = gdal.Open(warpOut,0)
+				b = gdal.Open(indexOut,0)
+				self.assertEqual(a.GetGeoTransform(),b.GetGeoTransform())
+				self.assertTrue(np.array_equal(a.ReadAsArray(),b.ReadAsArray()))
+				self.assertEqual(a.GetRasterBand(1).GetNoDataValue(),b.GetRasterBand(1).GetNoDataValue())
+				del a, b
+			self.assertEqual(len(glob.glob(os.path.join(regrid.CACHE_DIR,"*.npy"))),1)
+
+class TestDecode(TestCase):
+	@skipUnless(importlib.util.find_spec("gdal") or importlib.util.find_spec("osgeo"),"GDAL not installed")
+	def test_writeVsimem(self):
+		import gzip
+		from glam_data_processing import decode
+		from glam_data_processing.exceptions import UnavailableError
+		gdal = decode.gdal
+		data = os.urandom(300000)
+		zipped = gzip.compress(data[:100000]) + gzip.compress(data[100000:]) # two gzip members
+		chunks = [zipped[i:i+4096] for i in range(0,len(zipped),4096)]
+		path = decode.writeVsimem(iter(chunks),"test.tif",len(zipped),gunzip=True)
+		self.addCleanup(decode.unlink,path)
+		f = gdal.VSIFOpenL(path,"rb")
+		self.assertEqual(gdal.VSIFReadL(1,len(data)+1,f),data)
+		gdal.VSIFCloseL(f)
+		# short downloads fail, and leave nothing behind
+		with self.assertRaises(UnavailableError):
+			decode.writeVsimem(iter([data[:1000]]),"short.tif",len(data))
+		with self.assertRaises(UnavailableError):
+			decode.writeVsimem(iter([zipped[:1000]]),"short.tif.gz",gunzip=True)
+		self.assertEqual([p for p in (gdal.ReadDir("/vsimem/") or []) if "short" in p],[])
+
 class TestFunctionality(TestCase):
+	def setUp(self):
+		# ingest and the baselines list the archive through the catalog
+		isolateCatalog(self)
+
 	def test_ToDoList(self):
 		failure = False
 		try:
@@ -100,6 +1088,7 @@ def main():
 	res = [0,0]
 	try:
 		funcObj = TestFunctionality()
+		funcObj.setUp()
 	except:
 		print("Failed to instantialize TestFunctionality(); exiting")
 		sys.exit()
@@ -118,6 +1107,179 @@ def main():
 		print("test_import: FAILED")
 		res[1] +=1
 
+	timeObj = TestImportTime()
+	for test in (timeObj.test_import_legacy, timeObj.test_import_command_line):
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+
+	availObj = TestAvailability()
+	for test in (availObj.test_checkMany_matches_serial, availObj.test_checkMany_host_limit, availObj.test_checkMany_retries, availObj.test_probe, availObj.test_getListing, availObj.test_getListing_failure, availObj.test_filterAvailable):
+		availObj.setUp()
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+		finally:
+			availObj.tearDown()
+
+	merraObj = TestMerra2Download()
+	for test in (merraObj.test_compositeDates, merraObj.test_downloadDays, merraObj.test_downloadDays_failure):
+		merraObj.setUp()
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+		finally:
+			merraObj.tearDown()
+
+	fetchObj = TestFetch()
+	for test in (fetchObj.test_download_resumes, fetchObj.test_download_resumes_across_runs, fetchObj.test_download_failure, fetchObj.test_download_cached):
+		fetchObj.setUp()
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+		finally:
+			fetchObj.tearDown()
+
+	try:
+		TestSourceCache().test_SourceCache()
+		print("test_SourceCache: PASSED")
+		res[0] += 1
+	except:
+		print("test_SourceCache: FAILED")
+		res[1] +=1
+
+	try:
+		TestPipeline().test_Pipeline()
+		print("test_Pipeline: PASSED")
+		res[0] += 1
+	except:
+		print("test_Pipeline: FAILED")
+		res[1] +=1
+
+	schedObj = TestSchedule()
+	for test in (schedObj.test_candidateDates, schedObj.test_refresh):
+		schedObj.setUp()
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+
+	anomObj = TestAnomalyBaseline()
+	for test in (anomObj.test_importable, anomObj.test_getSwiBaselineDoy, anomObj.test_boundedMap):
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+
+	kernObj = TestKernels()
+	for test in (kernObj.test_matches_masked, kernObj.test_horizons, kernObj.test_benchmark):
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+
+	runObj = TestRunningSums()
+	for test in (runObj.test_rolling_means, runObj.test_planUpdate):
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+
+	catObj = TestCatalog()
+	for test in (catObj.test_parseName, catObj.test_records):
+		catObj.setUp()
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+		finally:
+			catObj.doCleanups()
+
+	planObj = TestPlanner()
+	for test in (planObj.test_planWindows, planObj.test_memoryBudget):
+		planObj.setUp()
+		try:
+			test()
+			print(f"{test.__name__}: PASSED")
+			res[0] += 1
+		except:
+			print(f"{test.__name__}: FAILED")
+			res[1] +=1
+		finally:
+			planObj.doCleanups()
+
+	cacheObj = TestMerra2Cache()
+	try:
+		cacheObj.test_DayCache()
+		print("test_DayCache: PASSED")
+		res[0] += 1
+	except:
+		print("test_DayCache: FAILED")
+		res[1] +=1
+
+	try:
+		cacheObj.test_Composite()
+		print("test_Composite: PASSED")
+		res[0] += 1
+	except:
+		print("test_Composite: FAILED")
+		res[1] +=1
+
+	try:
+		TestCog().test_overviewLevels()
+		print("test_overviewLevels: PASSED")
+		res[0] += 1
+	except:
+		print("test_overviewLevels: FAILED")
+		res[1] +=1
+
+	try:
+		TestCog().test_cogProfile()
+		print("test_cogProfile: PASSED")
+		res[0] += 1
+	except:
+		print("test_cogProfile: FAILED")
+		res[1] +=1
+
+	try:
+		TestRegrid().test_gather()
+		print("test_gather: PASSED")
+		res[0] += 1
+	except:
+		print("test_gather: FAILED")
+		res[1] +=1
+
 	try:
 		funcObj.test_ToDoList()
 		print("test_ToDoList: PASSED")
@@ -150,6 +1312,7 @@ def main():
 		logging.exception("FAILURE")
 		print("test_pullModisFromS3AndImage: FAILED")
 		res[1] +=1
+	funcObj.doCleanups()
 	print("Ran {0} tests | Successes: {1} | Failures: {2}".format(sum(res),*res))
 
 if __name__ == "__main__":